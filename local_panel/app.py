@@ -2,7 +2,7 @@
 IPTV Panel - Main Application
 Professional IPTV management system
 """
-from flask import Flask, render_template, request, redirect, url_for, flash, jsonify, send_file, abort, has_request_context, current_app, session
+from flask import Flask, render_template, request, redirect, url_for, flash, jsonify, send_file, abort, has_request_context, current_app, session, Response, stream_with_context
 from flask_login import LoginManager, login_user, logout_user, login_required, current_user
 from flask_migrate import Migrate
 from datetime import datetime, timedelta
@@ -10,20 +10,28 @@ from functools import wraps
 from pathlib import Path
 import secrets
 import os
-import re
 import json
 import subprocess
 import redis
+import requests
 import hashlib
+from types import SimpleNamespace
+from urllib.parse import urlsplit, urlunsplit
+import click
 from dotenv import load_dotenv
+from sqlalchemy import update as sa_update
 
-from database.models import db, Admin, User, Connection, Channel, SystemLog, Settings, M3USource
+from database.models import db, Admin, User, Connection, Channel, SystemLog, Settings, M3USource, SourceChannel, StreamServer
 
 BASE_DIR = Path(__file__).resolve().parent
 load_dotenv(BASE_DIR / '.env')
 
 from services.streaming import StreamingService
 from services.cloudflare import CloudflareService
+from services import user_import, snapshot, reconcile, placement, m3u, channel_import, source_refresh
+from services.jobs import JobQueue
+from services.purge_queue import PurgeQueue
+from services.import_staging import ImportStaging
 
 app = Flask(__name__)
 app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY', secrets.token_hex(32))
@@ -43,6 +51,16 @@ except Exception as e:
     print(f"⚠ Redis not available: {e}. M3U import will use alternative storage.")
     redis_client = None
 
+# Background queue for streaming/Cloudflare side effects (runs inline without Redis)
+job_queue = JobQueue(redis_client) if redis_client else None
+# Cloudflare purges wait in a shared set and the worker flushes them together
+PURGE_DEBOUNCE = int(os.environ.get('PURGE_DEBOUNCE', '5') or 5)
+purge_queue = PurgeQueue(redis_client, debounce=PURGE_DEBOUNCE,
+                         max_wait=int(os.environ.get('PURGE_MAX_WAIT', '30') or 30)) if redis_client else None
+# Parsed imports wait here between analysis and confirmation (binary chunks, so a non-decoding client)
+import_staging = ImportStaging(redis.from_url(redis_url) if redis_client else None,
+                               os.environ.get('IMPORT_STAGING_DIR') or None)
+
 db.init_app(app)
 migrate = Migrate(app, db)
 login_manager = LoginManager()
@@ -74,34 +92,507 @@ def _log_external(service: str, success: bool, message: str, detail: str = '') -
     SystemLog.log(level, service, entry, _external_ip())
 
 
-def sync_user_with_streaming(user, action: str, plain_password: str | None = None) -> tuple[bool, str]:
-    success, detail = StreamingService.sync_user(user, action, plain_password)
+def sync_user_with_streaming(user, action: str, plain_password: str | None = None,
+                             targets: list[str] | None = None) -> tuple[bool, object]:
+    success, detail = StreamingService.sync_user(user, action, plain_password, targets=targets)
     action_label = f"{action.capitalize()} user {user.username}"
     _log_external('STREAMING', success, action_label, str(detail))
-    return success, str(detail)
+    return success, detail
 
 
-def sync_channel_with_streaming(channel, action: str) -> tuple[bool, str]:
-    success, detail = StreamingService.sync_channel(channel, action)
+def sync_channel_with_streaming(channel, action: str, targets: list[str] | None = None) -> tuple[bool, object]:
+    success, detail = StreamingService.sync_channel(channel, action, targets=targets)
     action_label = f"{action.capitalize()} channel {channel.channel_id}"
     _log_external('STREAMING', success, action_label, str(detail))
+    return success, detail
+
+
+def _purge_urls(urls: list[str], label: str) -> tuple[bool, str]:
+    """Record URLs for the worker's debounced flush, or purge them now when Redis is unavailable."""
+    if purge_queue:
+        try:
+            purge_queue.add(urls)
+            return True, 'queued'
+        except Exception as exc:  # noqa: BLE001
+            current_app.logger.warning("Purge queue unavailable, purging inline: %s", exc)
+    success, detail = CloudflareService.purge_urls_batched(urls)
+    _log_external('CLOUDFLARE', success, f"Purge {label}", str(detail))
     return success, str(detail)
 
 
 def purge_playlist_cache(tokens: list[str], domain: str | None = None) -> tuple[bool, str]:
     domain = domain or Settings.get('stream_domain', request.host if has_request_context() else '')
-    success, detail = CloudflareService.purge_urls(CloudflareService.playlist_urls(domain, tokens))
-    _log_external('CLOUDFLARE', success, f"Purge playlist cache ({', '.join(tokens)})", str(detail))
-    return success, str(detail)
+    label = ', '.join(tokens) if len(tokens) <= 5 else f"{len(tokens)} tokens"
+    return _purge_urls(CloudflareService.playlist_urls(domain, tokens), f"playlist cache ({label})")
 
 
 def purge_channel_cache(channel_id: str, domain: str | None = None) -> tuple[bool, str]:
+    return purge_channels_cache([channel_id], domain)
+
+
+def purge_channels_cache(channel_ids: list[str], domain: str | None = None) -> tuple[bool, str]:
+    """Purge the live URLs of many channels in batched requests with one log entry."""
+    domain = domain or Settings.get('stream_domain', request.host if has_request_context() else '')
+    urls = [url for channel_id in channel_ids for url in CloudflareService.channel_urls(domain, channel_id)]
+    label = ', '.join(channel_ids) if len(channel_ids) <= 5 else f"{len(channel_ids)} channels"
+    return _purge_urls(urls, f"channel cache ({label})")
+
+
+def catalog_version() -> int:
+    try:
+        return int(Settings.get('catalog_version', '1') or 1)
+    except (TypeError, ValueError):
+        return 1
+
+
+def playlist_cache_tags(user) -> str:
+    """``Cache-Tag`` value for a playlist: the catalog version it was built from and its owner."""
+    return f"catalog-v{catalog_version()},user-{user.id}"
+
+
+def invalidate_playlists(reason: str) -> tuple[bool, str]:
+    """Purge every subscriber's cached playlist in one call after a catalog-wide change.
+
+    Bumps the catalog version so new responses carry a fresh tag, then purges the
+    old tag. Zones that cannot purge by tag fall back to purging the playlist
+    URL prefixes.
+    """
+    previous = catalog_version()
+    Settings.set('catalog_version', str(previous + 1))
+    success, detail = CloudflareService.purge_tags([f"catalog-v{previous}"])
+    if not success:
+        domain = Settings.get('stream_domain', request.host if has_request_context() else '')
+        success, detail = CloudflareService.purge_prefixes(CloudflareService.playlist_prefixes(domain))
+    _log_external('CLOUDFLARE', success, f"Invalidate all playlists ({reason})", str(detail))
+    return success, str(detail)
+
+
+def playlist_purge_status(tokens: list[str], domain: str | None = None) -> dict | None:
+    """Pending state of a user's playlist purge, shaped like a job status for the user page."""
+    if not purge_queue:
+        return None
     domain = domain or Settings.get('stream_domain', request.host if has_request_context() else '')
-    success, detail = CloudflareService.purge_urls(CloudflareService.channel_urls(domain, channel_id))
-    _log_external('CLOUDFLARE', success, f"Purge channel cache ({channel_id})", str(detail))
+    try:
+        if not purge_queue.pending(CloudflareService.playlist_urls(domain, tokens)):
+            return None
+        last_flush = purge_queue.stats()['last_flush'] or {}
+    except Exception:  # noqa: BLE001
+        return None
+    if last_flush and not last_flush.get('success'):
+        return {'state': 'retrying', 'attempts': 1, 'updated_at': last_flush['at'],
+                'last_error': last_flush.get('detail')}
+    return {'state': 'queued', 'updated_at': datetime.utcnow().isoformat()}
+
+
+def _merge_targets(old: dict, new: dict, merged: dict) -> dict:
+    """A job limited to some streaming targets widens to all when either side is unrestricted."""
+    merged.pop('targets', None)
+    if old.get('targets') and new.get('targets'):
+        merged['targets'] = list(dict.fromkeys(old['targets'] + new['targets']))
+    return merged
+
+
+def _narrow_to_failed_targets(payload: dict, success: bool, detail) -> None:
+    """Retry a fanned-out sync only on the targets that failed (the queue re-pushes ``payload``)."""
+    failed = StreamingService.failed_targets(detail)
+    if not success and failed:
+        payload['targets'] = failed
+
+
+def _merge_user_sync(old: dict, new: dict) -> dict:
+    """Coalesce two pending user sync jobs into the one that reflects the final state."""
+    if old.get('action') == 'create' and new.get('action') == 'update':
+        return _merge_targets(old, new, {**new, 'action': 'create'})
+    return _merge_targets(old, new, dict(new))
+
+
+def _merge_channel_sync(old: dict, new: dict) -> dict:
+    return _merge_targets(old, new, {**old, **new})
+
+
+def run_user_sync_job(key: str, payload: dict) -> tuple[bool, str]:
+    action = payload.get('action', 'update')
+    if action == 'delete':
+        user = SimpleNamespace(username=payload.get('username'), token=payload.get('token'))
+    else:
+        user = User.query.get(int(key))
+        if not user:
+            return True, 'User no longer exists'
+    success, detail = sync_user_with_streaming(user, action, targets=payload.get('targets'))
+    _narrow_to_failed_targets(payload, success, detail)
+    return success, str(detail)
+
+
+def run_channel_sync_job(key: str, payload: dict) -> tuple[bool, str]:
+    action = payload.get('action', 'update')
+    channel = Channel.query.filter_by(channel_id=key).first()
+    if action == 'delete' or not channel:
+        if action != 'delete':
+            return True, 'Channel no longer exists'
+        channel = SimpleNamespace(channel_id=key)
+    success, detail = sync_channel_with_streaming(channel, action, targets=payload.get('targets'))
+    _narrow_to_failed_targets(payload, success, detail)
+    return success, str(detail)
+
+
+def run_purge_job(key: str, payload: dict) -> tuple[bool, str]:
+    """Move purge jobs queued before the shared purge set existed into it."""
+    if payload.get('channel_id'):
+        return purge_channel_cache(payload['channel_id'], payload.get('domain'))
+    return purge_playlist_cache(payload.get('tokens') or [], payload.get('domain'))
+
+
+def _flush_purges(urls: list[str], stats: dict) -> tuple[bool, str]:
+    success, detail = CloudflareService.purge_urls_batched(urls, stats=stats)
+    _log_external('CLOUDFLARE', success, f"Flush queued purges ({len(urls)} URLs)", str(detail))
     return success, str(detail)
 
 
+def run_purge_flush_job(key: str, payload: dict) -> tuple[bool, str]:
+    if not purge_queue:
+        return True, 'Purge queue unavailable'
+    return purge_queue.flush(_flush_purges, force=bool(payload.get('force')))
+
+
+def dispatch_job(kind: str, key, payload: dict) -> tuple[bool, str]:
+    """Queue a side effect for the worker, or run it inline when Redis is unavailable."""
+    if job_queue:
+        try:
+            job_queue.enqueue(kind, key, payload)
+            return True, 'queued'
+        except Exception as exc:  # noqa: BLE001
+            current_app.logger.warning("Job enqueue failed, running %s inline: %s", kind, exc)
+    handler, _ = JOB_HANDLERS[kind]
+    return handler(str(key), payload)
+
+
+def queue_user_sync(user, action: str) -> tuple[bool, str]:
+    payload = {'action': action}
+    if action == 'delete':
+        payload.update(username=user.username, token=user.token)
+    return dispatch_job('user_sync', user.id, payload)
+
+
+def queue_channel_sync(channel, action: str) -> tuple[bool, str]:
+    return dispatch_job('channel_sync', channel.channel_id, {'action': action})
+
+
+def job_status(kind: str, key) -> dict | None:
+    if not job_queue:
+        return None
+    try:
+        return job_queue.status(kind, key)
+    except Exception:  # noqa: BLE001
+        return None
+
+
+BULK_USER_ACTIONS = ('extend', 'disable', 'enable', 'delete', 'reset_token')
+BULK_USER_CHUNK = 1000
+
+
+def filtered_users_query(search: str = '', status: str = 'all'):
+    """Return the User query matching the users list search box and status filter."""
+    query = User.query
+
+    if search:
+        query = query.filter(
+            (User.username.like(f'%{search}%')) | (User.email.like(f'%{search}%'))
+        )
+
+    if status == 'active':
+        query = query.filter(User.is_active == True, User.expiry_date > datetime.utcnow())
+    elif status == 'expired':
+        query = query.filter(User.expiry_date <= datetime.utcnow())
+    elif status == 'disabled':
+        query = query.filter(User.is_active == False)
+    return query
+
+
+def apply_bulk_user_action(action: str, user_ids: list[int] | None = None, search: str = '',
+                           status: str = 'all', days: int = 30) -> dict:
+    """Apply one action to many users with set-based UPDATEs and batched side effects.
+
+    Targets are either an explicit id list or the users list filter. The database is
+    changed in chunks of BULK_USER_CHUNK ids, then the streaming server receives one
+    bulk sync and Cloudflare receives chunked purges. Returns a per-user report.
+    """
+    if user_ids is not None:
+        query = User.query.filter(User.id.in_(user_ids)) if user_ids else None
+    else:
+        query = filtered_users_query(search, status)
+    targets = query.with_entities(User.id, User.username, User.token).order_by(User.id).all() if query is not None else []
+
+    results = {row.id: {'user_id': row.id, 'username': row.username, 'status': 'ok', 'detail': ''} for row in targets}
+    if user_ids is not None:
+        for missing_id in set(user_ids) - set(results):
+            results[missing_id] = {'user_id': missing_id, 'username': None, 'status': 'not_found', 'detail': 'User not found'}
+
+    ids = [row.id for row in targets]
+    tokens_to_purge = [row.token for row in targets if row.token]
+    now = datetime.utcnow()
+    delta = timedelta(days=days)
+
+    for start in range(0, len(ids), BULK_USER_CHUNK):
+        chunk = ids[start:start + BULK_USER_CHUNK]
+        scope = User.query.filter(User.id.in_(chunk))
+        if action == 'extend':
+            # Same rule as User.extend_subscription: expired users restart from now. One UPDATE,
+            # so a row moved to now + delta is not matched again and extended twice
+            scope.update({User.expiry_date: db.case((User.expiry_date < now, now + delta),
+                                                    else_=User.expiry_date + delta)}, synchronize_session=False)
+        elif action in ('disable', 'enable'):
+            scope.update({User.is_active: action == 'enable'}, synchronize_session=False)
+        elif action == 'reset_token':
+            token_length = get_token_length()
+            new_tokens = [{'id': user_id, 'token': secrets.token_hex(token_length // 2)} for user_id in chunk]
+            db.session.execute(sa_update(User), new_tokens)
+            tokens_to_purge.extend(row['token'] for row in new_tokens)
+        elif action == 'delete':
+            Connection.query.filter(Connection.user_id.in_(chunk)).delete(synchronize_session=False)
+            scope.delete(synchronize_session=False)
+    db.session.commit()
+
+    if action == 'delete':
+        sync_targets = targets
+        sync_action = 'delete'
+    else:
+        sync_targets = []
+        for start in range(0, len(ids), BULK_USER_CHUNK):
+            sync_targets.extend(User.query.filter(User.id.in_(ids[start:start + BULK_USER_CHUNK])).all())
+        sync_action = 'update'
+
+    sync_success, sync_detail = True, 'No users to sync'
+    if sync_targets:
+        sync_success, sync_detail = StreamingService.sync_users_bulk(sync_targets, sync_action)
+        _log_external('STREAMING', sync_success, f"Bulk {sync_action} of {len(sync_targets)} users", str(sync_detail))
+
+        per_user = {}
+        if isinstance(sync_detail, dict) and isinstance(sync_detail.get('results'), list):
+            per_user = {item.get('username'): item for item in sync_detail['results'] if isinstance(item, dict)}
+        by_username = {row.username: row.id for row in targets}
+        for username, user_id in by_username.items():
+            outcome = per_user.get(username)
+            ok = bool(outcome.get('success', True)) if outcome else sync_success
+            if not ok:
+                results[user_id]['status'] = 'sync_failed'
+                results[user_id]['detail'] = str((outcome or {}).get('error') or sync_detail)
+
+    purge_success, purge_detail = True, 'No URLs provided'
+    if tokens_to_purge:
+        purge_success, purge_detail = purge_playlist_cache(tokens_to_purge)
+
+    report_rows = [results[key] for key in sorted(results)]
+    return {
+        'action': action,
+        'matched': len(ids),
+        'succeeded': sum(1 for row in report_rows if row['status'] == 'ok'),
+        'failed': sum(1 for row in report_rows if row['status'] != 'ok'),
+        'results': report_rows,
+        'streaming_sync': {'success': sync_success, 'detail': str(sync_detail)},
+        'cloudflare_purge': {'success': purge_success, 'detail': purge_detail},
+    }
+
+
+def sync_imported_users(rows: list[dict]) -> None:
+    """Push one committed import batch to the streaming server in a single call."""
+    users = [SimpleNamespace(**row) for row in rows]
+    success, detail = StreamingService.sync_users_bulk(users, 'create')
+    _log_external('STREAMING', success, f"Bulk create of {len(users)} imported users", str(detail))
+
+
+def assign_imported_users(rows: list[dict]) -> None:
+    """Give one committed import batch its streaming servers."""
+    servers = available_servers()
+    if not servers:
+        return
+    users = User.query.filter(User.username.in_([row['username'] for row in rows])).all()
+    assign_servers(users, servers)
+    db.session.commit()
+
+
+def import_batch_committed(rows: list[dict]) -> None:
+    assign_imported_users(rows)
+    sync_imported_users(rows)
+
+
+def run_user_import(lines, fmt: str, workers: int | None = None):
+    """Run a bulk user import with the panel's defaults and streaming sync hook."""
+    try:
+        default_days = int(Settings.get('default_expiry_days', '30') or 30)
+    except (TypeError, ValueError):
+        default_days = 30
+    try:
+        default_max_connections = int(Settings.get('default_max_connections', '1') or 1)
+    except (TypeError, ValueError):
+        default_max_connections = 1
+    return user_import.import_users(
+        lines,
+        fmt,
+        default_days=default_days,
+        default_max_connections=default_max_connections,
+        token_length=get_token_length(),
+        workers=workers,
+        on_batch=import_batch_committed,
+    )
+
+
+def load_channel_manifests() -> dict:
+    """Per-target manifests of the channel catalog last pushed to each streaming server."""
+    raw = Settings.get('channel_sync_manifest')
+    try:
+        stored = json.loads(raw) if raw else None
+    except json.JSONDecodeError:
+        stored = None
+    if not isinstance(stored, dict):
+        return {}
+    if 'entries' in stored:
+        # Single-server format from before STREAMING_TARGETS
+        return {StreamingService.target_names()[0]: stored}
+    return stored.get('targets') or {}
+
+
+def save_channel_manifests(manifests: dict) -> None:
+    current = load_channel_manifests()
+    merged = {**current, **manifests}
+    merged = {name: manifest for name, manifest in merged.items() if manifest}
+    if merged != current:
+        Settings.set('channel_sync_manifest', json.dumps({'targets': merged}) if merged else '')
+
+
+def sync_channels_to_streaming(channels) -> tuple[int, int, list, dict]:
+    """Delta-sync a channel catalog to every streaming server and remember what was pushed."""
+    success_count, failure_count, failed_ids, report = StreamingService.sync_channels_delta(
+        channels, load_channel_manifests())
+    save_channel_manifests(report.pop('manifests', {}))
+    return success_count, failure_count, failed_ids, report
+
+
+def catalog_name(source_id) -> str:
+    return f'source-{source_id}'
+
+
+def load_catalog_stages() -> dict:
+    """Per-source record of the catalogs staged on each streaming server: ``{source_id: {target: stage}}``."""
+    raw = Settings.get('channel_catalog_stages')
+    try:
+        stored = json.loads(raw) if raw else {}
+    except json.JSONDecodeError:
+        stored = {}
+    return stored if isinstance(stored, dict) else {}
+
+
+def save_catalog_stage(source_id, staged: dict | None) -> None:
+    """Merge newly staged targets into a source's record; ``None`` forgets the source."""
+    stages = load_catalog_stages()
+    key = str(source_id)
+    if staged is None:
+        stages.pop(key, None)
+    else:
+        stages[key] = {**stages.get(key, {}), **staged}
+    Settings.set('channel_catalog_stages', json.dumps(stages) if stages else '')
+
+
+def stage_source_catalog(source, channels=None, targets=None) -> tuple[bool, str, dict]:
+    """Phase one of an activation: upload the source's catalog to the streaming servers without loading it."""
+    if channels is None:
+        channels = Channel.query.filter(Channel.in_source(source.id)).all()
+    success, detail, staged = StreamingService.stage_catalog(catalog_name(source.id), channels, targets)
+    staged_at = datetime.utcnow().isoformat()
+    save_catalog_stage(source.id, {target: {**stage, 'staged_at': staged_at} for target, stage in staged.items()})
+    _log_external('STREAMING', success, f'Staged catalog of source "{source.name}" ({len(channels)} channels) '
+                  f'on {len(staged)} servers', str(detail))
+    return success, str(detail), staged
+
+
+def switch_active_source(source) -> tuple[bool, dict]:
+    """Phase two of an activation: switch the streaming servers and the panel to ``source`` together.
+
+    Servers whose staged copy is missing or out of date are staged first, so
+    nothing changes anywhere until every server holds the new catalog. All
+    servers then switch to it at once and only after all of them confirmed is
+    the panel's active source committed. When a server or the commit fails,
+    the servers that already switched roll back to their previous catalog and
+    the previous source stays active. Servers whose switch endpoint answers
+    404 or 405 (older streaming servers) do not block the activation: they get
+    the catalog through :func:`sync_channels_to_streaming` after the commit,
+    and ``report['warning']`` names them. Without SSH access to every server
+    only the panel switches, and ``report['warning']`` says so.
+    """
+    started = datetime.utcnow()
+    channels = Channel.query.filter(Channel.in_source(source.id)).all()
+    report = {'channels': len(channels), 'staged': [], 'switched': [], 'error': None, 'warning': None}
+    switch_servers = StreamingService.file_sync_configured()
+    if not switch_servers and StreamingService.is_configured():
+        report['warning'] = 'streaming server SSH access is not configured, so the servers were not switched'
+
+    if switch_servers:
+        manifest = StreamingService.catalog_manifest(channels)
+        staged = load_catalog_stages().get(str(source.id), {})
+        targets = StreamingService.target_names()
+        stale = [target for target in targets if (staged.get(target) or {}).get('digest') != manifest['digest']]
+        if stale:
+            success, detail, fresh = stage_source_catalog(source, channels, stale)
+            staged.update(fresh)
+            report['staged'] = sorted(fresh)
+            if not success:
+                report['error'] = f'Staging failed: {detail}'
+                return False, report
+
+        success, detail, switched, unsupported = StreamingService.switch_catalog(catalog_name(source.id), staged,
+                                                                                 targets)
+        report['switched'] = switched
+        # Servers without the switch endpoint get the catalog by delta sync once the panel switched
+        legacy_servers = [target for target in targets if target not in switched]
+        if not success and legacy_servers and set(legacy_servers) <= set(unsupported):
+            success = True
+        else:
+            legacy_servers = []
+        if not success:
+            # Stage again next time rather than trusting a copy a server may have lost
+            save_catalog_stage(source.id, None)
+            rolled_back, rollback_detail = StreamingService.rollback_catalog(manifest['digest'], switched)
+            report['error'] = f'Switch failed: {detail}'
+            if not rolled_back:
+                report['error'] += f'; rollback failed: {rollback_detail}'
+            _log_external('STREAMING', False, f'Switch to source "{source.name}" rolled back on {len(switched)} servers',
+                          report['error'])
+            return False, report
+
+    try:
+        M3USource.query.filter(M3USource.id != source.id).update({'is_active': False})
+        source.is_active = True
+        db.session.commit()
+    except Exception as exc:  # noqa: BLE001
+        db.session.rollback()
+        report['error'] = f'Activation could not be saved: {exc}'
+        if switch_servers:
+            StreamingService.rollback_catalog(manifest['digest'], report['switched'])
+        return False, report
+
+    if switch_servers:
+        # Later delta syncs start from the catalog the servers now hold
+        save_channel_manifests({target: manifest for target in report['switched']})
+    if switch_servers and legacy_servers:
+        synced, failed, _, _ = sync_channels_to_streaming(channels)
+        report['warning'] = (f'{", ".join(legacy_servers)} cannot switch catalogs and were delta-synced instead '
+                             f'({synced} channels synced, {failed} failed)')
+    report['seconds'] = round((datetime.utcnow() - started).total_seconds(), 2)
+    return True, report
+
+
+def run_catalog_stage_job(key: str, payload: dict) -> tuple[bool, str]:
+    """Stage an inactive source's catalog on the streaming servers ahead of its activation."""
+    source = M3USource.query.get(int(key))
+    if not source:
+        return True, 'Source no longer exists'
+    if source.is_active:
+        return True, f'Source "{source.name}" is already active'
+    if not StreamingService.file_sync_configured():
+        return True, 'Streaming server SSH access not configured'
+    success, detail, staged = stage_source_catalog(source)
+    return success, f'Staged source "{source.name}" on {len(staged)} servers' if success else detail
+
+
 def get_allowed_categories() -> list[str]:
     raw = Settings.get('m3u_allowed_categories')
     if not raw:
@@ -133,6 +624,101 @@ def channel_stream_template() -> str:
     return template
 
 
+def available_servers() -> list:
+    return [server for server in StreamServer.query.filter_by(is_active=True).all() if server.is_available()]
+
+
+def _ring_choice(ring, servers: dict, user_id: int):
+    """First server on the hash ring for ``user_id`` whose heartbeat load is below its capacity."""
+    chosen = next((servers[server_id] for server_id in ring.candidates(str(user_id))
+                   if (servers[server_id].current_load or 0) < (servers[server_id].capacity or 0)), None)
+    return chosen or servers[ring.lookup(str(user_id))]
+
+
+def assign_servers(users: list, servers: list | None = None) -> None:
+    """Store a streaming server for each user that has none yet (the caller commits).
+
+    Called when users are created or imported; users need their id, so flush first.
+    """
+    servers = {server.id: server for server in (available_servers() if servers is None else servers)}
+    if not servers:
+        return
+    ring = placement.ring_for({server_id: server.capacity for server_id, server in servers.items()})
+    for user in users:
+        if user.server_id is None:
+            user.server_id = _ring_choice(ring, servers, user.id).id
+
+
+def server_for_user(user, servers: list | None = None):
+    """Return the streaming server a subscriber's stream URLs should point at.
+
+    Uses the stored assignment while that server is available. Otherwise, for
+    unassigned users and users of a server that is down or draining, the hash
+    ring picks a server for this request only; nothing is stored on this read
+    path. Assignments are made on create/import and by ``flask servers-rebalance``.
+    """
+    servers = {server.id: server for server in (available_servers() if servers is None else servers)}
+    if not servers:
+        return None
+    if user.server_id in servers:
+        return servers[user.server_id]
+    ring = placement.ring_for({server_id: server.capacity for server_id, server in servers.items()})
+    return _ring_choice(ring, servers, user.id)
+
+
+def stream_template_for_server(server) -> str:
+    """Channel URL template with its host pointed at ``server`` (``{SERVER}`` or the URL host)."""
+    template = channel_stream_template()
+    if server is None:
+        if '{SERVER}' in template:
+            return template.replace('{SERVER}', Settings.get('stream_domain', request.host if has_request_context() else 'stream.local'))
+        return template
+    if '{SERVER}' in template:
+        return template.replace('{SERVER}', server.domain)
+    parts = urlsplit(template)
+    if not parts.netloc:
+        return template
+    return urlunsplit(parts._replace(netloc=server.domain))
+
+
+def rebalance_servers(dry_run: bool = False) -> dict:
+    """Re-plan active subscribers over the available servers and move those whose server changed.
+
+    Users keep their current server while it is available and below its bounded
+    share, so only unassigned users, users of down or draining servers and the
+    overflow of overloaded servers move. Moved users' cached playlists are purged.
+    """
+    servers = available_servers()
+    rows = db.session.query(User.id, User.server_id, User.token).filter(User.is_active == True).all()
+    planned = placement.plan((str(row.id) for row in rows), {server.id: server.capacity for server in servers},
+                             current={str(row.id): row.server_id for row in rows if row.server_id is not None})
+
+    moves: dict[int, list[int]] = {}
+    tokens = []
+    for row in rows:
+        server_id = planned.get(str(row.id))
+        if server_id is not None and server_id != row.server_id:
+            moves.setdefault(server_id, []).append(row.id)
+            tokens.append(row.token)
+
+    names = {server.id: server.name for server in servers}
+    counts: dict[str, int] = {}
+    for server_id in planned.values():
+        counts[names[server_id]] = counts.get(names[server_id], 0) + 1
+    report = {'users': len(rows), 'moved': len(tokens), 'planned': counts, 'dry_run': dry_run}
+    if dry_run or not tokens:
+        return report
+
+    for server_id, user_ids in moves.items():
+        for start in range(0, len(user_ids), BULK_USER_CHUNK):
+            User.query.filter(User.id.in_(user_ids[start:start + BULK_USER_CHUNK])).update(
+                {User.server_id: server_id}, synchronize_session=False)
+    db.session.commit()
+    SystemLog.log('INFO', 'STREAMING', f"Rebalanced subscribers: moved {len(tokens)} of {len(rows)} ({counts})")
+    purge_playlist_cache(tokens)
+    return report
+
+
 def streaming_playlist_template() -> str:
     stream_domain = Settings.get('stream_domain', request.host if has_request_context() else 'stream.local')
     default = f"https://{stream_domain}/get_playlist.php?token={{TOKEN}}"
@@ -160,34 +746,90 @@ def panel_playlist_url(token: str) -> str:
     return f"/playlist/{token}.m3u8"
 
 
-def sync_channels_from_streaming(force: bool = False) -> None:
-    """Pull the channel catalog from the streaming API and mirror it locally."""
+CHANNEL_PULL_BATCH = 1000
+# Without a server cursor, the next pull asks for changes since the server's clock minus this
+# margin, so clock skew and changes made while the pull ran are not skipped
+CHANNEL_PULL_CURSOR_MARGIN = timedelta(minutes=5)
+# Optional pulled fields that fall back to the model default on insert
+CHANNEL_PULL_DEFAULTED = ('quality', 'view_count', 'is_active')
+
+
+def _dialect_insert():
+    """Return the dialect-specific INSERT construct that supports ON CONFLICT."""
+    if db.engine.dialect.name == 'postgresql':
+        from sqlalchemy.dialects.postgresql import insert
+    else:
+        from sqlalchemy.dialects.sqlite import insert
+    return insert
+
+
+def upsert_channels(rows: list[dict]) -> int:
+    """Apply pulled channel records with INSERT ... ON CONFLICT (channel_id) DO UPDATE.
+
+    Optional fields that the streaming API left out keep the stored value on update.
+    Rows are grouped by which of quality, view_count and is_active they lack, so new
+    rows get the model defaults for those in the INSERT itself. Returns the number
+    of inserted or changed rows.
+    """
+    insert = _dialect_insert()
+    groups: dict[tuple, list[dict]] = {}
+    for row in rows:
+        missing = tuple(column for column in CHANNEL_PULL_DEFAULTED if row.get(column) is None)
+        groups.setdefault(missing, []).append({key: value for key, value in row.items() if key not in missing})
+
+    changed = 0
+    for missing, group in groups.items():
+        for start in range(0, len(group), CHANNEL_PULL_BATCH):
+            stmt = insert(Channel).values(group[start:start + CHANNEL_PULL_BATCH])
+            new = stmt.excluded
+            keep_name = new.name == new.channel_id
+            updates = {
+                'name': db.case((keep_name, Channel.name), else_=new.name),
+                'source_url': db.func.coalesce(db.func.nullif(new.source_url, ''), Channel.source_url),
+                'category': new.category,
+                'logo_url': db.func.coalesce(new.logo_url, Channel.logo_url),
+                'quality': new.quality,
+                'epg_id': db.func.coalesce(new.epg_id, Channel.epg_id),
+                'view_count': new.view_count,
+                'is_active': new.is_active,
+            }
+            for column in missing:
+                del updates[column]
+            # Skip rows whose stored values would not change, so unchanged records cost no writes
+            differs = db.or_(*(getattr(Channel, column).is_distinct_from(value) for column, value in updates.items()))
+            result = db.session.execute(stmt.on_conflict_do_update(index_elements=['channel_id'], set_=updates, where=differs))
+            changed += max(result.rowcount or 0, 0)
+
+    db.session.commit()
+    return changed
+
+
+def sync_channels_from_streaming(force: bool = False) -> str:
+    """Pull channel changes from the streaming API and upsert them locally.
+
+    Uses the stored ETag and ``updated_since`` cursor, so an unchanged catalog costs
+    a single conditional request. ``force`` ignores both and re-reads everything.
+    """
     if not StreamingService.is_configured():
-        return
+        return 'Streaming API not configured'
 
-    last_sync_raw = Settings.get('channel_sync_timestamp')
-    if not force and last_sync_raw:
-        try:
-            last_sync = datetime.fromisoformat(last_sync_raw)
-        except ValueError:
-            last_sync = None
-        if last_sync and datetime.utcnow() - last_sync < timedelta(minutes=5):
-            return
+    try:
+        state = json.loads(Settings.get('channel_pull_state') or '{}')
+    except json.JSONDecodeError:
+        state = {}
 
-    success, payload = StreamingService.fetch_channels()
+    started_at = datetime.utcnow().isoformat()
+    success, records, meta = StreamingService.fetch_channel_changes(
+        etag=None if force else state.get('etag'),
+        updated_since=None if force else state.get('cursor'),
+    )
     if not success:
-        current_app.logger.warning("Channel sync failed: %s", payload)
-        return
+        current_app.logger.warning("Channel sync failed: %s", records)
+        raise RuntimeError(f"Channel sync failed: {records}")
 
-    records = []
-    if isinstance(payload, dict):
-        records = payload.get('channels') or []
-    elif isinstance(payload, list):
-        records = payload
-
-    if not isinstance(records, list):
-        current_app.logger.warning("Channel sync payload unexpected: %s", type(payload))
-        return
+    if meta['not_modified']:
+        Settings.set('channel_sync_timestamp', started_at)
+        return 'Channel catalog not modified'
 
     def _truncate(text: str | None, limit: int) -> str | None:
         if text is None:
@@ -195,10 +837,7 @@ def sync_channels_from_streaming(force: bool = False) -> None:
         text = str(text)
         return text if len(text) <= limit else text[:limit]
 
-    existing = {channel.channel_id: channel for channel in Channel.query.all()}
-    seen = set()
-    changed = False
-
+    rows = {}
     for item in records:
         if not isinstance(item, dict):
             continue
@@ -206,62 +845,378 @@ def sync_channels_from_streaming(force: bool = False) -> None:
         if not channel_id:
             continue
         channel_id = _truncate(channel_id, 50)
-        seen.add(channel_id)
-        channel = existing.get(channel_id)
-        if not channel:
-            channel = Channel(channel_id=channel_id)
-            db.session.add(channel)
-            existing[channel_id] = channel
-            changed = True
-
-        name = _truncate(item.get('name'), 100) or channel.name or channel_id
-        if channel.name != name:
-            channel.name = name
-            changed = True
-
-        source_url = item.get('source_url') or item.get('resolved_source_url')
-        source_url = _truncate(source_url, 500) or channel.source_url
-        if source_url and channel.source_url != source_url:
-            channel.source_url = source_url
-            changed = True
-
-        category = _truncate(item.get('category') or 'General', 50)
-        if category and channel.category != category:
-            channel.category = category
-            changed = True
-
-        logo = _truncate(item.get('logo') or item.get('logo_url'), 500)
-        if logo and channel.logo_url != logo:
-            channel.logo_url = logo
-            changed = True
-
-        quality = _truncate(item.get('quality'), 20)
-        if quality and channel.quality != quality:
-            channel.quality = quality
-            changed = True
-
-        epg_id = _truncate(item.get('epg_id'), 100)
-        if epg_id and channel.epg_id != epg_id:
-            channel.epg_id = epg_id
-            changed = True
 
         view_count = item.get('view_count')
         try:
             view_value = int(view_count) if view_count is not None else None
         except (TypeError, ValueError):
             view_value = None
-        if view_value is not None and channel.view_count != view_value:
-            channel.view_count = view_value
-            changed = True
-
         is_active = item.get('is_active')
-        if is_active is not None and channel.is_active != bool(is_active):
-            channel.is_active = bool(is_active)
-            changed = True
 
-    if changed:
+        rows[channel_id] = {
+            'channel_id': channel_id,
+            'name': _truncate(item.get('name'), 100) or channel_id,
+            'source_url': _truncate(item.get('source_url') or item.get('resolved_source_url'), 500) or '',
+            'category': _truncate(item.get('category') or 'General', 50),
+            'logo_url': _truncate(item.get('logo') or item.get('logo_url'), 500) or None,
+            'quality': _truncate(item.get('quality'), 20) or None,
+            'epg_id': _truncate(item.get('epg_id'), 100) or None,
+            'view_count': view_value,
+            'is_active': bool(is_active) if is_active is not None else None,
+        }
+
+    changed = upsert_channels(list(rows.values())) if rows else 0
+    cursor = meta.get('cursor') or ((meta.get('server_time') or datetime.fromisoformat(started_at))
+                                    - CHANNEL_PULL_CURSOR_MARGIN).isoformat()
+    Settings.set('channel_pull_state', json.dumps({'etag': meta.get('etag'), 'cursor': cursor}))
+    Settings.set('channel_sync_timestamp', started_at)
+    return f'Pulled {len(rows)} channel records, {changed} inserted or changed'
+
+
+def run_channel_pull_job(key: str, payload: dict) -> tuple[bool, str]:
+    return True, sync_channels_from_streaming(force=bool(payload.get('force')))
+
+
+USER_SNAPSHOT_PATH = Path(os.environ.get('USER_SNAPSHOT_PATH') or BASE_DIR / 'instance' / 'users.snap')
+
+
+def publish_user_snapshot(full: bool = False, push: bool = True) -> str:
+    """Regenerate the binary subscriber snapshot and push it when it changed.
+
+    The Settings key ``user_snapshot_state`` remembers the checksum and the
+    streaming targets that accepted it, so a failed push is retried (on the
+    failed targets only) even if nothing changed since. Targets without SSH
+    access are skipped.
+    """
+    report = snapshot.regenerate(USER_SNAPSHOT_PATH, full=full)
+    summary = (f"{report['mode']} snapshot of {report['count']} users "
+               f"({report['changed']} changed, {report['removed']} removed, {report['bytes']} bytes)")
+    if not push:
+        return summary
+
+    try:
+        state = json.loads(Settings.get('user_snapshot_state') or '{}')
+    except json.JSONDecodeError:
+        state = {}
+    accepted = (state.get('targets') or []) if state.get('sha256') == report['sha256'] else []
+    # Servers without SSH access cannot receive the file; they are skipped, not failed
+    reachable = StreamingService.file_sync_targets()
+    if not reachable:
+        return f"{summary}; no streaming server with SSH access, not pushed"
+    pending = [name for name in reachable if name not in accepted]
+    if not pending:
+        return f"{summary}; already on the streaming servers"
+
+    meta = {'version': snapshot.VERSION, 'count': report['count'], 'sha256': report['sha256'],
+            'generated_at': report['generated_at']}
+    success, detail, timings = StreamingService.push_user_snapshot(USER_SNAPSHOT_PATH.read_bytes(), meta,
+                                                                   targets=pending)
+    failed = StreamingService.failed_targets(detail) or ([] if success else pending)
+    accepted += [name for name in pending if name not in failed]
+    Settings.set('user_snapshot_state', json.dumps({**meta, 'targets': accepted,
+                                                    'pushed_at': datetime.utcnow().isoformat()}))
+    if not success:
+        raise RuntimeError(f"User snapshot push failed: {detail}")
+    SystemLog.log('INFO', 'STREAMING', f"Pushed {summary} to {', '.join(pending)} (timings ms: {timings})")
+    return f"{summary}; pushed"
+
+
+def run_user_snapshot_job(key: str, payload: dict) -> tuple[bool, str]:
+    return True, publish_user_snapshot(full=bool(payload.get('full')))
+
+
+RECONCILE_BUCKETS = int(os.environ.get('RECONCILE_BUCKETS', reconcile.DEFAULT_BUCKETS) or reconcile.DEFAULT_BUCKETS)
+
+
+def run_reconciliation(repair: bool = True) -> dict:
+    """Compare users and active-source channels with every streaming server and fix drift.
+
+    The outcome is kept in the Settings key ``reconcile_state`` for the status API.
+    """
+    if not StreamingService.is_configured():
+        return {'error': 'Streaming API not configured'}
+
+    state = {'checked_at': datetime.utcnow().isoformat(), 'repair': repair, 'targets': {}}
+    active_source_id = get_active_source_id()
+    channels = Channel.query.filter(Channel.in_source(active_source_id)).all() if active_source_id else None
+
+    for target in StreamingService.target_names():
+        target_state = state['targets'][target] = {}
+        try:
+            target_state['users'] = reconcile.reconcile_users(RECONCILE_BUCKETS, repair=repair, target=target)
+        except RuntimeError as exc:
+            target_state['users'] = {'error': str(exc)}
+        if channels is not None:
+            try:
+                result = reconcile.reconcile_channels(channels, RECONCILE_BUCKETS, repair=repair, target=target)
+            except RuntimeError as exc:
+                result = {'error': str(exc)}
+            if 'manifest' in result:
+                save_channel_manifests({target: result.pop('manifest')})
+            target_state['channels'] = result
+
+        drift = {kind: target_state[kind]['drift'] for kind in ('users', 'channels')
+                 if target_state.get(kind, {}).get('drift')}
+        if drift:
+            repaired = {kind: target_state[kind].get('repaired', 0) for kind in drift}
+            SystemLog.log('WARNING', 'STREAMING', f"Reconciliation found drift on {target}: {drift}"
+                          + (f", repaired {repaired}" if repair else ''))
+
+    Settings.set('reconcile_state', json.dumps(state))
+    return state
+
+
+def run_reconcile_job(key: str, payload: dict) -> tuple[bool, str]:
+    state = run_reconciliation(repair=payload.get('repair', True))
+    if 'error' in state:
+        return False, state['error']
+    errors = [f"{target}: {result[kind]['error']}" for target, result in state['targets'].items()
+              for kind in ('users', 'channels') if 'error' in result.get(kind, {})]
+    if errors:
+        return False, '; '.join(errors)
+    return True, json.dumps({target: {kind: result[kind].get('drift') for kind in result}
+                             for target, result in state['targets'].items()})
+
+
+# Staged playlists outlive the confirm step so a failed import job can still be resumed
+IMPORT_RESUME_TTL = int(os.environ.get('IMPORT_RESUME_TTL', '86400') or 86400)
+IMPORT_PROGRESS_TTL = 7 * 24 * 3600
+
+
+def _import_progress_key(source_id) -> str:
+    return f'm3u_import:{source_id}'
+
+
+def save_import_checkpoint(source, checkpoint: dict, status: str | None = None) -> None:
+    """Commit an import checkpoint together with the batch it describes and publish it for polling."""
+    if status:
+        source.import_status = status
+    checkpoint.update(status=source.import_status, updated_at=datetime.utcnow().isoformat())
+    source.import_checkpoint = json.dumps(checkpoint)
+    db.session.commit()
+    if redis_client:
+        try:
+            redis_client.setex(_import_progress_key(source.id), IMPORT_PROGRESS_TTL, json.dumps(checkpoint))
+        except Exception as exc:  # noqa: BLE001
+            current_app.logger.warning("Could not publish import progress: %s", exc)
+
+
+def import_progress(source) -> dict:
+    """Latest checkpoint of a background import, from Redis when available."""
+    if redis_client:
+        try:
+            raw = redis_client.get(_import_progress_key(source.id))
+            if raw:
+                return json.loads(raw)
+        except Exception:  # noqa: BLE001
+            pass
+    return source.import_progress
+
+
+def _run_m3u_import(source, checkpoint: dict) -> str:
+    import_id = checkpoint.get('import_id')
+    total = checkpoint.get('total', 0)
+    done = checkpoint.get('imported', 0) + checkpoint.get('shared', 0) + checkpoint.get('skipped', 0)
+    checkpoint.pop('error', None)
+
+    if done < total:
+        staged = import_staging.meta(import_id)
+        if not staged:
+            raise LookupError('The staged playlist expired, please import it again')
+        save_import_checkpoint(source, checkpoint, 'importing')
+        base = {name: checkpoint.get(name, 0) for name in ('imported', 'shared', 'skipped', 'batches')}
+        mapping = json.loads(source.field_mapping or '{}')
+
+        def on_batch(stats: dict) -> None:
+            checkpoint.update({name: base[name] + stats[name] for name in base}, engine=stats['engine'])
+            save_import_checkpoint(source, checkpoint)
+
+        # Entries before the checkpoint were committed by an earlier attempt
+        stats = channel_import.import_channels(import_staging.entries(import_id, staged, start=done), source.id,
+                                               mapping, total=total - done, on_batch=on_batch)
+        checkpoint.update(seconds=round(checkpoint.get('seconds', 0) + stats['seconds'], 2), rate=stats['rate'])
+        save_import_checkpoint(source, checkpoint)
+
+    if checkpoint.get('activate') and not checkpoint.get('synced_at'):
+        save_import_checkpoint(source, checkpoint, 'syncing')
+        if source.is_active:
+            channels = Channel.query.filter(Channel.in_source(source.id)).all()
+            success, report = True, {'channels': len(channels), 'switched': []}
+        else:
+            SystemLog.log('INFO', 'M3U_IMPORT', f'Staging and switching to source "{source.name}"...')
+            success, report = switch_active_source(source)
+        if not success:
+            # The import itself is complete; the previous source stays active
+            checkpoint.update(synced=0, sync_failed=report['channels'], failed_ids=[], sync_error=report['error'][:500])
+            SystemLog.log('ERROR', 'M3U_IMPORT', f'Activation of source "{source.name}" failed: {report["error"]}')
+        else:
+            SystemLog.log('INFO', 'M3U_IMPORT',
+                f'Switched {len(report["switched"])} streaming servers to source "{source.name}" '
+                f'({report["channels"]} channels)')
+            if report.get('warning'):
+                SystemLog.log('WARNING', 'M3U_IMPORT', f'Source "{source.name}" activated: {report["warning"]}')
+            checkpoint.update(synced=report['channels'], sync_failed=0, failed_ids=[])
+            purge_success, purge_detail = purge_channels_cache(
+                [channel_id for (channel_id,) in db.session.query(Channel.channel_id).filter(Channel.in_source(source.id))])
+            if not purge_success:
+                checkpoint['purge_error'] = str(purge_detail)[:500]
+            invalidate_playlists(f'source "{source.name}" imported')
+        checkpoint['synced_at'] = datetime.utcnow().isoformat()
+    elif not checkpoint.get('activate') and not source.is_active and StreamingService.file_sync_configured():
+        # Stage ahead of time so a later activation only has to switch
+        success, detail, staged = stage_source_catalog(source)
+        if not success:
+            checkpoint['stage_error'] = detail[:500]
+
+    source.total_channels = checkpoint.get('imported', 0) + checkpoint.get('shared', 0)
+    save_import_checkpoint(source, checkpoint, 'done')
+    try:
+        import_staging.delete(import_id)
+    except Exception as exc:  # noqa: BLE001
+        current_app.logger.error(f"Import staging cleanup failed: {exc}")
+
+    summary = (f'Created source "{source.name}" with {source.total_channels} channels '
+               f'({checkpoint.get("imported", 0)} new, {checkpoint.get("shared", 0)} shared with other sources) in '
+               f'{checkpoint.get("seconds", 0)}s ({checkpoint.get("rate", 0)} channels/sec, '
+               f'{checkpoint.get("engine", "insert")} engine, {checkpoint.get("batches", 0)} batches, '
+               f'{checkpoint.get("skipped", 0)} duplicates skipped)')
+    SystemLog.log('INFO', 'M3U_SOURCE', summary)
+    return summary
+
+
+def run_m3u_import_job(key: str, payload: dict) -> tuple[bool, str]:
+    """Import a staged playlist into its source, committing a checkpoint with every batch.
+
+    Running the job again (a retry or the Resume button) continues after the
+    last committed batch; a source that was already synced is not synced twice.
+    """
+    source = M3USource.query.get(int(key))
+    if not source:
+        return True, 'Source no longer exists'
+    if source.import_status == 'done':
+        return True, 'Already imported'
+    try:
+        return True, _run_m3u_import(source, source.import_progress)
+    except Exception as exc:  # noqa: BLE001
+        db.session.rollback()
+        current_app.logger.exception("M3U import of source %s failed", key)
+        checkpoint = source.import_progress
+        checkpoint['error'] = str(exc)[:500]
+        save_import_checkpoint(source, checkpoint, 'failed')
+        SystemLog.log('ERROR', 'M3U_IMPORT', f'Import into source "{source.name}" failed after '
+                      f'{checkpoint.get("imported", 0)} channels: {exc}')
+        return False, str(exc)
+
+
+def refresh_m3u_source(source, force: bool = False) -> tuple[bool, str]:
+    """Re-fetch a URL-backed source and apply the diff; the streaming server is only synced for the active source."""
+    try:
+        report = source_refresh.refresh(source, force=force)
+        source.refresh_status = {
+            'not_modified': 'Not modified',
+            'unchanged': 'Unchanged',
+        }.get(report['status']) or f'+{report["added"]} ~{report["changed"]} -{report["removed"]}'
         db.session.commit()
-    Settings.set('channel_sync_timestamp', datetime.utcnow().isoformat())
+    except (requests.exceptions.RequestException, m3u.M3UParseError) as exc:
+        db.session.rollback()
+        # Wait a full interval before trying the origin again
+        source.refreshed_at = datetime.utcnow()
+        source.refresh_status = f'Failed: {exc}'[:255]
+        db.session.commit()
+        SystemLog.log('WARNING', 'M3U_SOURCE', f'Refresh of source "{source.name}" failed: {exc}')
+        return False, str(exc)
+
+    if report['status'] != 'updated':
+        return True, f'Source "{source.name}": {source.refresh_status}'
+
+    summary = (f'Refreshed source "{source.name}": {report["added"]} added, {report["changed"]} changed, '
+               f'{report["removed"]} removed in {report["seconds"]}s')
+    if source.is_active and (report['added'] or report['changed'] or report['removed']):
+        channels = Channel.query.filter(Channel.in_source(source.id)).all()
+        success_count, failure_count, failed_ids, sync_report = sync_channels_to_streaming(channels)
+        summary += (f'; {sync_report["mode"]} sync: {success_count} succeeded, {failure_count} failed '
+                    f'({sync_report["bytes"]} bytes)')
+        purge_channels_cache(report['channel_ids'])
+        invalidate_playlists(f'source "{source.name}" refreshed')
+    elif not source.is_active and str(source.id) in load_catalog_stages():
+        # Keep an already staged catalog current so its activation stays a plain switch
+        success, detail, staged = stage_source_catalog(source)
+        summary += f'; restaged on {len(staged)} servers' if success else f'; restaging failed: {detail}'
+    SystemLog.log('INFO', 'M3U_SOURCE', summary)
+    return True, summary
+
+
+def run_source_refresh_job(key: str, payload: dict) -> tuple[bool, str]:
+    if key != 'periodic':
+        source = M3USource.query.get(int(key))
+        if not source or not source.origin_url:
+            return True, 'Source has no origin URL'
+        if source.is_deleting:
+            return True, f'Source "{source.name}" is being deleted'
+        if source.is_importing:
+            return False, f'Source "{source.name}" is still importing'
+        return refresh_m3u_source(source, force=bool(payload.get('force')))
+
+    results = [refresh_m3u_source(source) for source in source_refresh.due_sources()]
+    failed = [detail for success, detail in results if not success]
+    if failed:
+        return False, '; '.join(failed)
+    return True, f'Refreshed {len(results)} sources'
+
+
+# Channels detached per transaction when a source is deleted
+SOURCE_DELETE_BATCH_SIZE = int(os.environ.get('SOURCE_DELETE_BATCH_SIZE', '2000') or 2000)
+
+
+def run_source_delete_job(key: str, payload: dict) -> tuple[bool, str]:
+    """Delete a source in bounded transactions: its channels batch by batch, the source row last.
+
+    Every batch commits on its own, so no transaction holds locks on more than
+    one batch of channels and a retry continues where a failed run stopped.
+    """
+    source = M3USource.query.get(int(key))
+    if not source:
+        return True, 'Source already deleted'
+    if not source.is_deleting:
+        return True, f'Deletion of source "{source.name}" was not requested'
+
+    started = datetime.utcnow()
+    totals = {'unlinked': 0, 'removed': 0, 'detached': 0}
+    batches = 0
+    name = source.name
+    staged_import_id = source.import_progress.get('import_id')
+    try:
+        while True:
+            batch = channel_import.detach_source_batch(source.id, SOURCE_DELETE_BATCH_SIZE)
+            if not any(batch.values()):
+                break
+            for field in totals:
+                totals[field] += batch[field]
+            batches += 1
+            source.total_channels = max((source.total_channels or 0) - batch['unlinked'], 0)
+            db.session.commit()
+        # Nothing refers to the row any more; the foreign keys cover rows added meanwhile
+        db.session.delete(source)
+        db.session.commit()
+    except Exception as exc:  # noqa: BLE001
+        db.session.rollback()
+        current_app.logger.exception("Deleting source %s failed", key)
+        return False, str(exc)
+
+    if staged_import_id:
+        try:
+            import_staging.delete(staged_import_id)
+        except Exception as e:
+            current_app.logger.error(f"Import staging cleanup failed: {e}")
+    if key in load_catalog_stages():
+        save_catalog_stage(key, None)
+        StreamingService.discard_catalog(catalog_name(key))
+
+    summary = (f'Deleted source "{name}": {totals["unlinked"]} channels unlinked ({totals["removed"]} removed, '
+               f'{totals["unlinked"] - totals["removed"]} still listed by other sources) in {batches} batches, '
+               f'{round((datetime.utcnow() - started).total_seconds(), 2)}s')
+    SystemLog.log('WARNING', 'M3U_SOURCE', summary)
+    return True, summary
 
 
 # DEPRECATED: This function is no longer used after migration to database-only system
@@ -283,6 +1238,7 @@ def apply_m3u_template_from_url(m3u_url: str | None, token: str | None) -> None:
     template = m3u_url.replace(token, '{TOKEN}')
     if Settings.get('m3u_url_format') != template:
         Settings.set('m3u_url_format', template)
+        invalidate_playlists('stream URL format changed')
 
 
 def get_token_length() -> int:
@@ -298,6 +1254,34 @@ def get_active_source_id():
     return active_source.id if active_source else None
 
 
+JOB_HANDLERS = {
+    'user_sync': (run_user_sync_job, _merge_user_sync),
+    'channel_sync': (run_channel_sync_job, _merge_channel_sync),
+    'purge': (run_purge_job, None),
+    'purge_flush': (run_purge_flush_job, None),
+    'channel_pull': (run_channel_pull_job, None),
+    'user_snapshot': (run_user_snapshot_job, None),
+    'reconcile': (run_reconcile_job, None),
+    'm3u_import': (run_m3u_import_job, None),
+    'source_refresh': (run_source_refresh_job, None),
+    'catalog_stage': (run_catalog_stage_job, None),
+    'source_delete': (run_source_delete_job, None),
+}
+
+# Jobs the worker enqueues by itself, in seconds between runs
+PERIODIC_JOBS = {
+    'channel_pull': int(os.environ.get('CHANNEL_PULL_INTERVAL', '300') or 0),
+    'user_snapshot': int(os.environ.get('USER_SNAPSHOT_INTERVAL', '300') or 0),
+    'reconcile': int(os.environ.get('RECONCILE_INTERVAL', '900') or 0),
+    'purge_flush': PURGE_DEBOUNCE,
+    # Checks which URL-backed sources are due; each source has its own interval
+    'source_refresh': int(os.environ.get('SOURCE_REFRESH_CHECK_INTERVAL', '300') or 0),
+}
+if job_queue:
+    for _kind, (_handler, _merge) in JOB_HANDLERS.items():
+        job_queue.register(_kind, _handler, _merge)
+
+
 @app.before_request
 def enforce_setup_wizard():
     if not current_user.is_authenticated:
@@ -325,7 +1309,7 @@ def dashboard():
     # Only count channels from active M3U source
     active_source_id = get_active_source_id()
     if active_source_id:
-        total_channels = Channel.query.filter_by(is_active=True, source_id=active_source_id).count()
+        total_channels = Channel.query.filter_by(is_active=True).filter(Channel.in_source(active_source_id)).count()
     else:
         total_channels = 0
     
@@ -441,10 +1425,13 @@ def setup_wizard():
             return redirect(url_for('setup_wizard', step=3))
 
         if step == 3:
+            previous_format = Settings.get('m3u_url_format')
             m3u_url_format = request.form.get('m3u_url_format', m3u_url_format)
             token_type = request.form.get('token_type', token_type)
             token_length = request.form.get('token_length', token_length)
             Settings.set('m3u_url_format', m3u_url_format)
+            if previous_format is not None and previous_format != m3u_url_format:
+                invalidate_playlists('stream URL format changed')
             Settings.set('token_type', token_type)
             Settings.set('token_length', token_length)
             Settings.set('setup_complete', 'true')
@@ -474,24 +1461,51 @@ def users_list():
     search = request.args.get('search', '')
     status = request.args.get('status', 'all')
     
-    query = User.query
-    
-    if search:
-        query = query.filter(
-            (User.username.like(f'%{search}%')) | (User.email.like(f'%{search}%'))
-        )
-    
-    if status == 'active':
-        query = query.filter(User.is_active == True, User.expiry_date > datetime.utcnow())
-    elif status == 'expired':
-        query = query.filter(User.expiry_date <= datetime.utcnow())
-    elif status == 'disabled':
-        query = query.filter(User.is_active == False)
+    query = filtered_users_query(search, status)
     
     users = query.order_by(User.created_at.desc()).paginate(page=page, per_page=20)
     
     return render_template('users_list.html', users=users, search=search, status=status)
 
+@app.route('/users/bulk', methods=['POST'])
+@login_required
+def users_bulk():
+    action = request.form.get('action', '')
+    search = request.form.get('search', '')
+    status = request.form.get('status', 'all')
+
+    if action not in BULK_USER_ACTIONS:
+        flash('Please choose a bulk action', 'danger')
+        return redirect(url_for('users_list', search=search, status=status))
+
+    try:
+        days = int(request.form.get('days', 30))
+        if days <= 0:
+            raise ValueError
+    except (TypeError, ValueError):
+        flash('Invalid subscription days value', 'danger')
+        return redirect(url_for('users_list', search=search, status=status))
+
+    if request.form.get('scope') == 'filter':
+        user_ids = None
+    else:
+        user_ids = [int(value) for value in request.form.getlist('user_ids') if value.isdigit()]
+        if not user_ids:
+            flash('No users selected', 'warning')
+            return redirect(url_for('users_list', search=search, status=status))
+
+    report = apply_bulk_user_action(action, user_ids=user_ids, search=search, status=status, days=days)
+
+    if not report['streaming_sync']['success']:
+        flash(f"Streaming server sync failed: {report['streaming_sync']['detail']}", 'warning')
+    if not report['cloudflare_purge']['success']:
+        flash(f"Cloudflare cache purge failed: {report['cloudflare_purge']['detail']}", 'warning')
+
+    SystemLog.log('INFO' if action != 'delete' else 'WARNING', 'USER',
+        f"Bulk {action} on {report['matched']} users ({report['failed']} failed)", request.remote_addr)
+    flash(f"Bulk {action.replace('_', ' ')} applied to {report['matched']} users ({report['failed']} failed)", 'success')
+    return redirect(url_for('users_list', search=search, status=status))
+
 @app.route('/users/add', methods=['GET', 'POST'])
 @login_required
 def users_add():
@@ -499,9 +1513,16 @@ def users_add():
         username = request.form.get('username').strip()
         password = request.form.get('password') or secrets.token_urlsafe(12)
         email = request.form.get('email', '').strip()
-        days = int(request.form.get('days', 30))
         max_connections = int(request.form.get('max_connections', 1))
         notes = request.form.get('notes', '').strip()
+
+        try:
+            days = int(request.form.get('days', 30))
+            if days <= 0:
+                raise ValueError
+        except (TypeError, ValueError):
+            flash('Invalid subscription days value', 'danger')
+            return redirect(url_for('users_add'))
         
         if not username or len(username) < 3:
             flash('Username must be at least 3 characters', 'danger')
@@ -522,10 +1543,12 @@ def users_add():
         user.set_password(password)
 
         db.session.add(user)
+        db.session.flush()
+        assign_servers([user])
         db.session.commit()
 
-        # Sync with streaming server (if configured) - pass plain password before it's hashed
-        sync_success, sync_detail = sync_user_with_streaming(user, 'create', plain_password=password)
+        # Sync with streaming server (if configured) - the worker sends the stored plain password
+        sync_success, sync_detail = queue_user_sync(user, 'create')
         if not sync_success:
             flash(f'Streaming server sync failed: {sync_detail}', 'warning')
 
@@ -562,7 +1585,9 @@ def users_view(user_id):
         active_connections=active_conns,
         m3u_url=panel_url,
         streaming_m3u_url=direct_stream_url,
-        xtream_m3u_url=xtream_url
+        xtream_m3u_url=xtream_url,
+        sync_job=job_status('user_sync', user.id),
+        purge_job=playlist_purge_status([user.token])
     )
 
 @app.route('/users/<int:user_id>/edit', methods=['GET', 'POST'])
@@ -583,8 +1608,8 @@ def users_edit(user_id):
 
         db.session.commit()
 
-        # Sync with streaming server - pass password only if it was changed
-        sync_success, sync_detail = sync_user_with_streaming(user, 'update', plain_password=new_password if new_password else None)
+        # Sync with streaming server - set_password stored any new plain password on the user
+        sync_success, sync_detail = queue_user_sync(user, 'update')
         if not sync_success:
             flash(f'Streaming server sync failed: {sync_detail}', 'warning')
 
@@ -602,11 +1627,17 @@ def users_edit(user_id):
 @login_required
 def users_extend(user_id):
     user = User.query.get_or_404(user_id)
-    days = int(request.form.get('days', 30))
+    try:
+        days = int(request.form.get('days', 30))
+        if days <= 0:
+            raise ValueError
+    except (TypeError, ValueError):
+        flash('Invalid subscription days value', 'danger')
+        return redirect(url_for('users_view', user_id=user.id))
     user.extend_subscription(days)
     db.session.commit()
 
-    sync_success, sync_detail = sync_user_with_streaming(user, 'update')
+    sync_success, sync_detail = queue_user_sync(user, 'update')
     if not sync_success:
         flash(f'Streaming server sync failed: {sync_detail}', 'warning')
 
@@ -626,7 +1657,7 @@ def users_reset_token(user_id):
     user.generate_token(get_token_length())
     db.session.commit()
 
-    sync_success, sync_detail = sync_user_with_streaming(user, 'update')
+    sync_success, sync_detail = queue_user_sync(user, 'update')
     if not sync_success:
         flash(f'Streaming server sync failed: {sync_detail}', 'warning')
 
@@ -648,15 +1679,15 @@ def users_delete(user_id):
     username = user.username
     token = user.token
 
-    sync_success, sync_detail = sync_user_with_streaming(user, 'delete')
+    db.session.delete(user)
+    db.session.commit()
+
+    sync_success, sync_detail = queue_user_sync(SimpleNamespace(id=user_id, username=username, token=token), 'delete')
     if not sync_success:
         flash(f'Streaming server sync failed: {sync_detail}', 'warning')
 
     purge_playlist_cache([token])
 
-    db.session.delete(user)
-    db.session.commit()
-
     SystemLog.log('WARNING', 'USER', f'Deleted user: {username}', request.remote_addr)
     flash(f'User {username} deleted', 'info')
     return redirect(url_for('users_list'))
@@ -668,10 +1699,15 @@ def users_delete(user_id):
 @app.route('/channels')
 @login_required
 def channels_list():
-    try:
-        sync_channels_from_streaming()
-    except Exception as exc:  # noqa: BLE001
-        current_app.logger.warning("Channel sync raised an exception: %s", exc)
+    # The worker pulls the catalog on a schedule; without Redis fall back to a throttled inline pull
+    if not job_queue:
+        try:
+            last_sync_raw = Settings.get('channel_sync_timestamp')
+            last_sync = datetime.fromisoformat(last_sync_raw) if last_sync_raw else None
+            if not last_sync or datetime.utcnow() - last_sync >= timedelta(minutes=5):
+                sync_channels_from_streaming()
+        except Exception as exc:  # noqa: BLE001
+            current_app.logger.warning("Channel sync raised an exception: %s", exc)
 
     # Only show channels from active M3U source
     active_source_id = get_active_source_id()
@@ -680,13 +1716,13 @@ def channels_list():
         return redirect(url_for('m3u_sources_list'))
 
     category = request.args.get('category', '')
-    channels = Channel.query.filter_by(source_id=active_source_id)
+    channels = Channel.query.filter(Channel.in_source(active_source_id))
 
     if category:
         channels = channels.filter_by(category=category)
 
     channels = channels.order_by(Channel.category, Channel.name).all()
-    categories = db.session.query(Channel.category).filter(Channel.source_id == active_source_id).distinct().all()
+    categories = db.session.query(Channel.category).filter(Channel.in_source(active_source_id)).distinct().all()
 
     return render_template('channels_list.html', channels=channels, categories=[c[0] for c in categories], selected_category=category)
 
@@ -699,7 +1735,7 @@ def categories_manage():
         flash('No active M3U source. Please activate a source first.', 'warning')
         return redirect(url_for('m3u_sources_list'))
 
-    raw_categories = db.session.query(Channel.category).filter(Channel.source_id == active_source_id).distinct().all()
+    raw_categories = db.session.query(Channel.category).filter(Channel.in_source(active_source_id)).distinct().all()
     all_categories = sorted({(c[0] or '').strip() for c in raw_categories if (c[0] or '').strip()})
     selected = [cat for cat in get_allowed_categories() if cat in all_categories]
     available = [cat for cat in all_categories if cat not in selected]
@@ -721,7 +1757,9 @@ def categories_manage():
                 text = str(cat).strip()
                 if text and text in all_categories and text not in new_selected:
                     new_selected.append(text)
-        set_allowed_categories(new_selected)
+        if new_selected != get_allowed_categories():
+            set_allowed_categories(new_selected)
+            invalidate_playlists('category selection changed')
         flash('Category selection updated. These categories will appear in generated playlists.', 'success')
         return redirect(url_for('categories_manage'))
 
@@ -759,7 +1797,7 @@ def channels_add():
         db.session.add(channel)
         db.session.commit()
 
-        sync_success, sync_detail = sync_channel_with_streaming(channel, 'create')
+        sync_success, sync_detail = queue_channel_sync(channel, 'create')
         if not sync_success:
             flash(f'Streaming server channel sync failed: {sync_detail}', 'warning')
 
@@ -778,98 +1816,26 @@ def channels_add():
 def channels_delete(channel_id):
     channel = Channel.query.get_or_404(channel_id)
     name = channel.name
+    stream_channel_id = channel.channel_id
+
+    db.session.delete(channel)
+    db.session.commit()
 
-    sync_success, sync_detail = sync_channel_with_streaming(channel, 'delete')
+    sync_success, sync_detail = queue_channel_sync(SimpleNamespace(channel_id=stream_channel_id), 'delete')
     if not sync_success:
         flash(f'Streaming server channel sync failed: {sync_detail}', 'warning')
 
-    purge_channel_cache(channel.channel_id)
-
-    db.session.delete(channel)
-    db.session.commit()
+    purge_channel_cache(stream_channel_id)
     SystemLog.log('WARNING', 'CHANNEL', f'Deleted channel: {name}', request.remote_addr)
     flash(f'Channel {name} deleted', 'info')
     return redirect(url_for('channels_list'))
 
-def parse_m3u_content(m3u_content):
-    """
-    Enhanced M3U parser that extracts all attributes and handles various formats.
-    Returns: (channels_list, detected_attributes_set)
-    """
-    lines = m3u_content.split('\n')
-    channels = []
-    detected_attrs = set()
-
-    i = 0
-    while i < len(lines):
-        line = lines[i].strip()
-
-        # Skip empty lines and comments (but not EXTINF)
-        if not line or (line.startswith('#') and not line.startswith('#EXTINF')):
-            i += 1
-            continue
-
-        if line.startswith('#EXTINF'):
-            # Extract all attributes using flexible regex (handles both single and double quotes)
-            attrs = {}
-
-            # Extract attributes with double quotes
-            for match in re.finditer(r'([\w-]+)="([^"]*)"', line):
-                attr_name = match.group(1)
-                attr_value = match.group(2)
-                attrs[attr_name] = attr_value
-                detected_attrs.add(attr_name)
-
-            # Extract attributes with single quotes
-            for match in re.finditer(r"([\w-]+)='([^']*)'", line):
-                attr_name = match.group(1)
-                attr_value = match.group(2)
-                if attr_name not in attrs:  # Don't override double-quoted values
-                    attrs[attr_name] = attr_value
-                    detected_attrs.add(attr_name)
-
-            # Extract channel name (after the last comma)
-            name_match = re.search(r',(.+)$', line)
-            channel_name = name_match.group(1).strip() if name_match else ''
-
-            # Find the URL (skip empty lines after EXTINF)
-            url = None
-            j = i + 1
-            while j < len(lines):
-                potential_url = lines[j].strip()
-                if potential_url and not potential_url.startswith('#'):
-                    url = potential_url
-                    break
-                j += 1
-
-            if url and channel_name:  # Only add if we have both URL and name
-                channels.append({
-                    'name': channel_name,
-                    'url': url,
-                    'attributes': attrs
-                })
-
-            i = j + 1 if url else i + 1
-        else:
-            # Handle plain TXT format (just URLs)
-            if line.startswith('http') or line.startswith('rtmp'):
-                channels.append({
-                    'name': f'Channel {len(channels) + 1}',
-                    'url': line,
-                    'attributes': {}
-                })
-            i += 1
-
-    return channels, detected_attrs
-
-
 @app.route('/channels/import', methods=['GET', 'POST'])
 @login_required
 def channels_import():
     """Step 1: Upload and analyze M3U content"""
     if request.method == 'POST':
         import_method = request.form.get('import_method', 'paste')
-        m3u_content = ''
 
         if import_method == 'url':
             # Fetch from URL
@@ -877,60 +1843,60 @@ def channels_import():
             if not m3u_url:
                 flash('Please provide M3U URL', 'danger')
                 return redirect(url_for('channels_import'))
-
-            try:
-                SystemLog.log('INFO', 'M3U_IMPORT', f'Fetching M3U from URL: {m3u_url}', request.remote_addr)
-                response = requests.get(m3u_url, timeout=30)
-                response.raise_for_status()
-                m3u_content = response.text
-
-                # Log fetch success
-                SystemLog.log('INFO', 'M3U_IMPORT',
-                    f'Successfully fetched {len(m3u_content)} characters from URL',
-                    request.remote_addr)
-
-            except requests.exceptions.RequestException as e:
-                flash(f'Failed to fetch M3U from URL: {str(e)}', 'danger')
-                SystemLog.log('ERROR', 'M3U_IMPORT', f'URL fetch failed: {str(e)}', request.remote_addr)
+            SystemLog.log('INFO', 'M3U_IMPORT', f'Fetching M3U from URL: {m3u_url}', request.remote_addr)
+            # Streamed in chunks straight into the parser (gzip bodies are inflated)
+            fetch_info = {}
+            source = m3u.fetch(m3u_url, info=fetch_info)
+
+        elif import_method == 'file':
+            upload = request.files.get('m3u_file')
+            if not upload or not upload.filename:
+                flash('Please choose an M3U file to upload', 'danger')
                 return redirect(url_for('channels_import'))
+            source = upload.stream
 
         else:
             # Paste method
-            m3u_content = request.form.get('m3u_content', '')
+            source = request.form.get('m3u_content', '')
+            if not source:
+                flash('Please provide M3U content', 'danger')
+                return redirect(url_for('channels_import'))
 
-        if not m3u_content:
-            flash('Please provide M3U content', 'danger')
+        # Parse once and stage the records (Redis, or a temp directory without it) for the confirm step
+        import_id = secrets.token_urlsafe(16)
+        detected_attrs = set()
+        try:
+            staged = import_staging.stage(import_id, m3u.stream(source, detected_attrs), detected_attrs)
+        except requests.exceptions.RequestException as e:
+            flash(f'Failed to fetch M3U from URL: {str(e)}', 'danger')
+            SystemLog.log('ERROR', 'M3U_IMPORT', f'URL fetch failed: {str(e)}', request.remote_addr)
+            return redirect(url_for('channels_import'))
+        except m3u.M3UParseError as e:
+            flash(f'Could not parse M3U content: {str(e)}', 'danger')
+            return redirect(url_for('channels_import'))
+        except Exception as e:
+            current_app.logger.error(f"Import staging failed: {e}")
+            flash('Unable to store import data. Please try again.', 'danger')
             return redirect(url_for('channels_import'))
 
-        # Parse the M3U content
-        channels, detected_attrs = parse_m3u_content(m3u_content)
+        if import_method == 'url':
+            SystemLog.log('INFO', 'M3U_IMPORT',
+                f'Successfully fetched {staged["total"]} channels from URL',
+                request.remote_addr)
 
-        if not channels:
+        if not staged['total']:
+            import_staging.delete(import_id)
             flash('No valid channels found in the provided content', 'danger')
             return redirect(url_for('channels_import'))
 
-        # Generate a unique session key for this import
-        import_id = secrets.token_urlsafe(16)
-
-        # Store content in Redis (expires in 1 hour) or fallback to session
-        if redis_client:
-            try:
-                redis_client.setex(f'import:{import_id}:content', 3600, m3u_content)
-                redis_client.setex(f'import:{import_id}:total', 3600, str(len(channels)))
-                session['import_id'] = import_id
-            except Exception as e:
-                current_app.logger.error(f"Redis storage failed: {e}")
-                flash('Unable to store import data. Please try with a smaller file.', 'danger')
-                return redirect(url_for('channels_import'))
+        session['import_id'] = import_id
+        # URL imports remember where they came from so the source can refresh itself later
+        if import_method == 'url':
+            session['import_origin'] = {'url': m3u_url, 'etag': fetch_info.get('etag'),
+                                        'last_modified': fetch_info.get('last_modified'),
+                                        'sha256': fetch_info.get('sha256')}
         else:
-            # Fallback: store in session (will fail for large files)
-            try:
-                session['m3u_content'] = m3u_content
-                session['m3u_total_channels'] = len(channels)
-            except Exception as e:
-                current_app.logger.error(f"Session storage failed: {e}")
-                flash('File too large for session storage. Please configure Redis.', 'danger')
-                return redirect(url_for('channels_import'))
+            session.pop('import_origin', None)
 
         # Define available database fields
         db_fields = {
@@ -952,11 +1918,12 @@ def channels_import():
         }
 
         return render_template('channels_import_map.html',
-            detected_attrs=sorted(detected_attrs),
+            detected_attrs=staged['detected_attrs'],
             db_fields=db_fields,
             default_mapping=default_mapping,
-            preview_channels=channels[:5],
-            total_channels=len(channels)
+            preview_channels=staged['preview'],
+            total_channels=staged['total'],
+            origin_url=session.get('import_origin', {}).get('url')
         )
 
     return render_template('channels_import.html')
@@ -967,21 +1934,15 @@ def channels_import():
 def channels_import_confirm():
     """Step 2: Import channels with user-defined field mapping and save as M3U source"""
 
-    # Retrieve M3U content from Redis or session
-    m3u_content = None
+    # Retrieve the staged import (parsed once in step 1)
     import_id = session.get('import_id')
+    try:
+        staged = import_staging.meta(import_id)
+    except Exception as e:
+        current_app.logger.error(f"Import staging retrieval failed: {e}")
+        staged = None
 
-    if import_id and redis_client:
-        try:
-            m3u_content = redis_client.get(f'import:{import_id}:content')
-        except Exception as e:
-            current_app.logger.error(f"Redis retrieval failed: {e}")
-
-    if not m3u_content:
-        # Fallback to session
-        m3u_content = session.get('m3u_content')
-
-    if not m3u_content:
+    if not staged:
         flash('Session expired. Please upload your M3U file again.', 'danger')
         return redirect(url_for('channels_import'))
 
@@ -991,8 +1952,7 @@ def channels_import_confirm():
 
     if not source_name:
         flash('Please provide a name for this M3U source. The name field is required.', 'danger')
-        # Parse M3U to show the mapping page again
-        channels, detected_attrs = parse_m3u_content(m3u_content)
+        # Show the mapping page again from the staged import
         default_mapping = {
             'tvg-id': 'epg_id',
             'tvg-logo': 'logo_url',
@@ -1008,17 +1968,17 @@ def channels_import_confirm():
             'quality': 'Quality'
         }
         return render_template('channels_import_map.html',
-            detected_attrs=sorted(detected_attrs),
+            detected_attrs=staged['detected_attrs'],
             db_fields=db_fields,
             default_mapping=default_mapping,
-            preview_channels=channels[:5],
-            total_channels=len(channels))
+            preview_channels=staged['preview'],
+            total_channels=staged['total'],
+            origin_url=session.get('import_origin', {}).get('url'))
 
     # Check if source name already exists
     if M3USource.query.filter_by(name=source_name).first():
         flash(f'Source name "{source_name}" already exists. Please choose a different name.', 'danger')
-        # Parse M3U to show the mapping page again
-        channels, detected_attrs = parse_m3u_content(m3u_content)
+        # Show the mapping page again from the staged import
         default_mapping = {
             'tvg-id': 'epg_id',
             'tvg-logo': 'logo_url',
@@ -1034,11 +1994,12 @@ def channels_import_confirm():
             'quality': 'Quality'
         }
         return render_template('channels_import_map.html',
-            detected_attrs=sorted(detected_attrs),
+            detected_attrs=staged['detected_attrs'],
             db_fields=db_fields,
             default_mapping=default_mapping,
-            preview_channels=channels[:5],
-            total_channels=len(channels))
+            preview_channels=staged['preview'],
+            total_channels=staged['total'],
+            origin_url=session.get('import_origin', {}).get('url'))
 
     # Get user-defined mapping from form
     mapping = {}
@@ -1049,151 +2010,42 @@ def channels_import_confirm():
             if db_field and db_field != 'ignore':
                 mapping[m3u_attr] = db_field
 
-    # Parse M3U content again
-    channels, detected_attrs = parse_m3u_content(m3u_content)
-
-    # Create M3U Source record
+    # Create the M3U Source record; its channels are imported by a background job
+    origin = session.pop('import_origin', None) or {}
     m3u_source = M3USource(
         name=source_name,
-        is_active=activate_now,
-        total_channels=len(channels),
-        detected_attributes=json.dumps(list(detected_attrs)),
-        field_mapping=json.dumps(mapping)
+        is_active=False,
+        total_channels=staged['total'],
+        detected_attributes=json.dumps(staged['detected_attrs']),
+        field_mapping=json.dumps(mapping),
+        origin_url=origin.get('url'),
+        refresh_interval=request.form.get('refresh_interval', 0, type=int) if origin.get('url') else 0,
+        etag=origin.get('etag'),
+        last_modified=origin.get('last_modified'),
+        content_hash=origin.get('sha256'),
+        refreshed_at=datetime.utcnow() if origin.get('url') else None
     )
     db.session.add(m3u_source)
     db.session.flush()  # Get the source ID
-
-    # If activating this source, deactivate all others
-    if activate_now:
-        M3USource.query.filter(M3USource.id != m3u_source.id).update({'is_active': False})
-
-    imported = 0
-    skipped = 0
-    new_channels = []
-
-    # Get the highest existing import ID to avoid collisions
-    last_import_channel = Channel.query.filter(
-        Channel.channel_id.like('imp%')
-    ).order_by(Channel.channel_id.desc()).first()
-
-    if last_import_channel:
-        try:
-            last_id = int(last_import_channel.channel_id.replace('imp', ''))
-            next_id = last_id + 1
-        except (ValueError, AttributeError):
-            next_id = 1000
-    else:
-        next_id = 1000
-
-    for channel_data in channels:
-        attrs = channel_data['attributes']
-
-        # Build channel object using mapping
-        channel_values = {
-            'name': channel_data['name'],
-            'source_url': channel_data['url'],
-            'category': 'Imported',
-            'logo_url': '',
-            'epg_id': '',
-            'quality': 'medium'
-        }
-
-        # Apply user mapping
-        for m3u_attr, db_field in mapping.items():
-            if m3u_attr in attrs and db_field in channel_values:
-                value = attrs[m3u_attr]
-                if value:  # Only update if value is not empty
-                    channel_values[db_field] = value
-
-        # Generate unique channel_id
-        # Check if user mapped an M3U attribute to channel_id
-        channel_id_source = mapping.get('tvg-id', None)
-        if channel_id_source == 'channel_id' and attrs.get('tvg-id'):
-            # Use tvg-id as channel_id if mapped
-            proposed_id = attrs['tvg-id']
-            # Sanitize: remove special chars, limit length
-            proposed_id = re.sub(r'[^a-zA-Z0-9_-]', '', proposed_id)[:50]
-            if proposed_id and not Channel.query.filter_by(channel_id=proposed_id).first():
-                channel_id = proposed_id
-            else:
-                channel_id = f'{next_id}'
-                next_id += 1
-        else:
-            channel_id = f'{next_id}'
-            next_id += 1
-
-        # Check for duplicate
-        if Channel.query.filter_by(channel_id=channel_id).first():
-            skipped += 1
-            continue
-
-        # Create channel linked to this M3U source
-        channel = Channel(
-            channel_id=channel_id,
-            name=channel_values['name'][:100],
-            category=channel_values['category'][:50],
-            source_url=channel_values['source_url'][:500],
-            logo_url=channel_values['logo_url'][:500] if channel_values['logo_url'] else None,
-            epg_id=channel_values['epg_id'][:100] if channel_values['epg_id'] else None,
-            quality=channel_values['quality'][:20] if channel_values['quality'] else 'medium',
-            source_id=m3u_source.id  # Link to M3U source
-        )
-
-        db.session.add(channel)
-        new_channels.append(channel)
-        imported += 1
-
-    db.session.commit()
-
-    # Sync with streaming server ONLY if this source is being activated
-    sync_failures = []
-    purge_failures = []
-    if activate_now and new_channels:
-        # Use parallel sync for faster bulk import
-        SystemLog.log('INFO', 'M3U_IMPORT', f'Starting file-based sync of {len(new_channels)} channels...', request.remote_addr)
-
-        success_count, failure_count, failed_ids = StreamingService.sync_channels_via_file(
-            new_channels,
-            app=current_app._get_current_object()
-        )
-
-        sync_failures = failed_ids
-
-        SystemLog.log('INFO', 'M3U_IMPORT',
-            f'Parallel sync complete: {success_count} succeeded, {failure_count} failed',
-            request.remote_addr)
-
-        # Note: Cloudflare purge still sequential (usually fast and less critical)
-        for imported_channel in new_channels:
-            purge_success, purge_detail = purge_channel_cache(imported_channel.channel_id)
-            if not purge_success:
-                purge_failures.append(f"{imported_channel.channel_id}")
-
-    # Clear temporary data from Redis and session
-    if import_id and redis_client:
-        try:
-            redis_client.delete(f'import:{import_id}:content')
-            redis_client.delete(f'import:{import_id}:total')
-        except Exception as e:
-            current_app.logger.error(f"Redis cleanup failed: {e}")
-
+    save_import_checkpoint(m3u_source, {
+        'import_id': import_id, 'activate': activate_now, 'total': staged['total'],
+        'imported': 0, 'skipped': 0, 'batches': 0,
+    }, 'queued')
     session.pop('import_id', None)
-    session.pop('m3u_content', None)
-    session.pop('m3u_total_channels', None)
-
-    if sync_failures:
-        flash(f'Streaming sync failed for channels: {", ".join(sync_failures[:5])}', 'warning')
-    if purge_failures:
-        flash(f'Cloudflare purge failed for channels: {", ".join(purge_failures[:5])}', 'warning')
 
-    SystemLog.log('INFO', 'M3U_SOURCE', f'Created source "{source_name}" with {imported} channels ({skipped} skipped)', request.remote_addr)
+    # Keep the staged records until the job has finished (or been resumed)
+    try:
+        import_staging.keep(import_id, IMPORT_RESUME_TTL, staged)
+    except Exception as e:
+        current_app.logger.error(f"Import staging retention failed: {e}")
 
-    if activate_now:
-        flash(f'M3U Source "{source_name}" created and activated with {imported} channels!', 'success')
-    else:
-        flash(f'M3U Source "{source_name}" created with {imported} channels. Activate it from M3U Sources page to use it.', 'success')
+    SystemLog.log('INFO', 'M3U_IMPORT',
+        f'Queued import of {staged["total"]} channels into source "{source_name}"'
+        + (' (activate when done)' if activate_now else ''),
+        request.remote_addr)
+    dispatch_job('m3u_import', m3u_source.id, {})
 
-    return redirect(url_for('m3u_sources_list'))
+    return redirect(url_for('m3u_source_import', source_id=m3u_source.id))
 
 
 # ============================================================================
@@ -1205,7 +2057,8 @@ def channels_import_confirm():
 def m3u_sources_list():
     """List all M3U sources with their status"""
     sources = M3USource.query.order_by(M3USource.is_active.desc(), M3USource.uploaded_at.desc()).all()
-    return render_template('m3u_sources_list.html', sources=sources)
+    return render_template('m3u_sources_list.html', sources=sources, stages=load_catalog_stages(),
+                           streaming_targets=len(StreamingService.target_names()))
 
 
 @app.route('/m3u-sources/<int:source_id>/activate', methods=['POST'])
@@ -1218,35 +2071,69 @@ def m3u_source_activate(source_id):
         flash(f'Source "{source.name}" is already active.', 'info')
         return redirect(url_for('m3u_sources_list'))
 
-    # Deactivate all sources
-    M3USource.query.update({'is_active': False})
+    if source.is_deleting:
+        flash(f'Source "{source.name}" is being deleted.', 'warning')
+        return redirect(url_for('m3u_sources_list'))
 
-    # Activate this source
-    source.is_active = True
-    db.session.commit()
+    if source.import_status not in (None, 'done'):
+        flash(f'Source "{source.name}" has not finished importing yet.', 'warning')
+        return redirect(url_for('m3u_source_import', source_id=source.id))
+
+    # Channels both sources list keep their ids, so their streams continue across the switch
+    previous_id = get_active_source_id()
+    shared = 0
+    if previous_id:
+        shared = SourceChannel.query.filter(
+            SourceChannel.source_id == source.id,
+            SourceChannel.channel_pk.in_(db.select(SourceChannel.channel_pk).where(SourceChannel.source_id == previous_id))
+        ).count()
 
-    # Sync all channels from this source to the streaming server using parallel sync
-    channels = Channel.query.filter_by(source_id=source.id).all()
+    # The streaming servers switch to the pre-staged catalog together with the panel, or nothing changes
+    success, report = switch_active_source(source)
+    if not success:
+        flash(f'Source "{source.name}" was not activated: {report["error"]}. The previous source is still active.', 'danger')
+        SystemLog.log('ERROR', 'M3U_SOURCE', f'Activation of source "{source.name}" failed: {report["error"]}',
+                      request.remote_addr)
+        return redirect(url_for('m3u_sources_list'))
 
-    if channels:
-        SystemLog.log('INFO', 'M3U_SOURCE', f'Starting file-based sync of {len(channels)} channels for source "{source.name}"', request.remote_addr)
+    if report['warning']:
+        flash(f'Source "{source.name}" activated, but {report["warning"]}.', 'warning')
+    elif report['switched']:
+        flash(f'Source "{source.name}" activated successfully! All {report["channels"]} channels are now active.', 'success')
+    else:
+        flash(f'Source "{source.name}" activated ({report["channels"]} channels).', 'success')
+    SystemLog.log('INFO', 'M3U_SOURCE',
+        f'Activated source "{source.name}": {report["channels"]} channels switched on '
+        f'{len(report["switched"])} streaming servers ({len(report["staged"])} staged during activation), '
+        f'{shared} channels shared with the previous source, {report["seconds"]}s',
+        request.remote_addr)
+    invalidate_playlists(f'source "{source.name}" activated')
+    return redirect(url_for('m3u_sources_list'))
 
-        success_count, failure_count, sync_failures = StreamingService.sync_channels_via_file(
-            channels,
-            app=current_app._get_current_object()
-        )
 
-        if sync_failures:
-            flash(f'Source "{source.name}" activated, but {failure_count} channels failed to sync to streaming server.', 'warning')
-        else:
-            flash(f'Source "{source.name}" activated successfully! All {success_count} channels are now active.', 'success')
+@app.route('/m3u-sources/<int:source_id>/stage', methods=['POST'])
+@login_required
+def m3u_source_stage(source_id):
+    """Upload an inactive source's catalog to the streaming servers so activating it is a plain switch"""
+    source = M3USource.query.get_or_404(source_id)
+    if source.is_active:
+        flash(f'Source "{source.name}" is already active.', 'info')
+        return redirect(url_for('m3u_sources_list'))
+    if source.is_deleting:
+        flash(f'Source "{source.name}" is being deleted.', 'warning')
+        return redirect(url_for('m3u_sources_list'))
+    if source.is_importing:
+        flash(f'Source "{source.name}" is still importing.', 'warning')
+        return redirect(url_for('m3u_source_import', source_id=source.id))
+    if not StreamingService.file_sync_configured():
+        flash('Streaming server SSH access is not configured.', 'warning')
+        return redirect(url_for('m3u_sources_list'))
 
-        SystemLog.log('INFO', 'M3U_SOURCE',
-            f'Activated source "{source.name}": {success_count} synced, {failure_count} failed',
-            request.remote_addr)
+    success, message = dispatch_job('catalog_stage', source.id, {})
+    if message == 'queued':
+        flash(f'Staging of "{source.name}" queued.', 'info')
     else:
-        flash(f'Source "{source.name}" activated (no channels to sync).', 'info')
-        SystemLog.log('INFO', 'M3U_SOURCE', f'Activated source "{source.name}" (empty)', request.remote_addr)
+        flash(message, 'success' if success else 'danger')
     return redirect(url_for('m3u_sources_list'))
 
 
@@ -1262,6 +2149,7 @@ def m3u_source_deactivate(source_id):
 
     source.is_active = False
     db.session.commit()
+    invalidate_playlists(f'source "{source.name}" deactivated')
 
     flash(f'Source "{source.name}" deactivated. No channels are currently active.', 'warning')
     SystemLog.log('INFO', 'M3U_SOURCE', f'Deactivated source "{source.name}"', request.remote_addr)
@@ -1278,15 +2166,26 @@ def m3u_source_delete(source_id):
         flash(f'Cannot delete active source "{source.name}". Please deactivate or activate another source first.', 'danger')
         return redirect(url_for('m3u_sources_list'))
 
-    source_name = source.name
-    channel_count = source.total_channels
+    if source.is_deleting:
+        flash(f'Source "{source.name}" is already being deleted.', 'info')
+        return redirect(url_for('m3u_sources_list'))
 
-    # Delete the source (channels will be cascade deleted)
-    db.session.delete(source)
-    db.session.commit()
+    if source.is_importing:
+        flash(f'Source "{source.name}" is still importing. Wait for the import to finish or fail first.', 'warning')
+        return redirect(url_for('m3u_source_import', source_id=source.id))
 
-    flash(f'Source "{source_name}" and its {channel_count} channels deleted successfully.', 'success')
-    SystemLog.log('WARNING', 'M3U_SOURCE', f'Deleted source "{source_name}" with {channel_count} channels', request.remote_addr)
+    # Memberships and channels go in bounded batches in the background, the source row last
+    source.deleted_at = datetime.utcnow()
+    db.session.commit()
+    SystemLog.log('WARNING', 'M3U_SOURCE', f'Deletion of source "{source.name}" with {source.total_channels} channels requested',
+                  request.remote_addr)
+    source_name = source.name
+    channel_count = source.total_channels
+    success, message = dispatch_job('source_delete', source.id, {})
+    if message == 'queued':
+        flash(f'Deleting source "{source_name}" and its {channel_count} channels in the background.', 'info')
+    else:
+        flash(message, 'success' if success else 'danger')
     return redirect(url_for('m3u_sources_list'))
 
 
@@ -1297,7 +2196,7 @@ def m3u_source_view(source_id):
     source = M3USource.query.get_or_404(source_id)
     page = request.args.get('page', 1, type=int)
 
-    channels = Channel.query.filter_by(source_id=source.id).order_by(Channel.category, Channel.name).paginate(page=page, per_page=50)
+    channels = Channel.query.filter(Channel.in_source(source.id)).order_by(Channel.category, Channel.name).paginate(page=page, per_page=50)
 
     # Parse stored attributes and mapping
     detected_attrs = []
@@ -1322,6 +2221,98 @@ def m3u_source_view(source_id):
     )
 
 
+@app.route('/m3u-sources/<int:source_id>/import')
+@login_required
+def m3u_source_import(source_id):
+    """Progress of the background import that fills a source"""
+    source = M3USource.query.get_or_404(source_id)
+    return render_template('m3u_import_status.html',
+        source=source,
+        progress=import_progress(source),
+        job=job_status('m3u_import', source.id)
+    )
+
+
+@app.route('/m3u-sources/<int:source_id>/import/resume', methods=['POST'])
+@login_required
+def m3u_source_import_resume(source_id):
+    """Queue a failed import again; it continues after the last committed batch"""
+    source = M3USource.query.get_or_404(source_id)
+    job = job_status('m3u_import', source.id)
+
+    if source.import_status in (None, 'done'):
+        flash(f'Source "{source.name}" is already imported.', 'info')
+        return redirect(url_for('m3u_sources_list'))
+    if source.is_deleting:
+        flash(f'Source "{source.name}" is being deleted.', 'warning')
+        return redirect(url_for('m3u_sources_list'))
+    if job and job.get('state') in ('queued', 'running', 'retrying'):
+        flash(f'The import of "{source.name}" is still running.', 'info')
+        return redirect(url_for('m3u_source_import', source_id=source.id))
+
+    progress = source.import_progress
+    pending = (progress.get('imported', 0) + progress.get('shared', 0) + progress.get('skipped', 0)
+               < progress.get('total', 0))
+    if pending and not import_staging.keep(progress.get('import_id'), IMPORT_RESUME_TTL):
+        flash('The staged playlist expired. Delete this source and import the playlist again.', 'danger')
+        return redirect(url_for('m3u_source_import', source_id=source.id))
+
+    save_import_checkpoint(source, progress, 'queued')
+    SystemLog.log('INFO', 'M3U_IMPORT',
+        f'Resuming import of source "{source.name}" after {progress.get("imported", 0)} channels',
+        request.remote_addr)
+    dispatch_job('m3u_import', source.id, {})
+    return redirect(url_for('m3u_source_import', source_id=source.id))
+
+
+@app.route('/m3u-sources/<int:source_id>/refresh', methods=['POST'])
+@login_required
+def m3u_source_refresh(source_id):
+    """Re-fetch a URL-backed source now and apply what changed"""
+    source = M3USource.query.get_or_404(source_id)
+    if not source.origin_url:
+        flash(f'Source "{source.name}" was not imported from a URL.', 'warning')
+        return redirect(url_for('m3u_source_view', source_id=source.id))
+    if source.is_deleting:
+        flash(f'Source "{source.name}" is being deleted.', 'warning')
+        return redirect(url_for('m3u_sources_list'))
+    if source.is_importing:
+        flash(f'Source "{source.name}" is still importing.', 'warning')
+        return redirect(url_for('m3u_source_import', source_id=source.id))
+
+    success, message = dispatch_job('source_refresh', source.id, {'force': request.form.get('force') == 'on'})
+    if message == 'queued':
+        flash(f'Refresh of "{source.name}" queued.', 'info')
+    else:
+        flash(message, 'success' if success else 'danger')
+    return redirect(url_for('m3u_source_view', source_id=source.id))
+
+
+@app.route('/m3u-sources/<int:source_id>/refresh-settings', methods=['POST'])
+@login_required
+def m3u_source_refresh_settings(source_id):
+    """Set the origin URL and the automatic refresh interval of a source"""
+    source = M3USource.query.get_or_404(source_id)
+    origin_url = request.form.get('origin_url', '').strip() or None
+    refresh_interval = max(request.form.get('refresh_interval', 0, type=int) or 0, 0)
+
+    if origin_url and not origin_url.startswith(('http://', 'https://')):
+        flash('The origin URL must start with http:// or https://', 'danger')
+        return redirect(url_for('m3u_source_view', source_id=source.id))
+    if origin_url != source.origin_url:
+        # Validators and hash belong to the old URL
+        source.etag = source.last_modified = source.content_hash = None
+    source.origin_url = origin_url
+    source.refresh_interval = refresh_interval if origin_url else 0
+    db.session.commit()
+
+    flash(f'Refresh settings of "{source.name}" saved.', 'success')
+    SystemLog.log('INFO', 'M3U_SOURCE',
+        f'Source "{source.name}" refreshes every {source.refresh_interval} minutes from {origin_url or "nowhere"}',
+        request.remote_addr)
+    return redirect(url_for('m3u_source_view', source_id=source.id))
+
+
 # ============================================================================
 # PUBLIC API
 # ============================================================================
@@ -1336,14 +2327,21 @@ def _extract_api_token():
         return header_token.strip()
     return request.args.get('api_token', '').strip()
 
-@app.route('/api/users', methods=['POST'])
-def api_create_user():
+def _api_auth_error():
+    """Return an error response when the admin API token is missing or wrong."""
     if not ADMIN_API_TOKEN:
         return jsonify({'error': 'API token not configured'}), 503
-    
+
     provided_token = _extract_api_token()
     if not provided_token or not secrets.compare_digest(provided_token, ADMIN_API_TOKEN):
         return jsonify({'error': 'Unauthorized'}), 401
+    return None
+
+@app.route('/api/users', methods=['POST'])
+def api_create_user():
+    auth_error = _api_auth_error()
+    if auth_error:
+        return auth_error
     
     payload = request.get_json(silent=True)
     if not payload:
@@ -1388,6 +2386,8 @@ def api_create_user():
     user.set_password(plaintext_password)
     
     db.session.add(user)
+    db.session.flush()
+    assign_servers([user])
     db.session.commit()
 
     # Sync with streaming server (if configured)
@@ -1426,6 +2426,127 @@ def api_create_user():
         }
     }), 201
 
+@app.route('/api/users/bulk', methods=['POST'])
+def api_users_bulk():
+    """Apply extend/disable/enable/delete/reset_token to many users at once.
+
+    JSON body: {"action": ..., "user_ids": [...]} or {"action": ..., "filter": {"search": ..., "status": ...}},
+    plus "days" for extend.
+    """
+    auth_error = _api_auth_error()
+    if auth_error:
+        return auth_error
+
+    payload = request.get_json(silent=True)
+    if not payload:
+        return jsonify({'error': 'Invalid JSON payload'}), 400
+
+    action = payload.get('action')
+    if action not in BULK_USER_ACTIONS:
+        return jsonify({'error': f"Invalid action, expected one of: {', '.join(BULK_USER_ACTIONS)}"}), 400
+
+    try:
+        days = int(payload.get('days', 30))
+        if days <= 0:
+            raise ValueError
+    except (TypeError, ValueError):
+        return jsonify({'error': 'Invalid subscription days value'}), 400
+
+    user_ids = payload.get('user_ids')
+    filters = payload.get('filter')
+    if user_ids is None and not isinstance(filters, dict):
+        return jsonify({'error': 'Provide either user_ids or filter'}), 400
+    if user_ids is not None:
+        if not isinstance(user_ids, list) or not all(
+                isinstance(value, int) and not isinstance(value, bool) for value in user_ids):
+            return jsonify({'error': 'user_ids must be a list of integers'}), 400
+    filters = filters or {}
+
+    report = apply_bulk_user_action(
+        action,
+        user_ids=user_ids,
+        search=str(filters.get('search') or ''),
+        status=str(filters.get('status') or 'all'),
+        days=days,
+    )
+
+    SystemLog.log('INFO', 'API', f"Bulk {action} via API on {report['matched']} users ({report['failed']} failed)", request.remote_addr)
+    return jsonify(report)
+
+@app.route('/api/users/import', methods=['POST'])
+def api_import_users():
+    """Bulk-create users from a CSV or NDJSON upload.
+
+    Accepts a multipart ``file`` field or a raw request body; ``?format=csv|ndjson``
+    overrides detection. Progress and per-row errors are streamed back as NDJSON.
+    """
+    auth_error = _api_auth_error()
+    if auth_error:
+        return auth_error
+
+    upload = request.files.get('file')
+    source = upload.stream if upload else request.stream
+    filename = upload.filename if upload else None
+    fmt = request.args.get('format')
+    if not fmt:
+        fmt = 'ndjson' if not upload and 'json' in (request.content_type or '') else user_import.detect_format(filename)
+    if fmt not in user_import.FORMATS:
+        return jsonify({'error': f"Invalid format, expected one of: {', '.join(user_import.FORMATS)}"}), 400
+
+    remote_addr = request.remote_addr
+
+    def generate():
+        summary = {}
+        for event in run_user_import(user_import.decode_lines(source), fmt):
+            if event['event'] == 'done':
+                summary = event
+            yield json.dumps(event, default=str) + '\n'
+        SystemLog.log('INFO', 'API',
+            f"Bulk import via API: {summary.get('created', 0)} created, {summary.get('failed', 0)} failed",
+            remote_addr)
+
+    return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+
+@app.route('/api/servers/heartbeat', methods=['POST'])
+def api_server_heartbeat():
+    """Streaming servers report their load; unknown servers register when they send a domain."""
+    auth_error = _api_auth_error()
+    if auth_error:
+        return auth_error
+
+    data = request.get_json(silent=True) or {}
+    name = str(data.get('name') or '').strip()[:50]
+    if not name:
+        return jsonify({'error': 'name is required'}), 400
+
+    server = StreamServer.query.filter_by(name=name).first()
+    if not server:
+        domain = str(data.get('domain') or '').strip()
+        if not domain:
+            return jsonify({'error': f'Unknown server {name}; send a domain to register it'}), 404
+        server = StreamServer(name=name, domain=domain[:255])
+        db.session.add(server)
+        SystemLog.log('INFO', 'STREAMING', f'Registered stream server {name} ({domain})', request.remote_addr)
+
+    try:
+        if data.get('capacity') is not None:
+            server.capacity = max(1, int(data['capacity']))
+        server.current_load = max(0, int(data.get('load', data.get('connections', 0)) or 0))
+    except (TypeError, ValueError):
+        return jsonify({'error': 'capacity and load must be integers'}), 400
+    if data.get('ip'):
+        server.ip_address = str(data['ip'])[:45]
+    server.last_heartbeat = datetime.utcnow()
+    db.session.commit()
+    return jsonify({'success': True, 'server': server.to_dict(), 'assigned_users': server.users.count()})
+
+@app.route('/api/servers')
+@login_required
+def api_servers():
+    servers = StreamServer.query.order_by(StreamServer.name).all()
+    counts = dict(db.session.query(User.server_id, db.func.count(User.id)).group_by(User.server_id).all())
+    return jsonify([{**server.to_dict(), 'assigned_users': counts.get(server.id, 0)} for server in servers])
+
 @app.route('/api/auth/<token>')
 def api_auth(token):
     user = User.query.filter_by(token=token).first()
@@ -1542,19 +2663,22 @@ def generate_playlist(token, output_format='m3u8'):
     if not user or not user.is_active or user.is_expired():
         abort(403)
 
+    # Cloudflare reads Cache-Tag to purge all playlists of a catalog version, or one user's
+    headers = {'Content-Type': 'application/vnd.apple.mpegurl; charset=utf-8', 'Cache-Tag': playlist_cache_tags(user)}
+
     # Only include channels from the active M3U source
     active_source_id = get_active_source_id()
     if not active_source_id:
         # No active source - return empty playlist
-        return "#EXTM3U\n", 200, {'Content-Type': 'application/vnd.apple.mpegurl; charset=utf-8'}
+        return "#EXTM3U\n", 200, headers
 
     allowed_categories = get_allowed_categories()
-    channels_query = Channel.query.filter_by(is_active=True, source_id=active_source_id)
+    channels_query = Channel.query.filter_by(is_active=True).filter(Channel.in_source(active_source_id))
     if allowed_categories:
         channels_query = channels_query.filter(Channel.category.in_(allowed_categories))
     channels = channels_query.order_by(Channel.category, Channel.name).all()
     stream_domain = Settings.get('stream_domain', request.host)
-    format_template = channel_stream_template()
+    format_template = stream_template_for_server(server_for_user(user))
 
     # Normalize output format
     if output_format in ['ts', 'mpegts']:
@@ -1585,7 +2709,7 @@ def generate_playlist(token, output_format='m3u8'):
     user.last_access = datetime.utcnow()
     db.session.commit()
 
-    return m3u, 200, {'Content-Type': 'application/vnd.apple.mpegurl; charset=utf-8'}
+    return m3u, 200, headers
 
 # ============================================================================
 # SYSTEM
@@ -1628,7 +2752,7 @@ def api_stats():
     active_source_id = get_active_source_id()
     total_channels = 0
     if active_source_id:
-        total_channels = Channel.query.filter_by(is_active=True, source_id=active_source_id).count()
+        total_channels = Channel.query.filter_by(is_active=True).filter(Channel.in_source(active_source_id)).count()
 
     return jsonify({
         'total_users': User.query.count(),
@@ -1639,6 +2763,51 @@ def api_stats():
         ).count()
     })
 
+@app.route('/api/streaming/stats')
+@login_required
+def api_streaming_stats():
+    return jsonify(StreamingService.pool_stats())
+
+@app.route('/api/cloudflare/purges')
+@login_required
+def api_cloudflare_purges():
+    """Purge queue counters: URLs queued versus API calls made."""
+    if not purge_queue:
+        return jsonify({'enabled': False})
+    return jsonify({'enabled': True, **purge_queue.stats()})
+
+@app.route('/api/m3u-sources/<int:source_id>/import')
+@login_required
+def api_m3u_source_import(source_id):
+    """Checkpoint of a background import (rows parsed, inserted, shared and synced) plus its job state."""
+    source = M3USource.query.get_or_404(source_id)
+    progress = import_progress(source)
+    return jsonify({
+        'source_id': source.id,
+        'name': source.name,
+        'status': progress.get('status') or source.import_status,
+        'parsed': progress.get('total', 0),
+        'inserted': progress.get('imported', 0),
+        'shared': progress.get('shared', 0),
+        'skipped': progress.get('skipped', 0),
+        'synced': progress.get('synced'),
+        'progress': progress,
+        'job': job_status('m3u_import', source.id),
+    })
+
+@app.route('/api/streaming/reconcile', methods=['GET', 'POST'])
+@login_required
+def api_streaming_reconcile():
+    """Last reconciliation result; POST queues a new run."""
+    if request.method == 'POST':
+        success, message = dispatch_job('reconcile', 'manual', {'repair': request.args.get('repair', '1') != '0'})
+        return jsonify({'success': success, 'message': message, 'job': job_status('reconcile', 'manual')})
+    try:
+        state = json.loads(Settings.get('reconcile_state') or '{}')
+    except json.JSONDecodeError:
+        state = {}
+    return jsonify({'state': state, 'job': job_status('reconcile', 'periodic')})
+
 # ============================================================================
 # INITIALIZATION
 # ============================================================================
@@ -1666,6 +2835,99 @@ def init_db():
         if Settings.get('setup_complete') is None:
             Settings.set('setup_complete', 'false')
 
+@app.cli.command('run-worker')
+@click.option('--once', is_flag=True, help='Exit when no jobs are due instead of polling forever.')
+@click.option('--poll-interval', type=float, default=1.0, show_default=True)
+def run_worker_command(once, poll_interval):
+    """Process queued streaming sync and Cloudflare purge jobs."""
+    if not job_queue:
+        raise click.ClickException('Redis is not available; side effects run inline and no worker is needed.')
+    click.echo(f"Worker started, {job_queue.pending_count()} jobs pending")
+    job_queue.run_worker(app=app, poll_interval=poll_interval, once=once, periodic=PERIODIC_JOBS)
+
+@app.cli.command('pull-channels')
+@click.option('--force', is_flag=True, help='Ignore the stored ETag/cursor and re-read the whole catalog.')
+def pull_channels_command(force):
+    """Pull channel changes from the streaming API once."""
+    click.echo(sync_channels_from_streaming(force=force))
+
+@app.cli.command('user-snapshot')
+@click.option('--full', is_flag=True, help='Rebuild from scratch instead of updating the previous file.')
+@click.option('--no-push', is_flag=True, help='Only write the local file.')
+def user_snapshot_command(full, no_push):
+    """Regenerate the binary subscriber snapshot and push it to the streaming server."""
+    click.echo(publish_user_snapshot(full=full, push=not no_push))
+
+@app.cli.command('reconcile')
+@click.option('--dry-run', is_flag=True, help='Only report drift, do not re-sync anything.')
+def reconcile_command(dry_run):
+    """Compare users and channels with the streaming server and re-sync what drifted."""
+    click.echo(json.dumps(run_reconciliation(repair=not dry_run), indent=2, default=str))
+
+@app.cli.command('purge-flush')
+@click.option('--force', is_flag=True, help='Flush now instead of waiting for the debounce window.')
+def purge_flush_command(force):
+    """Flush queued Cloudflare purges and print the queue counters."""
+    if not purge_queue:
+        raise click.ClickException('Redis is not available; purges run inline.')
+    success, detail = run_purge_flush_job('manual', {'force': force})
+    click.echo(f"{'OK' if success else 'FAILED'}: {detail}")
+    click.echo(json.dumps(purge_queue.stats(), indent=2))
+
+@app.cli.command('refresh-sources')
+@click.option('--source', 'source_id', type=int, default=None, help='Refresh this source even if it is not due.')
+@click.option('--force', is_flag=True, help='Ignore ETag/Last-Modified and the content hash.')
+def refresh_sources_command(source_id, force):
+    """Re-fetch URL-backed M3U sources whose refresh interval elapsed and apply the changes."""
+    success, detail = run_source_refresh_job(str(source_id) if source_id else 'periodic', {'force': force})
+    click.echo(f"{'OK' if success else 'FAILED'}: {detail}")
+
+@app.cli.command('server-add')
+@click.argument('name')
+@click.argument('domain')
+@click.option('--capacity', type=int, default=1000, show_default=True, help='Concurrent connections the server can carry.')
+@click.option('--ip', default=None)
+def server_add_command(name, domain, capacity, ip):
+    """Register a streaming server (run servers-rebalance afterwards to move users onto it)."""
+    if StreamServer.query.filter_by(name=name).first():
+        raise click.ClickException(f'Server {name} already exists')
+    db.session.add(StreamServer(name=name, domain=domain, capacity=capacity, ip_address=ip))
+    db.session.commit()
+    click.echo(f'Registered {name} ({domain}, capacity {capacity})')
+
+@app.cli.command('server-drain')
+@click.argument('name')
+@click.option('--undo', is_flag=True, help='Accept subscribers again.')
+def server_drain_command(name, undo):
+    """Stop assigning users to a server (run servers-rebalance to move its users away)."""
+    server = StreamServer.query.filter_by(name=name).first()
+    if not server:
+        raise click.ClickException(f'Unknown server {name}')
+    server.is_draining = not undo
+    db.session.commit()
+    click.echo(f"{name} is {'accepting users' if undo else 'draining'}")
+
+@app.cli.command('servers-rebalance')
+@click.option('--dry-run', is_flag=True, help='Only report how many users would move.')
+def servers_rebalance_command(dry_run):
+    """Reassign subscribers to streaming servers by consistent hashing."""
+    click.echo(json.dumps(rebalance_servers(dry_run=dry_run), indent=2))
+
+@app.cli.command('import-users')
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+@click.option('--format', 'fmt', type=click.Choice(user_import.FORMATS), default=None, help='Input format (default: by extension).')
+@click.option('--workers', type=int, default=None, help='Password hashing processes (default: CPU count).')
+def import_users_command(path, fmt, workers):
+    """Bulk-import subscribers from a CSV or NDJSON file."""
+    with open(path, 'rb') as handle:
+        fmt = fmt or user_import.detect_format(path)
+        for event in run_user_import(user_import.decode_lines(handle), fmt, workers=workers):
+            if event['event'] == 'error':
+                click.echo(f"  line {event['line']}: {event.get('username') or '-'}: {event['error']}", err=True)
+            else:
+                click.echo(f"{event['event']}: {event['processed']} processed, {event['created']} created, {event['failed']} failed")
+        SystemLog.log('INFO', 'USER', f"Bulk import from {os.path.basename(path)}: {event['created']} created, {event['failed']} failed")
+
 if __name__ == '__main__':
     init_db()
     app.run(host='0.0.0.0', port=5000, debug=True)
@@ -6,6 +6,7 @@ from flask_sqlalchemy import SQLAlchemy
 from flask_login import UserMixin
 from datetime import datetime, timedelta
 import secrets
+import json
 import bcrypt
 
 db = SQLAlchemy()
@@ -44,9 +45,11 @@ class User(db.Model):
     max_connections = db.Column(db.Integer, default=1)
     
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, index=True)
     last_access = db.Column(db.DateTime)
     total_bandwidth_mb = db.Column(db.Integer, default=0)
     notes = db.Column(db.Text)
+    server_id = db.Column(db.Integer, db.ForeignKey('stream_servers.id'), nullable=True, index=True)
     
     connections = db.relationship('Connection', backref='user', lazy=True, cascade='all, delete-orphan')
 
@@ -99,6 +102,49 @@ class Connection(db.Model):
         return (datetime.utcnow() - self.last_heartbeat).seconds < 120
 
 
+class StreamServer(db.Model):
+    """Streaming edge servers that subscribers are assigned to"""
+    __tablename__ = 'stream_servers'
+
+    # A server that reported heartbeats but went quiet this long is treated as down
+    HEARTBEAT_TIMEOUT = timedelta(seconds=90)
+
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(50), unique=True, nullable=False)
+    domain = db.Column(db.String(255), nullable=False)  # Host used in the subscriber's stream URLs
+    ip_address = db.Column(db.String(45))
+    capacity = db.Column(db.Integer, default=1000)  # Concurrent connections the server can carry
+    current_load = db.Column(db.Integer, default=0)  # Connections reported by the last heartbeat
+    is_active = db.Column(db.Boolean, default=True, index=True)
+    is_draining = db.Column(db.Boolean, default=False)
+    last_heartbeat = db.Column(db.DateTime)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    users = db.relationship('User', backref='server', lazy='dynamic')
+
+    def is_available(self):
+        """Whether the server may receive subscribers (registered-only servers count as up)."""
+        if not self.is_active or self.is_draining:
+            return False
+        if self.last_heartbeat is None:
+            return True
+        return datetime.utcnow() - self.last_heartbeat < self.HEARTBEAT_TIMEOUT
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'name': self.name,
+            'domain': self.domain,
+            'ip_address': self.ip_address,
+            'capacity': self.capacity,
+            'current_load': self.current_load,
+            'is_active': self.is_active,
+            'is_draining': self.is_draining,
+            'available': self.is_available(),
+            'last_heartbeat': self.last_heartbeat.isoformat() if self.last_heartbeat else None,
+        }
+
+
 class M3USource(db.Model):
     """M3U source providers - each uploaded M3U list becomes a source"""
     __tablename__ = 'm3u_sources'
@@ -111,9 +157,40 @@ class M3USource(db.Model):
     detected_attributes = db.Column(db.Text)  # JSON string of detected M3U attributes
     field_mapping = db.Column(db.Text)  # JSON string of user's field mapping
     description = db.Column(db.String(255))
+    # Background import: queued/importing/syncing/failed/done (NULL for sources imported before jobs)
+    import_status = db.Column(db.String(20))
+    import_checkpoint = db.Column(db.Text)  # JSON progress, committed together with each batch
+    # URL-backed sources are re-fetched every ``refresh_interval`` minutes (0 = never)
+    origin_url = db.Column(db.String(1000))
+    refresh_interval = db.Column(db.Integer, default=0)
+    etag = db.Column(db.String(255))
+    last_modified = db.Column(db.String(64))
+    content_hash = db.Column(db.String(64))  # SHA-256 of the last applied playlist body
+    refreshed_at = db.Column(db.DateTime)
+    refresh_status = db.Column(db.String(255))
+    # Set when a delete was requested; the worker detaches the channels in batches and then drops the row
+    deleted_at = db.Column(db.DateTime)
 
-    # Relationship to channels
-    channels = db.relationship('Channel', backref='m3u_source', lazy=True, cascade='all, delete-orphan')
+    # Channels are shared between sources with identical entries (see SourceChannel)
+    channels = db.relationship('Channel', secondary='m3u_source_channels', lazy='dynamic', viewonly=True)
+    # The database removes memberships itself (ON DELETE CASCADE); never load them just to delete them
+    memberships = db.relationship('SourceChannel', lazy='dynamic', cascade='all, delete-orphan', passive_deletes=True)
+
+    @property
+    def import_progress(self):
+        """Parsed ``import_checkpoint`` (empty when the source has none)"""
+        try:
+            return json.loads(self.import_checkpoint) if self.import_checkpoint else {}
+        except ValueError:
+            return {}
+
+    @property
+    def is_importing(self):
+        return self.import_status in ('queued', 'importing', 'syncing')
+
+    @property
+    def is_deleting(self):
+        return self.deleted_at is not None
 
     @staticmethod
     def get_active():
@@ -134,6 +211,10 @@ class M3USource(db.Model):
         return False
 
 
+# Numeric ids for imported channels; databases without sequences count up from the highest id
+channel_import_id_seq = db.Sequence('channel_import_id_seq', start=1000, metadata=db.metadata)
+
+
 class Channel(db.Model):
     """Available channels"""
     __tablename__ = 'channels'
@@ -150,14 +231,30 @@ class Channel(db.Model):
     view_count = db.Column(db.Integer, default=0)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
 
-    # Foreign key to M3U source
-    source_id = db.Column(db.Integer, db.ForeignKey('m3u_sources.id'), nullable=True, index=True)
+    # Normalized content hash of imported channels; identical entries of different sources share one row
+    content_hash = db.Column(db.String(40), unique=True, index=True)
+
+    # Foreign key to the M3U source that first imported the channel (membership lives in SourceChannel)
+    source_id = db.Column(db.Integer, db.ForeignKey('m3u_sources.id', ondelete='SET NULL'), nullable=True, index=True)
+
+    @staticmethod
+    def in_source(source_id):
+        """Filter clause for the channels an M3U source lists"""
+        return Channel.id.in_(db.select(SourceChannel.channel_pk).where(SourceChannel.source_id == source_id))
 
     def increment_views(self):
         self.view_count += 1
         db.session.commit()
 
 
+class SourceChannel(db.Model):
+    """Membership of a channel in an M3U source"""
+    __tablename__ = 'm3u_source_channels'
+
+    source_id = db.Column(db.Integer, db.ForeignKey('m3u_sources.id', ondelete='CASCADE'), primary_key=True)
+    channel_pk = db.Column(db.Integer, db.ForeignKey('channels.id', ondelete='CASCADE'), primary_key=True, index=True)
+
+
 class SystemLog(db.Model):
     """System logs"""
     __tablename__ = 'logs'
@@ -0,0 +1,26 @@
+"""Add import status and checkpoint to m3u_sources for background imports
+
+Revision ID: a5d7c3e91b08
+Revises: f3b8d61c2a57
+Create Date: 2026-10-19 13:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a5d7c3e91b08'
+down_revision = 'f3b8d61c2a57'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('m3u_sources', sa.Column('import_status', sa.String(length=20), nullable=True))
+    op.add_column('m3u_sources', sa.Column('import_checkpoint', sa.Text(), nullable=True))
+
+
+def downgrade():
+    op.drop_column('m3u_sources', 'import_checkpoint')
+    op.drop_column('m3u_sources', 'import_status')
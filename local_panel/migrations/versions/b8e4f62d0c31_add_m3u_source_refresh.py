@@ -0,0 +1,32 @@
+"""Add origin URL and conditional refresh state to m3u_sources
+
+Revision ID: b8e4f62d0c31
+Revises: a5d7c3e91b08
+Create Date: 2026-10-19 14:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b8e4f62d0c31'
+down_revision = 'a5d7c3e91b08'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('m3u_sources', sa.Column('origin_url', sa.String(length=1000), nullable=True))
+    op.add_column('m3u_sources', sa.Column('refresh_interval', sa.Integer(), nullable=True, server_default='0'))
+    op.add_column('m3u_sources', sa.Column('etag', sa.String(length=255), nullable=True))
+    op.add_column('m3u_sources', sa.Column('last_modified', sa.String(length=64), nullable=True))
+    op.add_column('m3u_sources', sa.Column('content_hash', sa.String(length=64), nullable=True))
+    op.add_column('m3u_sources', sa.Column('refreshed_at', sa.DateTime(), nullable=True))
+    op.add_column('m3u_sources', sa.Column('refresh_status', sa.String(length=255), nullable=True))
+
+
+def downgrade():
+    for column in ('refresh_status', 'refreshed_at', 'content_hash', 'last_modified', 'etag',
+                   'refresh_interval', 'origin_url'):
+        op.drop_column('m3u_sources', column)
@@ -0,0 +1,27 @@
+"""Add users.updated_at for incremental subscriber snapshots
+
+Revision ID: c4e1a9d27f3b
+Revises: bc878764dfa4
+Create Date: 2026-10-19 10:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c4e1a9d27f3b'
+down_revision = 'bc878764dfa4'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('users', sa.Column('updated_at', sa.DateTime(), nullable=True))
+    op.execute("UPDATE users SET updated_at = COALESCE(created_at, CURRENT_TIMESTAMP)")
+    op.create_index(op.f('ix_users_updated_at'), 'users', ['updated_at'], unique=False)
+
+
+def downgrade():
+    op.drop_index(op.f('ix_users_updated_at'), table_name='users')
+    op.drop_column('users', 'updated_at')
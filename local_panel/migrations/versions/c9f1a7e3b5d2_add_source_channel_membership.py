@@ -0,0 +1,77 @@
+"""Content-addressed channels shared between M3U sources through m3u_source_channels
+
+Revision ID: c9f1a7e3b5d2
+Revises: b8e4f62d0c31
+Create Date: 2026-10-19 15:00:00.000000
+
+"""
+import hashlib
+import json
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c9f1a7e3b5d2'
+down_revision = 'b8e4f62d0c31'
+branch_labels = None
+depends_on = None
+
+FIELDS = ('name', 'category', 'source_url', 'logo_url', 'epg_id', 'quality')
+
+
+def _content_hash(row, channel_id):
+    # Same digest as services.channel_import.content_hash
+    values = [channel_id] + [' '.join((row[field] or '').split()) for field in FIELDS]
+    return hashlib.sha1('\x1f'.join(values).encode('utf-8')).hexdigest()
+
+
+def upgrade():
+    op.create_table(
+        'm3u_source_channels',
+        sa.Column('source_id', sa.Integer(), nullable=False),
+        sa.Column('channel_pk', sa.Integer(), nullable=False),
+        sa.ForeignKeyConstraint(['source_id'], ['m3u_sources.id'], ondelete='CASCADE'),
+        sa.ForeignKeyConstraint(['channel_pk'], ['channels.id'], ondelete='CASCADE'),
+        sa.PrimaryKeyConstraint('source_id', 'channel_pk'),
+    )
+    op.create_index(op.f('ix_m3u_source_channels_channel_pk'), 'm3u_source_channels', ['channel_pk'], unique=False)
+    op.add_column('channels', sa.Column('content_hash', sa.String(length=40), nullable=True))
+
+    bind = op.get_bind()
+    bind.execute(sa.text(
+        "INSERT INTO m3u_source_channels (source_id, channel_pk) "
+        "SELECT source_id, id FROM channels WHERE source_id IS NOT NULL"
+    ))
+
+    # Hash imported channels; existing duplicates stay separate rows without a hash
+    uses_ids = set()
+    for source_id, mapping in bind.execute(sa.text("SELECT id, field_mapping FROM m3u_sources")):
+        try:
+            if json.loads(mapping or '{}').get('tvg-id') == 'channel_id':
+                uses_ids.add(source_id)
+        except ValueError:
+            continue
+    seen = set()
+    updates = []
+    rows = bind.execute(sa.text(
+        f"SELECT id, channel_id, source_id, {', '.join(FIELDS)} FROM channels WHERE source_id IS NOT NULL ORDER BY id"
+    )).mappings()
+    for row in rows:
+        digest = _content_hash(row, row['channel_id'] if row['source_id'] in uses_ids else '')
+        if digest not in seen:
+            seen.add(digest)
+            updates.append({'pk': row['id'], 'digest': digest})
+    statement = sa.text("UPDATE channels SET content_hash = :digest WHERE id = :pk")
+    for start in range(0, len(updates), 1000):
+        bind.execute(statement, updates[start:start + 1000])
+
+    op.create_index(op.f('ix_channels_content_hash'), 'channels', ['content_hash'], unique=True)
+
+
+def downgrade():
+    op.drop_index(op.f('ix_channels_content_hash'), table_name='channels')
+    op.drop_column('channels', 'content_hash')
+    op.drop_index(op.f('ix_m3u_source_channels_channel_pk'), table_name='m3u_source_channels')
+    op.drop_table('m3u_source_channels')
@@ -0,0 +1,29 @@
+"""Let the database detach channels from deleted M3U sources; mark sources being deleted
+
+Revision ID: d4e8b2a6f1c9
+Revises: c9f1a7e3b5d2
+Create Date: 2026-10-19 17:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd4e8b2a6f1c9'
+down_revision = 'c9f1a7e3b5d2'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('m3u_sources', sa.Column('deleted_at', sa.DateTime(), nullable=True))
+    op.drop_constraint('fk_channels_source_id', 'channels', type_='foreignkey')
+    op.create_foreign_key('fk_channels_source_id', 'channels', 'm3u_sources', ['source_id'], ['id'],
+                          ondelete='SET NULL')
+
+
+def downgrade():
+    op.drop_constraint('fk_channels_source_id', 'channels', type_='foreignkey')
+    op.create_foreign_key('fk_channels_source_id', 'channels', 'm3u_sources', ['source_id'], ['id'])
+    op.drop_column('m3u_sources', 'deleted_at')
@@ -0,0 +1,47 @@
+"""Add stream server registry and per-user server assignment
+
+Revision ID: e7a2f05b9c14
+Revises: c4e1a9d27f3b
+Create Date: 2026-10-19 11:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e7a2f05b9c14'
+down_revision = 'c4e1a9d27f3b'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('stream_servers',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('name', sa.String(length=50), nullable=False),
+    sa.Column('domain', sa.String(length=255), nullable=False),
+    sa.Column('ip_address', sa.String(length=45), nullable=True),
+    sa.Column('capacity', sa.Integer(), nullable=True),
+    sa.Column('current_load', sa.Integer(), nullable=True),
+    sa.Column('is_active', sa.Boolean(), nullable=True),
+    sa.Column('is_draining', sa.Boolean(), nullable=True),
+    sa.Column('last_heartbeat', sa.DateTime(), nullable=True),
+    sa.Column('created_at', sa.DateTime(), nullable=True),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('name')
+    )
+    op.create_index(op.f('ix_stream_servers_is_active'), 'stream_servers', ['is_active'], unique=False)
+
+    op.add_column('users', sa.Column('server_id', sa.Integer(), nullable=True))
+    op.create_index(op.f('ix_users_server_id'), 'users', ['server_id'], unique=False)
+    op.create_foreign_key('fk_users_server_id', 'users', 'stream_servers', ['server_id'], ['id'])
+
+
+def downgrade():
+    op.drop_constraint('fk_users_server_id', 'users', type_='foreignkey')
+    op.drop_index(op.f('ix_users_server_id'), table_name='users')
+    op.drop_column('users', 'server_id')
+
+    op.drop_index(op.f('ix_stream_servers_is_active'), table_name='stream_servers')
+    op.drop_table('stream_servers')
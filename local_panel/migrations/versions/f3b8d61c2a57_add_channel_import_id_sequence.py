@@ -0,0 +1,32 @@
+"""Add sequence for imported channel ids
+
+Revision ID: f3b8d61c2a57
+Revises: e7a2f05b9c14
+Create Date: 2026-10-19 12:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'f3b8d61c2a57'
+down_revision = 'e7a2f05b9c14'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    bind = op.get_bind()
+    if bind.dialect.name != 'postgresql':
+        return
+    # Continue after the highest numeric id the old max()+1 scheme handed out
+    start = bind.execute(sa.text(
+        "SELECT COALESCE(MAX(channel_id::bigint), 999) + 1 FROM channels WHERE channel_id ~ '^[0-9]{1,18}$'"
+    )).scalar()
+    op.execute(f"CREATE SEQUENCE IF NOT EXISTS channel_import_id_seq START WITH {max(int(start), 1000)}")
+
+
+def downgrade():
+    if op.get_bind().dialect.name == 'postgresql':
+        op.execute("DROP SEQUENCE IF EXISTS channel_import_id_seq")
@@ -0,0 +1,205 @@
+#!/usr/bin/env python3
+"""Check the #EXTINF tokenizer against a plain reference and the former regexes, then time it.
+
+Usage:
+    python scripts/m3u_extinf_check.py [--fuzz 200000] [--lines 100000] [--seed 1]
+
+1. Random lines built from quotes, commas, ``=`` and key fragments must give
+   the same ``(name, attributes)`` as a character-by-character reference
+   implementation of the tokenizer rules.
+2. Provider-style lines are compared with the previous two-regex parser.
+   Every difference must fall into one of the documented divergences:
+   a comma inside a quoted value, ``key="value"`` text in the display name,
+   a pair nested in a quoted value, or a stray quote (such as an apostrophe
+   before the attributes) that now opens a quoted span. A line that has a
+   name with the former parser but no comma outside a quoted span (such as
+   ``tvg-name=O'Brien tvg-id="x",O'Brien TV``) must keep that name: the
+   tokenizer reads it the former way instead of dropping the channel.
+3. A microbenchmark reports the time per line of both implementations.
+
+Exits with status 1 on any mismatch.
+"""
+import argparse
+import os
+import random
+import re
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from services import m3u  # noqa: E402
+
+_DOUBLE_QUOTED = re.compile(r'([\w-]+)="([^"]*)"')
+_SINGLE_QUOTED = re.compile(r"([\w-]+)='([^']*)'")
+_WORD = re.compile(r'[\w-]')
+_PAIR_TEXT = re.compile(r'''[\w-]+=["']''')
+
+
+def legacy(line):
+    """The parser before the tokenizer: two attribute regexes and the first comma as name start."""
+    attrs = {}
+    if '"' in line:
+        for name, value in _DOUBLE_QUOTED.findall(line):
+            attrs[name] = value
+    if "'" in line:
+        for name, value in _SINGLE_QUOTED.findall(line):
+            attrs.setdefault(name, value)
+    comma = line.find(',')
+    return (line[comma + 1:].strip() if comma != -1 else ''), attrs
+
+
+def reference(line):
+    """The tokenizer rules, one character at a time."""
+    doubles, singles = {}, {}
+    name = None
+    index = 0
+    while index < len(line):
+        char = line[index]
+        if char == ',':
+            name = line[index + 1:].strip()
+            break
+        end = index
+        while end < len(line) and _WORD.match(line[end]):
+            end += 1
+        if end > index and line[end:end + 1] == '=' and line[end + 1:end + 2] in ('"', "'"):
+            quote = line[end + 1]
+            close = line.find(quote, end + 2)
+            if close != -1:
+                if quote == '"':
+                    doubles[line[index:end]] = line[end + 2:close]
+                else:
+                    singles.setdefault(line[index:end], line[end + 2:close])
+                index = close + 1
+                continue
+        if char in ('"', "'"):
+            close = line.find(char, index + 1)
+            if close != -1:
+                index = close + 1
+                continue
+        index += 1
+    if name is None:
+        if ',' in line:
+            return legacy(line)
+        name = ''
+    for key, value in singles.items():
+        doubles.setdefault(key, value)
+    return name, doubles
+
+
+def divergence(line, name):
+    """The documented reason why the former parser reads ``line`` differently, or None."""
+    values, stray = [], False
+    for match in m3u._EXTINF_TOKEN.finditer(line):
+        if match.group(3) is not None:
+            break
+        if match.group(1):
+            values.append(match.group(2)[1:-1])
+        else:
+            stray = True
+            values.append(match.group(0)[1:-1])
+    if any(',' in value for value in values):
+        return 'comma inside a quoted value'
+    if _PAIR_TEXT.search(name):
+        return 'key="value" text in the display name'
+    if any(_PAIR_TEXT.search(value) for value in values):
+        return 'pair nested in a quoted value'
+    if stray:
+        return 'quote outside a key=value pair opening a quoted span'
+    return None
+
+
+FRAGMENTS = ['#EXTINF:-1', ' ', ' ', 'tvg-id', 'group-title', 'tvg-name', 'a', 'x1', '-', '_', '=', '=', '"', '"',
+             "'", "'", ',', ',', 'Music, Live', 'http://h/p?x=1,2', "Children's", 'é', 'قناة', '="', "='", ':', '0']
+
+
+def fuzz_line(rng):
+    return ''.join(rng.choice(FRAGMENTS) for _ in range(rng.randint(0, 24)))
+
+
+GROUPS = ['Sports', 'News', 'Movies', 'Kids', 'Music, Live', 'UK | Entertainment', "Children's", 'VOD: Drama']
+NAMES = ['BBC One HD', "Men's Channel", 'Sky Sports 1 FHD', 'Canal+ [FR]', 'ESPN 2', 'Live: Match, Part 1', '']
+
+
+def provider_line(rng, index):
+    attrs = [f'tvg-id="ch{index}.tv"', f'tvg-name="{rng.choice(NAMES)}"',
+             f'tvg-logo="http://logos.example.com/{index}.png"', f'group-title="{rng.choice(GROUPS)}"']
+    if rng.random() < 0.1:
+        attrs.append(f"tvg-country='{rng.choice(['UK', 'FR', 'US'])}'")
+    if rng.random() < 0.1:
+        attrs.append(f'catchup="default" catchup-days="{rng.randint(1, 7)}" tvg-shift="-2"')
+    if rng.random() < 0.05:
+        attrs.append('tvg-logo=""')
+    if rng.random() < 0.02:
+        attrs.append(f"tvg-name={rng.choice(['O', 'D', 'L'])}'{rng.choice(['Brien', 'Arcy', 'Equipe'])}")
+    rng.shuffle(attrs)
+    duration = rng.choice(['-1', '0', '-1 '])
+    return f'#EXTINF:{duration} {" ".join(attrs)},{rng.choice(NAMES)}'
+
+
+def bench(function, lines, repeat):
+    best = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        for line in lines:
+            function(line)
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return best / len(lines) * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--fuzz', type=int, default=200000, help='Random lines checked against the reference')
+    parser.add_argument('--lines', type=int, default=100000, help='Provider-style lines compared and timed')
+    parser.add_argument('--repeat', type=int, default=5, help='Benchmark runs; the fastest is kept')
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+    rng = random.Random(args.seed)
+    failures = 0
+
+    for _ in range(args.fuzz):
+        line = fuzz_line(rng)
+        if m3u._extinf(line) != reference(line):
+            failures += 1
+            if failures <= 10:
+                print(f'Reference mismatch: {line!r}\n  tokenizer {m3u._extinf(line)!r}\n  reference {reference(line)!r}')
+    print(f'Fuzz: {args.fuzz} random lines, {failures} differ from the reference')
+
+    lines = [provider_line(rng, index) for index in range(args.lines)]
+    lines += [fuzz_line(rng) for _ in range(args.lines // 10)]
+    reasons = {}
+    unexplained = 0
+    lost = 0
+    for line in lines:
+        result = m3u._extinf(line)
+        if result == legacy(line):
+            continue
+        name_comma = any(match.group(3) is not None for match in m3u._EXTINF_TOKEN.finditer(line))
+        if legacy(line)[0] and not result[0] and not name_comma:
+            lost += 1
+            if lost <= 10:
+                print(f'Name lost: {line!r}\n  tokenizer {result!r}\n  legacy    {legacy(line)!r}')
+            continue
+        reason = divergence(line, result[0])
+        if reason is None:
+            unexplained += 1
+            if unexplained <= 10:
+                print(f'Unexplained difference: {line!r}\n  tokenizer {result!r}\n  legacy    {legacy(line)!r}')
+        else:
+            reasons[reason] = reasons.get(reason, 0) + 1
+    print(f'Legacy: {len(lines)} lines, {sum(reasons.values())} documented divergences, {unexplained} unexplained, '
+          f'{lost} names lost')
+    for reason, count in sorted(reasons.items()):
+        print(f'  {count:>8}  {reason}')
+    failures += unexplained + lost
+
+    provider = lines[:args.lines]
+    before = bench(legacy, provider, args.repeat)
+    after = bench(m3u._extinf, provider, args.repeat)
+    print(f'Per line: legacy {before:.2f} us, tokenizer {after:.2f} us, speedup {before / after:.2f}x')
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+"""Time sequential vs. multi-process M3U parsing and record the speedup per worker count.
+
+Usage:
+    python scripts/m3u_parse_bench.py [--file playlist.m3u] [--entries 500000]
+                                      [--workers 1,2,4,8] [--output bench.json]
+
+Without ``--file`` a synthetic provider list is generated. Every parallel run
+is checked against the sequential result before its time is reported.
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from services import m3u  # noqa: E402
+
+
+def synthetic(entries, seed=1):
+    rng = random.Random(seed)
+    groups = ['Sports', 'News', 'Movies', 'Kids', 'Music, Live', 'Documentary']
+    lines = ['#EXTM3U']
+    for index in range(entries):
+        lines.append(
+            f'#EXTINF:-1 tvg-id="ch{index}.tv" tvg-name="Channel {index}" '
+            f'tvg-logo="http://logos.example.com/{index}.png" group-title="{rng.choice(groups)}",'
+            f'Channel {index} {rng.choice(["HD", "FHD", "SD", "4K"])}'
+        )
+        lines.append(f'http://provider.example.com:8080/live/user/pass/{index}.ts')
+    return '\n'.join(lines) + '\n'
+
+
+def timed(parse, repeat):
+    best = None
+    result = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = parse()
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--file', help='Playlist to parse instead of a synthetic one')
+    parser.add_argument('--entries', type=int, default=500000, help='Entries in the synthetic playlist')
+    parser.add_argument('--workers', default=','.join(str(n) for n in (1, 2, 4, 8) if n <= (os.cpu_count() or 1)) or '1',
+                        help='Comma-separated worker counts to time')
+    parser.add_argument('--repeat', type=int, default=3, help='Runs per measurement; the fastest is kept')
+    parser.add_argument('--output', help='Write the results as JSON to this file')
+    args = parser.parse_args()
+
+    if args.file:
+        with open(args.file, 'rb') as handle:
+            text = m3u.read_text(handle)
+    else:
+        text = synthetic(args.entries)
+    print(f'Playlist: {len(text) / 1024 / 1024:.1f} MiB, {os.cpu_count()} CPUs')
+
+    def sequential():
+        detected = set()
+        return list(m3u.iter_entries(m3u.iter_lines(text), detected)), detected
+
+    base, expected = timed(sequential, args.repeat)
+    print(f'{"workers":>8} {"seconds":>9} {"speedup":>8}')
+    print(f'{"seq":>8} {base:>9.2f} {1:>8.2f}')
+    results = {'bytes': len(text), 'entries': len(expected[0]), 'cpus': os.cpu_count(),
+               'sequential': round(base, 3), 'parallel': []}
+
+    for workers in (int(value) for value in args.workers.split(',') if value.strip()):
+        def parallel():
+            detected = set()
+            return list(m3u.parse_parallel(text, detected, workers)), detected
+
+        elapsed, result = timed(parallel, args.repeat)
+        if result != expected:
+            print(f'Parallel output with {workers} workers differs from the sequential parser', file=sys.stderr)
+            return 1
+        speedup = base / elapsed if elapsed else 0.0
+        print(f'{workers:>8} {elapsed:>9.2f} {speedup:>8.2f}')
+        results['parallel'].append({'workers': workers, 'seconds': round(elapsed, 3), 'speedup': round(speedup, 2)})
+
+    if args.output:
+        with open(args.output, 'w') as handle:
+            json.dump(results, handle, indent=2)
+        print(f'Results written to {args.output}')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,211 @@
+#!/usr/bin/env python3
+"""Check the streaming M3U parser against the former whole-text parser and its memory bound.
+
+Usage:
+    python scripts/m3u_parse_check.py [--entries 20000] [--memory-lines 500000] [--seed 1]
+
+1. Generated playlists (provider lines, blank lines and comments between an
+   ``#EXTINF`` and its URL, plain URL lines, entries without name or URL,
+   ``\\r\\n`` endings, no final newline) are parsed from ``str``, ``bytes``,
+   gzip-compressed ``bytes`` and a chunk iterator. Entries and detected
+   attributes must equal those of ``parse_m3u_content`` as it was before the
+   parser moved to ``services/m3u.py``.
+2. A playlist of ``--memory-lines`` lines is streamed from a chunk generator
+   under ``tracemalloc``; the peak must stay below ``--max-peak`` MiB while
+   the text alone is many times larger.
+
+Exits with status 1 on any mismatch or when the memory bound is exceeded.
+"""
+import argparse
+import gzip
+import os
+import random
+import re
+import sys
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from services import m3u  # noqa: E402
+
+
+def parse_m3u_content(m3u_content):
+    """The former parser from app.py, kept verbatim as the reference."""
+    lines = m3u_content.split('\n')
+    channels = []
+    detected_attrs = set()
+
+    i = 0
+    while i < len(lines):
+        line = lines[i].strip()
+
+        # Skip empty lines and comments (but not EXTINF)
+        if not line or (line.startswith('#') and not line.startswith('#EXTINF')):
+            i += 1
+            continue
+
+        if line.startswith('#EXTINF'):
+            # Extract all attributes using flexible regex (handles both single and double quotes)
+            attrs = {}
+
+            # Extract attributes with double quotes
+            for match in re.finditer(r'([\w-]+)="([^"]*)"', line):
+                attr_name = match.group(1)
+                attr_value = match.group(2)
+                attrs[attr_name] = attr_value
+                detected_attrs.add(attr_name)
+
+            # Extract attributes with single quotes
+            for match in re.finditer(r"([\w-]+)='([^']*)'", line):
+                attr_name = match.group(1)
+                attr_value = match.group(2)
+                if attr_name not in attrs:  # Don't override double-quoted values
+                    attrs[attr_name] = attr_value
+                    detected_attrs.add(attr_name)
+
+            # Extract channel name (after the last comma)
+            name_match = re.search(r',(.+)$', line)
+            channel_name = name_match.group(1).strip() if name_match else ''
+
+            # Find the URL (skip empty lines after EXTINF)
+            url = None
+            j = i + 1
+            while j < len(lines):
+                potential_url = lines[j].strip()
+                if potential_url and not potential_url.startswith('#'):
+                    url = potential_url
+                    break
+                j += 1
+
+            if url and channel_name:  # Only add if we have both URL and name
+                channels.append({
+                    'name': channel_name,
+                    'url': url,
+                    'attributes': attrs
+                })
+
+            i = j + 1 if url else i + 1
+        else:
+            # Handle plain TXT format (just URLs)
+            if line.startswith('http') or line.startswith('rtmp'):
+                channels.append({
+                    'name': f'Channel {len(channels) + 1}',
+                    'url': line,
+                    'attributes': {}
+                })
+            i += 1
+
+    return channels, detected_attrs
+
+
+# Quoted values without commas or nested pairs: the documented #EXTINF divergences are
+# covered by scripts/m3u_extinf_check.py, this check is about the line and entry handling
+GROUPS = ['Sports', 'News', 'Movies', 'Kids', 'UK | Entertainment', 'VOD: Drama', '']
+NAMES = ['BBC One HD', 'Sky Sports 1 FHD', 'Canal+ [FR]', 'ESPN 2', 'Live: Match, Part 1', 'قناة', '']
+
+
+def extinf(rng, index):
+    attrs = [f'tvg-id="ch{index}.tv"', f'tvg-name="{rng.choice(NAMES).replace(",", "")}"',
+             f'tvg-logo="http://logos.example.com/{index}.png"', f'group-title="{rng.choice(GROUPS)}"']
+    if rng.random() < 0.1:
+        attrs.append(f"tvg-country='{rng.choice(['UK', 'FR', 'US'])}'")
+    if rng.random() < 0.05:
+        attrs.append(f'catchup="default" catchup-days="{rng.randint(1, 7)}"')
+    rng.shuffle(attrs)
+    return f'#EXTINF:-1 {" ".join(attrs)},{rng.choice(NAMES)}'
+
+
+def playlist(rng, entries):
+    lines = ['#EXTM3U x-tvg-url="http://epg.example.com/guide.xml"']
+    for index in range(entries):
+        roll = rng.random()
+        if roll < 0.05:
+            lines.append(rng.choice(['http', 'rtmp']) + f'://plain.example.com/{index}.ts')
+            continue
+        lines.append(extinf(rng, index))
+        if roll < 0.10:
+            lines.append(rng.choice(['', '   ', '#EXTVLCOPT:http-user-agent=VLC', '#EXTGRP:News']))
+        elif roll < 0.12:
+            # A second #EXTINF before the URL is skipped like a comment
+            lines.append(extinf(rng, -index))
+        if roll < 0.99:
+            lines.append(f'  http://provider.example.com:8080/live/user/pass/{index}.ts ')
+    newline = rng.choice(['\n', '\r\n'])
+    return newline.join(lines) + rng.choice(['', newline])
+
+
+def chunked(data, rng):
+    position = 0
+    while position < len(data):
+        size = rng.randint(1, 4096)
+        yield data[position:position + size]
+        position += size
+
+
+def check(text, rng):
+    expected_entries, expected_attrs = parse_m3u_content(text)
+    data = text.encode('utf-8')
+    inputs = {
+        'str': text,
+        'bytes': data,
+        'gzip': gzip.compress(data),
+        'chunks': chunked(data, rng),
+        'gzip chunks': chunked(gzip.compress(data), rng),
+    }
+    failures = 0
+    for label, source in inputs.items():
+        entries, attrs = m3u.parse_all(source)
+        if [entry.to_dict() for entry in entries] != expected_entries or attrs != expected_attrs:
+            failures += 1
+            print(f'{label}: {len(entries)} entries / {len(expected_entries)} expected, '
+                  f'attributes {sorted(attrs ^ expected_attrs)} differ')
+    return failures
+
+
+def memory_lines(count):
+    """``count`` playlist lines as UTF-8 chunks, generated on the fly."""
+    batch = []
+    for index in range(count // 2):
+        batch.append(f'#EXTINF:-1 tvg-id="ch{index}.tv" tvg-logo="http://logos.example.com/{index}.png" '
+                     f'group-title="Sports",Channel {index}\nhttp://provider.example.com/live/{index}.ts\n')
+        if len(batch) == 256:
+            yield ''.join(batch).encode('utf-8')
+            batch = []
+    if batch:
+        yield ''.join(batch).encode('utf-8')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--entries', type=int, default=20000, help='Entries per generated playlist')
+    parser.add_argument('--playlists', type=int, default=5, help='Generated playlists compared')
+    parser.add_argument('--memory-lines', type=int, default=500000, help='Lines of the streamed playlist')
+    parser.add_argument('--max-peak', type=float, default=4, help='Allowed tracemalloc peak in MiB')
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+    rng = random.Random(args.seed)
+    failures = 0
+
+    for _ in range(args.playlists):
+        failures += check(playlist(rng, args.entries), rng)
+    print(f'Equivalence: {args.playlists} playlists x 5 input forms, {failures} mismatches')
+
+    size = sum(len(chunk) for chunk in memory_lines(args.memory_lines))
+    tracemalloc.start()
+    count = 0
+    for _ in m3u.stream(memory_lines(args.memory_lines), workers=1):
+        count += 1
+    peak = tracemalloc.get_traced_memory()[1] / 1024 / 1024
+    tracemalloc.stop()
+    print(f'Memory: {args.memory_lines} lines ({size / 1024 / 1024:.1f} MiB), {count} entries, '
+          f'peak {peak:.2f} MiB (limit {args.max_peak} MiB)')
+    if count != args.memory_lines // 2:
+        print(f'Expected {args.memory_lines // 2} entries')
+        failures += 1
+    if peak > args.max_peak:
+        failures += 1
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,363 @@
+"""Bulk channel import from parsed M3U entries into content-addressed channels."""
+from __future__ import annotations
+
+import csv
+import hashlib
+import io
+import logging
+import os
+import re
+import time
+from collections import deque
+from datetime import datetime
+from itertools import islice
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Tuple
+
+from sqlalchemy import delete, exists, insert, text
+
+from database.models import db, Channel, SourceChannel, channel_import_id_seq
+
+from .m3u import Entry
+
+LOGGER = logging.getLogger(__name__)
+
+BATCH_SIZE = 1000
+FIRST_ID = 1000
+# Imports at least this large use COPY on PostgreSQL
+COPY_THRESHOLD = int(os.environ.get("CHANNEL_IMPORT_COPY_THRESHOLD", "20000") or 20000)
+# Rows per COPY when every batch is committed (resumable background imports)
+COPY_BATCH_SIZE = 50000
+# Rounds of new ids for COPY rows whose channel id was taken by another writer
+COPY_ID_RETRIES = 3
+CHANNEL_FIELDS = ("name", "category", "source_url", "logo_url", "epg_id", "quality")
+COPY_COLUMNS = ("channel_id",) + CHANNEL_FIELDS + ("content_hash",)
+_UNSAFE_ID = re.compile(r"[^a-zA-Z0-9_-]")
+
+# ``on_batch(stats)`` runs after every batch is written; committing there makes the batch durable
+OnBatch = Callable[[Dict[str, Any]], None]
+
+
+class ChannelIdConflict(RuntimeError):
+    """Raised when imported channels keep colliding with channel ids written by someone else."""
+
+
+class IdAllocator:
+    """Hand out numeric channel ids that are not taken yet.
+
+    On PostgreSQL ids come from ``channel_import_id_seq`` in blocks of
+    ``BATCH_SIZE``; elsewhere they count up from the highest numeric id in
+    ``existing``. Ids already in ``existing`` are skipped either way.
+    """
+
+    def __init__(self, existing: set, block: int = BATCH_SIZE):
+        self.existing = existing
+        self.block = block
+        self.use_sequence = db.engine.dialect.name == "postgresql"
+        self._buffer: deque = deque()
+        numeric = [int(channel_id) for channel_id in existing if channel_id.isdigit() and len(channel_id) < 19]
+        self._next = max(numeric + [FIRST_ID - 1]) + 1
+
+    def _refill(self) -> None:
+        if self.use_sequence:
+            rows = db.session.execute(
+                text(f"SELECT nextval('{channel_import_id_seq.name}') FROM generate_series(1, :n)"),
+                {"n": self.block},
+            )
+            self._buffer.extend(value for (value,) in rows)
+        else:
+            self._buffer.extend(range(self._next, self._next + self.block))
+            self._next += self.block
+
+    def take(self) -> str:
+        while True:
+            if not self._buffer:
+                self._refill()
+            channel_id = str(self._buffer.popleft())
+            if channel_id not in self.existing:
+                return channel_id
+
+
+def existing_channels() -> Tuple[set, Dict[str, Tuple[int, str]]]:
+    """All channel ids, and ``content hash -> (primary key, channel id)`` for hashed channels."""
+    ids: set = set()
+    hashes: Dict[str, Tuple[int, str]] = {}
+    for pk, channel_id, digest in db.session.query(Channel.id, Channel.channel_id, Channel.content_hash):
+        ids.add(channel_id)
+        if digest:
+            hashes[digest] = (pk, channel_id)
+    return ids, hashes
+
+
+def linked_hashes(source_id: int) -> set:
+    """Content hashes of the channels ``source_id`` already references (a resumed import skips them)."""
+    query = (db.session.query(Channel.content_hash)
+             .join(SourceChannel, SourceChannel.channel_pk == Channel.id)
+             .filter(SourceChannel.source_id == source_id, Channel.content_hash.isnot(None)))
+    return {digest for (digest,) in query}
+
+
+def channel_row(entry: Entry, mapping: Dict[str, str]) -> Dict[str, Any]:
+    """Map one entry onto channel columns (before an id is chosen)."""
+    values = {
+        "name": entry.name,
+        "source_url": entry.url,
+        "category": "Imported",
+        "logo_url": "",
+        "epg_id": "",
+        "quality": "medium",
+    }
+    for m3u_attr, db_field in mapping.items():
+        if db_field in values and entry.attributes.get(m3u_attr):
+            values[db_field] = entry.attributes[m3u_attr]
+    return {
+        "name": values["name"][:100],
+        "category": values["category"][:50],
+        "source_url": values["source_url"][:500],
+        "logo_url": values["logo_url"][:500] or None,
+        "epg_id": values["epg_id"][:100] or None,
+        "quality": values["quality"][:20] or "medium",
+    }
+
+
+def content_hash(row: Dict[str, Any], channel_id: str = "") -> str:
+    """Content address of a channel: its stored fields plus the id the playlist asked for, if any.
+
+    Runs of whitespace are collapsed first, so entries that only differ in
+    spacing share one channel.
+    """
+    values = [channel_id] + [" ".join((row.get(column) or "").split()) for column in CHANNEL_FIELDS]
+    return hashlib.sha1("\x1f".join(values).encode("utf-8")).hexdigest()
+
+
+def proposed_id(entry: Entry, mapping: Dict[str, str]) -> str:
+    """The sanitized ``tvg-id`` when the mapping uses it as channel id, else ''."""
+    if mapping.get("tvg-id") != "channel_id" or not entry.attributes.get("tvg-id"):
+        return ""
+    return _UNSAFE_ID.sub("", entry.attributes["tvg-id"])[:50]
+
+
+def choose_engine(total: int) -> str:
+    """``"copy"`` for large imports on PostgreSQL through psycopg2, ``"insert"`` otherwise."""
+    dialect = db.engine.dialect
+    if dialect.name == "postgresql" and dialect.driver == "psycopg2" and total >= COPY_THRESHOLD:
+        return "copy"
+    return "insert"
+
+
+def _rows(entries: Iterable[Entry], mapping: Dict[str, str], existing: set, hashes: Dict[str, Tuple[int, str]],
+          seen: set, allocator: IdAllocator, stats: Dict[str, Any]) -> Iterator[Dict[str, Any]]:
+    """Yield one row per distinct entry; rows of channels that already exist carry their ``pk``."""
+    for entry in entries:
+        row = channel_row(entry, mapping)
+        wanted = proposed_id(entry, mapping)
+        digest = content_hash(row, wanted)
+        if digest in seen:
+            # Listed twice in this playlist: one membership is enough
+            stats["skipped"] += 1
+            continue
+        seen.add(digest)
+        if digest in hashes:
+            pk, channel_id = hashes[digest]
+            yield {**row, "channel_id": channel_id, "content_hash": digest, "pk": pk}
+            continue
+        channel_id = wanted
+        # A taken tvg-id falls back to a generated id instead of dropping the channel
+        if not channel_id or channel_id in existing:
+            channel_id = allocator.take()
+        existing.add(channel_id)
+        yield {**row, "channel_id": channel_id, "content_hash": digest, "pk": None}
+
+
+class _CsvReader:
+    """File-like object ``copy_expert`` reads from, rendering CSV rows on demand."""
+
+    def __init__(self, rows: Iterator[Dict[str, Any]]):
+        self.rows = rows
+        self.count = 0
+        self._buffer = io.StringIO()
+        self._writer = csv.writer(self._buffer, lineterminator="\n")
+
+    def read(self, size: int = -1) -> str:
+        while size < 0 or self._buffer.tell() < size:
+            row = next(self.rows, None)
+            if row is None:
+                break
+            # None becomes an empty unquoted field, which COPY's CSV format reads as NULL
+            self._writer.writerow([row[column] for column in COPY_COLUMNS])
+            self.count += 1
+        data = self._buffer.getvalue()
+        rest = ""
+        if 0 <= size < len(data):
+            data, rest = data[:size], data[size:]
+        self._buffer.seek(0)
+        self._buffer.truncate()
+        self._buffer.write(rest)
+        return data
+
+
+def _insert_batches(rows: Iterator[Dict[str, Any]], source_id: int, now: datetime, batch_size: int,
+                    stats: Dict[str, Any], on_batch: OnBatch | None = None) -> None:
+    pending: List[Dict[str, Any]] = []
+    links: List[int] = []
+    reported_skips = 0
+
+    def flush() -> None:
+        nonlocal reported_skips
+        if pending:
+            created = db.session.execute(insert(Channel).returning(Channel.id), pending)
+            links.extend(pk for (pk,) in created)
+        db.session.execute(insert(SourceChannel), [{"source_id": source_id, "channel_pk": pk} for pk in links])
+        stats["imported"] += len(pending)
+        stats["shared"] += len(links) - len(pending)
+        stats["batches"] += 1
+        pending.clear()
+        links.clear()
+        reported_skips = stats["skipped"]
+        if on_batch:
+            on_batch(stats)
+
+    for row in rows:
+        pk = row.pop("pk")
+        if pk is None:
+            pending.append({**row, "source_id": source_id, "is_active": True, "view_count": 0, "created_at": now})
+        else:
+            links.append(pk)
+        if len(pending) + len(links) >= batch_size:
+            flush()
+    if pending or links:
+        flush()
+    elif on_batch and stats["skipped"] != reported_skips:
+        # Duplicates after the last batch still count as consumed entries
+        on_batch(stats)
+
+
+def _copy(rows: Iterator[Dict[str, Any]], source_id: int, now: datetime, stats: Dict[str, Any],
+          allocator: IdAllocator) -> None:
+    """Stream rows into a temp table with COPY, then merge them with one INSERT ... SELECT.
+
+    A row whose channel id another writer took while we were copying gets a
+    newly allocated id, like a taken ``tvg-id`` in :func:`_rows`; rows that
+    still cannot be inserted after ``COPY_ID_RETRIES`` rounds raise
+    :class:`ChannelIdConflict` instead of being dropped.
+    """
+    columns = ", ".join(COPY_COLUMNS)
+    # Left over by an earlier segment of the same transaction when the caller did not commit
+    db.session.execute(text("DROP TABLE IF EXISTS channel_import_staging"))
+    db.session.execute(text(
+        "CREATE TEMP TABLE channel_import_staging ("
+        "channel_id varchar(50), name varchar(100), category varchar(50), source_url varchar(500), "
+        "logo_url varchar(500), epg_id varchar(100), quality varchar(20), content_hash varchar(40)) ON COMMIT DROP"
+    ))
+    reader = _CsvReader(rows)
+    cursor = db.session.connection().connection.cursor()
+    try:
+        cursor.copy_expert(f"COPY channel_import_staging ({columns}) FROM STDIN WITH (FORMAT csv)", reader)
+    finally:
+        cursor.close()
+    created = 0
+    for attempt in range(COPY_ID_RETRIES + 1):
+        # Rows of existing channels conflict on their content hash and only get linked below
+        created += db.session.execute(text(
+            f"INSERT INTO channels ({columns}, source_id, is_active, view_count, created_at) "
+            f"SELECT {columns}, :source_id, true, 0, :created_at FROM channel_import_staging "
+            "ON CONFLICT DO NOTHING"
+        ), {"source_id": source_id, "created_at": now}).rowcount
+        conflicts = [digest for (digest,) in db.session.execute(text(
+            "SELECT content_hash FROM channel_import_staging WHERE NOT EXISTS "
+            "(SELECT 1 FROM channels WHERE channels.content_hash = channel_import_staging.content_hash)"
+        ))]
+        if not conflicts:
+            break
+        if attempt == COPY_ID_RETRIES:
+            raise ChannelIdConflict(f"{len(conflicts)} channels could not be given a free channel id")
+        LOGGER.warning("Channel import: %d channel ids were taken during COPY, allocating new ones", len(conflicts))
+        db.session.execute(
+            text("UPDATE channel_import_staging SET channel_id = :channel_id WHERE content_hash = :content_hash"),
+            [{"channel_id": allocator.take(), "content_hash": digest} for digest in conflicts],
+        )
+    linked = db.session.execute(text(
+        "INSERT INTO m3u_source_channels (source_id, channel_pk) "
+        "SELECT :source_id, channels.id FROM channel_import_staging "
+        "JOIN channels ON channels.content_hash = channel_import_staging.content_hash "
+        "ON CONFLICT DO NOTHING"
+    ), {"source_id": source_id}).rowcount
+    stats["imported"] += created
+    stats["shared"] += linked - created
+    # Memberships another writer added for this source in the meantime
+    stats["skipped"] += reader.count - linked
+    if reader.count:
+        stats["batches"] += 1
+
+
+def import_channels(entries: Iterable[Entry], source_id: int, mapping: Dict[str, str],
+                    total: int | None = None, engine: str | None = None,
+                    batch_size: int = BATCH_SIZE, on_batch: OnBatch | None = None) -> Dict[str, Any]:
+    """Add ``entries`` to ``source_id`` without committing.
+
+    Entries whose content hash matches an existing channel only get a
+    membership row; the others become new channels. Existing channel ids and
+    hashes are loaded with one query and checked in memory. The
+    ``"insert"`` engine writes one executemany INSERT per batch; ``"copy"``
+    streams everything through COPY into a temp table first, or in segments of
+    ``COPY_BATCH_SIZE`` rows when ``on_batch`` is given. ``engine`` defaults to
+    :func:`choose_engine` for ``total`` entries. ``on_batch`` is called with the
+    running counts after each batch. Returns counts and the throughput for the
+    import log.
+    """
+    started = time.perf_counter()
+    engine = engine or choose_engine(total or 0)
+    existing, hashes = existing_channels()
+    stats = {"engine": engine, "imported": 0, "shared": 0, "skipped": 0, "batches": 0}
+    allocator = IdAllocator(existing, batch_size)
+    rows = _rows(entries, mapping, existing, hashes, linked_hashes(source_id), allocator, stats)
+    now = datetime.utcnow()
+
+    if engine == "copy" and on_batch is None:
+        _copy(rows, source_id, now, stats, allocator)
+    elif engine == "copy":
+        while True:
+            written = stats["imported"] + stats["shared"] + stats["skipped"]
+            _copy(islice(rows, COPY_BATCH_SIZE), source_id, now, stats, allocator)
+            if stats["imported"] + stats["shared"] + stats["skipped"] == written:
+                break
+            on_batch(stats)
+    else:
+        _insert_batches(rows, source_id, now, batch_size, stats, on_batch)
+
+    elapsed = max(time.perf_counter() - started, 1e-6)
+    stats["seconds"] = round(elapsed, 2)
+    stats["rate"] = round(stats["imported"] / elapsed)
+    return stats
+
+
+def remove_orphans(channel_pks: Iterable[int], chunk: int = BATCH_SIZE) -> List[str]:
+    """Delete the given channels that no source references any more; returns their channel ids."""
+    pks = list(channel_pks)
+    removed: List[str] = []
+    for start in range(0, len(pks), chunk):
+        orphaned = (Channel.id.in_(pks[start:start + chunk])
+                    & ~exists().where(SourceChannel.channel_pk == Channel.id))
+        rows = db.session.execute(delete(Channel).where(orphaned).returning(Channel.channel_id))
+        removed.extend(channel_id for (channel_id,) in rows)
+    return removed
+
+
+def detach_source_batch(source_id: int, limit: int = BATCH_SIZE) -> Dict[str, int]:
+    """Detach up to ``limit`` channels from a source that is being deleted (without committing).
+
+    Drops that many memberships, deletes the channels no other source lists
+    and clears ``source_id`` on up to ``limit`` surviving channels the source
+    first imported. Every count is zero once nothing refers to the source, so
+    callers commit after each batch and stop there; each transaction only
+    locks one batch of rows.
+    """
+    pks = [pk for (pk,) in db.session.query(SourceChannel.channel_pk)
+           .filter(SourceChannel.source_id == source_id).limit(limit)]
+    if pks:
+        db.session.execute(delete(SourceChannel).where(SourceChannel.source_id == source_id,
+                                                       SourceChannel.channel_pk.in_(pks)))
+    removed = remove_orphans(pks)
+    detached = [pk for (pk,) in db.session.query(Channel.id).filter(Channel.source_id == source_id).limit(limit)]
+    if detached:
+        db.session.execute(Channel.__table__.update().where(Channel.id.in_(detached)).values(source_id=None))
+    return {"unlinked": len(pks), "removed": len(removed), "detached": len(detached)}
@@ -3,12 +3,29 @@ from __future__ import annotations
 
 import logging
 import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 from typing import Iterable, List, Tuple, Any
 
 import requests
+from requests.adapters import HTTPAdapter
 
 LOGGER = logging.getLogger(__name__)
 API_BASE = "https://api.cloudflare.com/client/v4"
+# Cloudflare accepts at most 30 URLs per purge_cache request (more on Enterprise plans).
+PURGE_BATCH_SIZE = 30
+PURGE_CONCURRENCY = 4
+# Attempts per chunk when Cloudflare answers 429 or 5xx
+PURGE_ATTEMPTS = 4
+MAX_RETRY_AFTER = 60
+
+_SESSION: requests.Session | None = None
+_SESSION_PID: int | None = None
+_SESSION_LOCK = threading.Lock()
+# Shared pause after a rate-limit response, so concurrent chunks back off together
+_PAUSE_LOCK = threading.Lock()
+_PAUSE_UNTIL = 0.0
 
 
 def _config() -> Tuple[str, str]:
@@ -17,6 +34,50 @@ def _config() -> Tuple[str, str]:
     return zone_id, token
 
 
+def _int_env(name: str, default: int) -> int:
+    try:
+        value = int(os.environ.get(name, "") or default)
+    except (TypeError, ValueError):
+        return default
+    return value if value > 0 else default
+
+
+def _session() -> requests.Session:
+    """Return this process's keep-alive session for the Cloudflare API."""
+    global _SESSION, _SESSION_PID
+    pid = os.getpid()
+    with _SESSION_LOCK:
+        if _SESSION is None or _SESSION_PID != pid:
+            session = requests.Session()
+            pool_size = _int_env("CLOUDFLARE_PURGE_CONCURRENCY", PURGE_CONCURRENCY)
+            session.mount("https://", HTTPAdapter(pool_connections=1, pool_maxsize=pool_size))
+            _SESSION, _SESSION_PID = session, pid
+        return _SESSION
+
+
+def _retry_delay(response: requests.Response, attempt: int) -> float:
+    """Seconds to wait before retrying, from ``Retry-After`` or a short exponential backoff."""
+    raw = response.headers.get("Retry-After") or response.headers.get("ratelimit-reset")
+    try:
+        delay = float(raw) if raw else 0.0
+    except ValueError:
+        delay = 0.0
+    return min(delay or 2 ** attempt, MAX_RETRY_AFTER)
+
+
+def _pause(seconds: float) -> None:
+    global _PAUSE_UNTIL
+    with _PAUSE_LOCK:
+        _PAUSE_UNTIL = max(_PAUSE_UNTIL, time.monotonic() + seconds)
+
+
+def _wait_for_rate_limit() -> None:
+    with _PAUSE_LOCK:
+        remaining = _PAUSE_UNTIL - time.monotonic()
+    if remaining > 0:
+        time.sleep(remaining)
+
+
 def _normalize_domain(domain: str | None) -> str | None:
     if not domain:
         return None
@@ -43,7 +104,27 @@ class CloudflareService:
         url_list = [u for u in urls if u]
         if not url_list:
             return True, "No URLs provided"
+        return CloudflareService._purge({"files": url_list})
+
+    @staticmethod
+    def purge_tags(tags: Iterable[str]) -> Tuple[bool, Any]:
+        """Purge every cached response whose origin sent one of ``tags`` in ``Cache-Tag``."""
+        tag_list = list(dict.fromkeys(t for t in tags if t))
+        if not tag_list:
+            return True, "No tags provided"
+        return CloudflareService._purge({"tags": tag_list})
 
+    @staticmethod
+    def purge_prefixes(prefixes: Iterable[str]) -> Tuple[bool, Any]:
+        """Purge every cached URL under ``host/path`` prefixes (given without scheme)."""
+        prefix_list = list(dict.fromkeys(p for p in prefixes if p))
+        if not prefix_list:
+            return True, "No prefixes provided"
+        return CloudflareService._purge({"prefixes": prefix_list})
+
+    @staticmethod
+    def _purge(body: dict) -> Tuple[bool, Any]:
+        """POST one purge_cache request over the pooled session, honouring rate limits."""
         zone_id, token = _config()
         if not zone_id or not token:
             return True, "Cloudflare not configured"
@@ -54,21 +135,78 @@ class CloudflareService:
             "Content-Type": "application/json",
         }
 
-        try:
-            response = requests.post(endpoint, headers=headers, json={"files": url_list}, timeout=15)
-            response.raise_for_status()
-            data = response.json()
-            if data.get("success", True):
-                return True, data
-            return False, data.get("errors", data)
-        except Exception as exc:  # noqa: BLE001
-            LOGGER.exception("Cloudflare purge failed for %s", url_list)
-            return False, str(exc)
+        for attempt in range(PURGE_ATTEMPTS):
+            _wait_for_rate_limit()
+            try:
+                response = _session().post(endpoint, headers=headers, json=body, timeout=15)
+                if response.status_code == 429 or response.status_code >= 500:
+                    delay = _retry_delay(response, attempt)
+                    if attempt + 1 < PURGE_ATTEMPTS:
+                        LOGGER.warning("Cloudflare purge got %s, retrying in %.1fs", response.status_code, delay)
+                        if response.status_code == 429:
+                            _pause(delay)
+                        else:
+                            time.sleep(delay)
+                        continue
+                response.raise_for_status()
+                if response.headers.get("ratelimit-remaining") == "0":
+                    _pause(_retry_delay(response, attempt))
+                data = response.json()
+                if data.get("success", True):
+                    return True, data
+                return False, data.get("errors", data)
+            except Exception as exc:  # noqa: BLE001
+                LOGGER.exception("Cloudflare purge failed for %s", body)
+                return False, str(exc)
+        return False, "Cloudflare purge retries exhausted"
+
+    @staticmethod
+    def purge_urls_batched(urls: Iterable[str], batch_size: int | None = None,
+                           concurrency: int | None = None, stats: dict | None = None) -> Tuple[bool, Any]:
+        """Purge any number of URLs: dedupe, split into API-sized chunks, send chunks concurrently.
+
+        Returns one summary instead of a result per chunk, so callers can log a single entry.
+        ``stats``, when given, receives the URL and API request counts.
+        """
+        url_list = list(dict.fromkeys(u for u in urls if u))
+        if not url_list:
+            return True, "No URLs provided"
+        zone_id, token = _config()
+        if not zone_id or not token:
+            return True, "Cloudflare not configured"
+
+        batch_size = batch_size or _int_env("CLOUDFLARE_PURGE_BATCH_SIZE", PURGE_BATCH_SIZE)
+        concurrency = concurrency or _int_env("CLOUDFLARE_PURGE_CONCURRENCY", PURGE_CONCURRENCY)
+        chunks = [url_list[start:start + batch_size] for start in range(0, len(url_list), batch_size)]
+        if stats is not None:
+            stats.update(urls=len(url_list), requests=len(chunks))
+
+        started = time.perf_counter()
+        if len(chunks) == 1:
+            results = [CloudflareService.purge_urls(chunks[0])]
+        else:
+            with ThreadPoolExecutor(max_workers=min(concurrency, len(chunks))) as executor:
+                results = list(executor.map(CloudflareService.purge_urls, chunks))
+        elapsed = time.perf_counter() - started
+
+        failures = [str(detail) for success, detail in results if not success]
+        if failures:
+            return False, f"{len(failures)}/{len(chunks)} purge batches failed: {failures[0]}"
+        return True, f"Purged {len(url_list)} URLs in {len(chunks)} requests ({elapsed:.1f}s)"
 
     @staticmethod
     def playlist_urls(domain: str, tokens: Iterable[str]) -> List[str]:
         return [_build_full_url(domain, f"playlist/{token}.m3u8") for token in tokens]
 
+    @staticmethod
+    def playlist_prefixes(domain: str) -> List[str]:
+        """Prefixes covering every subscriber playlist (token and Xtream-style URLs)."""
+        base = _normalize_domain(domain)
+        if not base:
+            return []
+        host = base.split("://", 1)[1]
+        return [f"{host}/playlist/", f"{host}/get.php"]
+
     @staticmethod
     def channel_urls(domain: str, channel_id: str) -> List[str]:
         return [
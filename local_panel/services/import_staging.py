@@ -0,0 +1,182 @@
+"""Parsed M3U imports staged between the analyse and confirm steps."""
+from __future__ import annotations
+
+import json
+import logging
+import os
+import re
+import shutil
+import tempfile
+import time
+import zlib
+from typing import Any, Dict, Iterable, Iterator, List, Set
+
+from .m3u import Entry
+
+LOGGER = logging.getLogger(__name__)
+
+TTL = 3600
+# Entries per compressed chunk
+CHUNK_ENTRIES = 5000
+PREVIEW_ENTRIES = 5
+_IMPORT_ID = re.compile(r"^[A-Za-z0-9_-]{8,64}$")
+
+
+class ImportStaging:
+    """Store a parsed catalog once as zlib-compressed JSON chunks keyed by import id.
+
+    Uses Redis when a binary (``decode_responses=False``) client is given and a
+    temp directory otherwise, so nothing large ever lands in the cookie session.
+
+    * ``import:<id>:meta``      JSON: total, detected attributes, preview, chunk count
+    * ``import:<id>:chunk-<n>`` zlib(JSON list of ``[name, url, attributes]``)
+
+    The directory store keeps the same entries as ``<dir>/<id>/meta`` and ``<dir>/<id>/chunk-<n>``.
+    """
+
+    def __init__(self, client=None, directory: str | None = None, ttl: int = TTL):
+        self.client = client
+        self.directory = directory or os.path.join(tempfile.gettempdir(), "iptv-imports")
+        self.ttl = ttl
+
+    @staticmethod
+    def _check(import_id: str) -> str:
+        if not import_id or not _IMPORT_ID.match(import_id):
+            raise ValueError("Invalid import id")
+        return import_id
+
+    def _path(self, import_id: str, name: str = "") -> str:
+        return os.path.join(self.directory, self._check(import_id), name)
+
+    def _put(self, import_id: str, name: str, data: bytes) -> None:
+        if self.client is not None:
+            self.client.setex(f"import:{self._check(import_id)}:{name}", self.ttl, data)
+            return
+        path = self._path(import_id, name)
+        with open(f"{path}.tmp", "wb") as handle:
+            handle.write(data)
+        os.replace(f"{path}.tmp", path)
+
+    def _get(self, import_id: str, name: str) -> bytes | None:
+        if self.client is not None:
+            return self.client.get(f"import:{self._check(import_id)}:{name}")
+        path = self._path(import_id, name)
+        try:
+            if time.time() - os.path.getmtime(path) > self.ttl:
+                return None
+            with open(path, "rb") as handle:
+                return handle.read()
+        except FileNotFoundError:
+            return None
+
+    def stage(self, import_id: str, entries: Iterable[Entry], detected_attrs: Set[str]) -> Dict[str, Any]:
+        """Consume ``entries`` chunk by chunk and store them with their metadata.
+
+        ``detected_attrs`` is read after ``entries`` is exhausted, so it may be the
+        set a streaming parser is still filling. Returns the stored metadata.
+        """
+        self._check(import_id)
+        if self.client is None:
+            self._expire_directories()
+            os.makedirs(self._path(import_id), exist_ok=True)
+        chunk: List[list] = []
+        chunks = total = 0
+        preview: List[Dict[str, Any]] = []
+        try:
+            for entry in entries:
+                if len(preview) < PREVIEW_ENTRIES:
+                    preview.append(entry.to_dict())
+                chunk.append([entry.name, entry.url, entry.attributes])
+                total += 1
+                if len(chunk) >= CHUNK_ENTRIES:
+                    self._put(import_id, f"chunk-{chunks}", _pack(chunk))
+                    chunks += 1
+                    chunk = []
+            if chunk:
+                self._put(import_id, f"chunk-{chunks}", _pack(chunk))
+                chunks += 1
+            meta = {"total": total, "chunks": chunks, "detected_attrs": sorted(detected_attrs), "preview": preview}
+            self._put(import_id, "meta", json.dumps(meta).encode("utf-8"))
+        except Exception:
+            try:
+                self.delete(import_id, chunks + 1)
+            except Exception:  # noqa: BLE001
+                LOGGER.warning("Could not clean up failed import %s", import_id)
+            raise
+        return meta
+
+    def meta(self, import_id: str | None) -> Dict[str, Any] | None:
+        if not import_id or not _IMPORT_ID.match(import_id):
+            return None
+        raw = self._get(import_id, "meta")
+        return json.loads(raw) if raw else None
+
+    def entries(self, import_id: str, meta: Dict[str, Any] | None = None, start: int = 0) -> Iterator[Entry]:
+        """Stream the staged entries back in their original order, beginning at entry ``start``.
+
+        Chunks before ``start`` are not read at all, so resuming a large import is cheap.
+        """
+        meta = meta or self.meta(import_id)
+        if not meta:
+            return
+        first, skip = divmod(start, CHUNK_ENTRIES)
+        for index in range(first, meta["chunks"]):
+            raw = self._get(import_id, f"chunk-{index}")
+            if raw is None:
+                raise LookupError(f"Import {import_id} chunk {index} expired")
+            records = json.loads(zlib.decompress(raw))
+            for name, url, attributes in records[skip:] if skip else records:
+                yield Entry(name, url, attributes)
+            skip = 0
+
+    def keep(self, import_id: str, seconds: int, meta: Dict[str, Any] | None = None) -> bool:
+        """Extend the lifetime of a staged import to ``seconds`` from now (for queued and resumable jobs)."""
+        meta = meta or self.meta(import_id)
+        if not meta:
+            return False
+        names = ["meta"] + [f"chunk-{index}" for index in range(meta["chunks"])]
+        if self.client is not None:
+            with self.client.pipeline() as pipe:
+                for name in names:
+                    pipe.expire(f"import:{import_id}:{name}", seconds)
+                pipe.execute()
+            return True
+        # Directory entries expire ``ttl`` seconds after their mtime, so move it ahead
+        stamp = time.time() + max(seconds - self.ttl, 0)
+        for name in names + [""]:
+            try:
+                os.utime(self._path(import_id, name), (stamp, stamp))
+            except FileNotFoundError:
+                continue
+        return True
+
+    def delete(self, import_id: str | None, chunks: int | None = None) -> None:
+        if not import_id or not _IMPORT_ID.match(import_id):
+            return
+        if self.client is None:
+            shutil.rmtree(self._path(import_id), ignore_errors=True)
+            return
+        if chunks is None:
+            meta = self.meta(import_id)
+            chunks = meta["chunks"] if meta else 0
+        keys = [f"import:{import_id}:meta"] + [f"import:{import_id}:chunk-{index}" for index in range(chunks)]
+        self.client.delete(*keys)
+
+    def _expire_directories(self) -> None:
+        """Drop directory imports older than the TTL (Redis expires its keys itself)."""
+        try:
+            names = os.listdir(self.directory)
+        except FileNotFoundError:
+            return
+        cutoff = time.time() - self.ttl
+        for name in names:
+            path = os.path.join(self.directory, name)
+            try:
+                if os.path.getmtime(path) < cutoff:
+                    shutil.rmtree(path, ignore_errors=True)
+            except OSError:
+                continue
+
+
+def _pack(chunk: List[list]) -> bytes:
+    return zlib.compress(json.dumps(chunk, separators=(",", ":")).encode("utf-8"))
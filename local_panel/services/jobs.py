@@ -0,0 +1,303 @@
+"""Redis-backed background job queue for streaming and Cloudflare side effects."""
+from __future__ import annotations
+
+import json
+import logging
+import threading
+import time
+from datetime import datetime
+from typing import Any, Callable, Dict, Tuple
+
+import redis
+
+LOGGER = logging.getLogger(__name__)
+
+Handler = Callable[[str, Dict[str, Any]], Tuple[bool, Any]]
+Merge = Callable[[Dict[str, Any], Dict[str, Any]], Dict[str, Any]]
+
+
+class JobQueue:
+    """Coalescing job queue with retries and exponential backoff.
+
+    Redis layout (``<prefix>`` defaults to ``jobs``):
+
+    * ``<prefix>:queue``   sorted set of job ids scored by the time they may run
+    * ``<prefix>:payload`` hash of job id -> JSON payload
+    * ``<prefix>:processing`` sorted set of claimed job ids scored by their lease deadline
+    * ``<prefix>:inflight`` hash of claimed job id -> JSON payload being run
+    * ``<prefix>:status:<job id>`` JSON status kept for ``STATUS_TTL`` seconds
+
+    A job id is ``<kind>:<key>`` (e.g. ``user_sync:42``), so enqueueing the same
+    kind and key while a job is still pending merges into it instead of adding a
+    second job. Handlers return ``(success, detail)``; failures are retried.
+    A claimed job keeps its payload in ``inflight`` until it finishes, and the
+    worker extends its lease while the handler runs; when a worker dies, the
+    job is queued again once its lease expires.
+    """
+
+    MAX_ATTEMPTS = 6
+    BASE_DELAY = 5  # seconds, doubled on every failed attempt
+    STATUS_TTL = 7 * 24 * 3600
+    LEASE = 300  # seconds a claimed job may go without a lease renewal
+
+    def __init__(self, client, prefix: str = "jobs"):
+        self.client = client
+        self.prefix = prefix
+        self.handlers: Dict[str, Handler] = {}
+        self.mergers: Dict[str, Merge] = {}
+
+    @property
+    def queue_key(self) -> str:
+        return f"{self.prefix}:queue"
+
+    @property
+    def payload_key(self) -> str:
+        return f"{self.prefix}:payload"
+
+    @property
+    def processing_key(self) -> str:
+        return f"{self.prefix}:processing"
+
+    @property
+    def inflight_key(self) -> str:
+        return f"{self.prefix}:inflight"
+
+    def status_key(self, job_id: str) -> str:
+        return f"{self.prefix}:status:{job_id}"
+
+    @staticmethod
+    def job_id(kind: str, key: Any) -> str:
+        return f"{kind}:{key}"
+
+    def register(self, kind: str, handler: Handler, merge: Merge | None = None) -> None:
+        """Register the handler (and optional payload merge rule) for a job kind."""
+        self.handlers[kind] = handler
+        if merge:
+            self.mergers[kind] = merge
+
+    def enqueue(self, kind: str, key: Any, payload: Dict[str, Any] | None = None, delay: float = 0) -> str:
+        """Queue a job, merging with a pending job for the same kind and key.
+
+        While the job is running its status is left alone and only flagged for a
+        re-run; ``run_job`` reports it as queued again when the current run ends.
+        """
+        job_id = self._push(kind, key, payload or {}, delay)
+        if (self._get_status(job_id) or {}).get("state") == "running":
+            self._set_status(job_id, "running", rerun=True)
+        else:
+            self._set_status(job_id, "queued", attempts=0)
+        return job_id
+
+    def _push(self, kind: str, key: Any, payload: Dict[str, Any], delay: float, retry: bool = False) -> str:
+        job_id = self.job_id(kind, key)
+        merge = self.mergers.get(kind, lambda old, new: {**old, **new})
+        run_at = time.time() + delay
+
+        with self.client.pipeline() as pipe:
+            while True:
+                try:
+                    pipe.watch(self.payload_key)
+                    current = pipe.hget(self.payload_key, job_id)
+                    if current:
+                        # A retried payload is older than anything queued since it was claimed
+                        merged = merge(payload, json.loads(current)) if retry else merge(json.loads(current), payload)
+                    else:
+                        merged = payload
+                    pipe.multi()
+                    pipe.hset(self.payload_key, job_id, json.dumps(merged))
+                    # LT keeps the earliest run time, so a new request pulls a job out of backoff
+                    pipe.zadd(self.queue_key, {job_id: run_at}, lt=True)
+                    pipe.execute()
+                    break
+                except redis.WatchError:
+                    continue
+        return job_id
+
+    def status(self, kind: str, key: Any) -> Dict[str, Any] | None:
+        return self._get_status(self.job_id(kind, key))
+
+    def _get_status(self, job_id: str) -> Dict[str, Any] | None:
+        raw = self.client.get(self.status_key(job_id))
+        return json.loads(raw) if raw else None
+
+    def _set_status(self, job_id: str, state: str, **extra: Any) -> None:
+        previous = self.client.get(self.status_key(job_id))
+        data = json.loads(previous) if previous else {}
+        data.update(extra, state=state, updated_at=datetime.utcnow().isoformat())
+        self.client.setex(self.status_key(job_id), self.STATUS_TTL, json.dumps(data))
+
+    def pending_count(self) -> int:
+        return self.client.zcard(self.queue_key)
+
+    def claim(self) -> Tuple[str, Dict[str, Any]] | None:
+        """Take the next due job off the queue under a lease, or return None.
+
+        The queue entry and payload move to ``processing``/``inflight`` in one
+        transaction, so an enqueue racing with the claim either merges into the
+        claimed payload or queues the job again with its own payload.
+        """
+        with self.client.pipeline() as pipe:
+            while True:
+                try:
+                    pipe.watch(self.queue_key, self.payload_key)
+                    due = pipe.zrangebyscore(self.queue_key, "-inf", time.time(), start=0, num=1)
+                    if not due:
+                        pipe.unwatch()
+                        return None
+                    job_id = due[0]
+                    raw = pipe.hget(self.payload_key, job_id)
+                    pipe.multi()
+                    pipe.zrem(self.queue_key, job_id)
+                    pipe.hdel(self.payload_key, job_id)
+                    if raw is not None:
+                        pipe.hset(self.inflight_key, job_id, raw)
+                        pipe.zadd(self.processing_key, {job_id: time.time() + self.LEASE})
+                    pipe.execute()
+                    break
+                except redis.WatchError:
+                    continue
+        if raw is None:
+            LOGGER.warning("Dropped queued job %s without a payload", job_id)
+            return None
+        return job_id, json.loads(raw)
+
+    def _ack(self, job_id: str) -> None:
+        """Release the lease of a finished job."""
+        with self.client.pipeline() as pipe:
+            pipe.zrem(self.processing_key, job_id)
+            pipe.hdel(self.inflight_key, job_id)
+            pipe.execute()
+
+    def _renew(self, job_id: str, stop: threading.Event) -> None:
+        """Keep extending the lease of a running job until ``stop`` is set."""
+        while not stop.wait(self.LEASE / 3):
+            try:
+                self.client.zadd(self.processing_key, {job_id: time.time() + self.LEASE}, xx=True)
+            except redis.RedisError:
+                LOGGER.warning("Could not renew the lease of job %s", job_id)
+
+    def requeue_expired(self) -> int:
+        """Queue again the claimed jobs whose lease expired because their worker died."""
+        requeued = 0
+        for job_id in self.client.zrangebyscore(self.processing_key, "-inf", time.time()):
+            kind, _, key = job_id.partition(":")
+            merge = self.mergers.get(kind, lambda old, new: {**old, **new})
+            attempts = (self._get_status(job_id) or {}).get("attempts", 0)
+            with self.client.pipeline() as pipe:
+                while True:
+                    try:
+                        pipe.watch(self.processing_key, self.payload_key)
+                        deadline = pipe.zscore(self.processing_key, job_id)
+                        if deadline is None or deadline > time.time():
+                            pipe.unwatch()
+                            raw = None
+                            break  # finished, renewed or taken over by another worker
+                        raw = pipe.hget(self.inflight_key, job_id)
+                        current = pipe.hget(self.payload_key, job_id)
+                        pipe.multi()
+                        pipe.zrem(self.processing_key, job_id)
+                        pipe.hdel(self.inflight_key, job_id)
+                        if raw is not None and attempts < self.MAX_ATTEMPTS:
+                            payload = json.loads(raw)
+                            # Like a retry: the lost payload is older than anything queued since
+                            merged = merge(payload, json.loads(current)) if current else payload
+                            pipe.hset(self.payload_key, job_id, json.dumps(merged))
+                            pipe.zadd(self.queue_key, {job_id: time.time()}, lt=True)
+                        pipe.execute()
+                        break
+                    except redis.WatchError:
+                        continue
+            if raw is None:
+                continue
+            if attempts >= self.MAX_ATTEMPTS:
+                self._set_status(job_id, "failed", last_error="Worker lost the job")
+                LOGGER.error("Job %s lost by its worker %s times, giving up", job_id, attempts)
+                continue
+            self._set_status(job_id, "retrying", last_error="Worker lost the job")
+            LOGGER.warning("Re-queued job %s after its lease expired", job_id)
+            requeued += 1
+        return requeued
+
+    def run_job(self, job_id: str, payload: Dict[str, Any]) -> bool:
+        kind, _, key = job_id.partition(":")
+        handler = self.handlers.get(kind)
+        if not handler:
+            LOGGER.error("No handler registered for job %s", job_id)
+            self._set_status(job_id, "failed", last_error="No handler registered")
+            self._ack(job_id)
+            return False
+
+        attempts = (self._get_status(job_id) or {}).get("attempts", 0) + 1
+        self._set_status(job_id, "running", attempts=attempts, rerun=False)
+        stop = threading.Event()
+        renewer = threading.Thread(target=self._renew, args=(job_id, stop), daemon=True)
+        renewer.start()
+        try:
+            success, detail = handler(key, payload)
+        except Exception as exc:  # noqa: BLE001
+            LOGGER.exception("Job %s raised", job_id)
+            success, detail = False, str(exc)
+        finally:
+            stop.set()
+            renewer.join()
+        try:
+            return self._finish(job_id, kind, key, payload, attempts, success, detail)
+        finally:
+            # Only now, after any retry was queued, so a crash in between cannot lose the job
+            self._ack(job_id)
+
+    def _finish(self, job_id: str, kind: str, key: str, payload: Dict[str, Any], attempts: int,
+                success: bool, detail: Any) -> bool:
+        """Record the outcome of a run and queue its retry when needed."""
+        if (self._get_status(job_id) or {}).get("rerun"):
+            # Enqueued again while running: the new request is already queued and starts fresh
+            if not success:
+                self._push(kind, key, payload, 0, retry=True)
+            self._set_status(job_id, "queued", attempts=0, rerun=False,
+                             last_error=None if success else str(detail)[:500])
+            return success
+
+        if success:
+            self._set_status(job_id, "done", attempts=0, last_error=None, detail=str(detail)[:500])
+            return True
+
+        if attempts >= self.MAX_ATTEMPTS:
+            self._set_status(job_id, "failed", attempts=attempts, last_error=str(detail)[:500])
+            LOGGER.error("Job %s failed permanently after %s attempts: %s", job_id, attempts, detail)
+            return False
+
+        delay = self.BASE_DELAY * 2 ** (attempts - 1)
+        self._set_status(job_id, "retrying", attempts=attempts, last_error=str(detail)[:500])
+        self._push(kind, key, payload, delay, retry=True)
+        return False
+
+    def enqueue_periodic(self, periodic: Dict[str, float]) -> None:
+        """Enqueue each ``{kind: interval seconds}`` job at most once per interval.
+
+        The SET NX EX marker is shared through Redis, so running several workers
+        does not multiply scheduled jobs.
+        """
+        for kind, interval in periodic.items():
+            if interval and self.client.set(f"{self.prefix}:periodic:{kind}", time.time(), nx=True, ex=int(interval)):
+                self.enqueue(kind, "periodic", {})
+
+    def run_worker(self, app=None, poll_interval: float = 1.0, once: bool = False,
+                   periodic: Dict[str, float] | None = None) -> None:
+        """Process jobs forever (or until the queue is drained when ``once``)."""
+        LOGGER.info("Job worker started (%s handlers)", len(self.handlers))
+        while True:
+            if periodic:
+                self.enqueue_periodic(periodic)
+            self.requeue_expired()
+            job = self.claim()
+            if job is None:
+                if once and not self.client.zcount(self.queue_key, "-inf", time.time()) \
+                    and not self.client.zcard(self.processing_key):
+                    return
+                time.sleep(poll_interval)
+                continue
+            if app is not None:
+                with app.app_context():
+                    self.run_job(*job)
+            else:
+                self.run_job(*job)
@@ -0,0 +1,427 @@
+"""Incremental M3U/TXT playlist parser with bounded memory."""
+from __future__ import annotations
+
+import codecs
+import hashlib
+import logging
+import os
+import re
+import zlib
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from itertools import chain
+from typing import Any, Dict, Iterable, Iterator, List, NamedTuple, Set, Tuple
+
+import requests
+
+LOGGER = logging.getLogger(__name__)
+
+# Provider lists beyond these limits are rejected instead of exhausting the worker
+MAX_BYTES = 512 * 1024 * 1024
+MAX_LINES = 5_000_000
+MAX_LINE_LENGTH = 64 * 1024
+CHUNK_SIZE = 64 * 1024
+FETCH_TIMEOUT = 30
+# Past this many decoded characters the rest of a playlist is parsed on PARSE_WORKERS processes (0 = one per CPU)
+PARALLEL_THRESHOLD = int(os.environ.get("M3U_PARALLEL_THRESHOLD", "33554432") or 33554432)
+PARSE_WORKERS = int(os.environ.get("M3U_PARSE_WORKERS", "0") or 0) or os.cpu_count() or 1
+# Characters per piece handed to a worker, and pieces in flight per worker: this bounds
+# the text and parsed entries held at once while keeping every process busy
+PIECE_SIZE = 1024 * 1024
+PIECES_PER_WORKER = 4
+
+_GZIP_MAGIC = b"\x1f\x8b"
+# One scan per #EXTINF line: key="value"/key='value' pairs and other quoted spans are
+# tokens, and the first comma outside them takes the rest of the line as the name
+_EXTINF_TOKEN = re.compile(r"""([\w-]+)=("[^"]*"|'[^']*')|"[^"]*"|'[^']*'|(,.*)""")
+# The former attribute patterns, used for lines whose every comma sits inside a quoted span
+_DOUBLE_QUOTED = re.compile(r'([\w-]+)="([^"]*)"')
+_SINGLE_QUOTED = re.compile(r"([\w-]+)='([^']*)'")
+
+
+class M3UParseError(ValueError):
+    """Raised when a playlist exceeds the size/line limits or cannot be decoded."""
+
+
+class Entry(NamedTuple):
+    name: str
+    url: str
+    attributes: Dict[str, str]
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {"name": self.name, "url": self.url, "attributes": self.attributes}
+
+
+def _chunks(source) -> Iterator[bytes | str]:
+    """Normalise the accepted inputs to an iterator of ``bytes`` or ``str`` chunks."""
+    if isinstance(source, (str, bytes, bytearray)):
+        for start in range(0, len(source), CHUNK_SIZE):
+            yield source[start:start + CHUNK_SIZE]
+    elif hasattr(source, "read"):
+        for chunk in iter(lambda: source.read(CHUNK_SIZE), b""):
+            if not chunk:
+                break
+            yield chunk
+    else:
+        yield from source
+
+
+def _inflate(inflater, chunk: bytes) -> Iterator[bytes]:
+    """Inflate ``chunk`` in ``CHUNK_SIZE`` pieces so a highly compressed input never expands at once."""
+    try:
+        data = inflater.decompress(chunk, CHUNK_SIZE)
+        yield data
+        while inflater.unconsumed_tail:
+            yield inflater.decompress(inflater.unconsumed_tail, CHUNK_SIZE)
+    except zlib.error as exc:
+        raise M3UParseError(f"Invalid gzip data: {exc}") from exc
+
+
+def _decoded(chunks: Iterable[bytes | str], encoding: str, max_bytes: int) -> Iterator[str]:
+    """Gunzip (when the stream starts with the gzip magic) and decode, counting bytes against ``max_bytes``."""
+    decoder = codecs.getincrementaldecoder(encoding)(errors="replace")
+    inflater = None
+    seen = 0
+    first = True
+    for chunk in chunks:
+        if not chunk:
+            continue
+        if isinstance(chunk, str):
+            seen += len(chunk)
+            if seen > max_bytes:
+                raise M3UParseError(f"Playlist is larger than {max_bytes} bytes")
+            yield chunk
+            continue
+        if first and chunk[:2] == _GZIP_MAGIC:
+            inflater = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        first = False
+        pieces = _inflate(inflater, chunk) if inflater is not None else (chunk,)
+        for data in pieces:
+            seen += len(data)
+            if seen > max_bytes:
+                raise M3UParseError(f"Playlist is larger than {max_bytes} bytes")
+            yield decoder.decode(data)
+    tail = decoder.decode(b"", final=True)
+    if tail:
+        yield tail
+
+
+def iter_lines(source, encoding: str = "utf-8", max_bytes: int = MAX_BYTES, max_lines: int = MAX_LINES,
+               max_line_length: int = MAX_LINE_LENGTH) -> Iterator[str]:
+    """Yield the stripped lines of ``source`` one at a time.
+
+    ``source`` may be text, bytes, a binary file object (an upload) or an
+    iterable of chunks such as ``response.iter_content()``; gzip-compressed
+    input is inflated on the fly. Lines are split on ``\\n`` only, like
+    ``str.split('\\n')``.
+    """
+    return _lines(_decoded(_chunks(source), encoding, max_bytes), max_lines, max_line_length)
+
+
+def _lines(texts: Iterable[str], max_lines: int, max_line_length: int, switch_at: int | None = None,
+           handoff: Dict[str, Any] | None = None) -> Iterator[str]:
+    """The line splitter behind :func:`iter_lines`.
+
+    With ``switch_at``, once that many characters were read it stops after the
+    next line that is neither empty nor a comment (so no ``#EXTINF`` entry is
+    open) and stores the unread text and the number of lines read in ``handoff``.
+    """
+    pending = ""
+    count = 0
+    size = 0
+    for text in texts:
+        pending += text
+        size += len(text)
+        lines = pending.split("\n")
+        pending = lines.pop()
+        if len(pending) > max_line_length:
+            raise M3UParseError(f"Line {count + len(lines) + 1} is longer than {max_line_length} characters")
+        switching = switch_at is not None and size >= switch_at
+        for index, line in enumerate(lines):
+            count += 1
+            if count > max_lines:
+                raise M3UParseError(f"Playlist has more than {max_lines} lines")
+            if len(line) > max_line_length:
+                raise M3UParseError(f"Line {count} is longer than {max_line_length} characters")
+            line = line.strip()
+            yield line
+            if switching and line and line[0] != "#":
+                handoff.update(text="\n".join(lines[index + 1:] + [pending]), lines=count)
+                return
+    count += 1
+    if count > max_lines:
+        raise M3UParseError(f"Playlist has more than {max_lines} lines")
+    yield pending.strip()
+
+
+def _extinf(line: str) -> Tuple[str, Dict[str, str]]:
+    """Split an ``#EXTINF`` line into its display name and attributes in a single tokenizer pass.
+
+    The name is everything after the first comma that is not inside a quoted
+    value, so ``group-title="Music, Live"`` no longer cuts it short. For a key
+    given more than once, the last double-quoted value wins over any
+    single-quoted one, and otherwise the first single-quoted value is kept.
+    ``key="value"`` text inside the name or nested in another quoted value is
+    not an attribute. When a stray quote (``tvg-name=O'Brien``) swallows every
+    comma, the line is read as before the tokenizer instead of losing its name.
+    """
+    if '"' not in line and "'" not in line:
+        comma = line.find(",")
+        return (line[comma + 1:].strip() if comma != -1 else ""), {}
+    tokens = _EXTINF_TOKEN.findall(line)
+    # Only the comma token captures the name, and it is always the last one
+    if tokens and tokens[-1][2]:
+        name = tokens[-1][2][1:].strip()
+    elif "," in line:
+        return _extinf_fallback(line)
+    elif not tokens:
+        return "", {}
+    else:
+        name = ""
+    if "'" not in line:
+        return name, {key: value[1:-1] for key, value, _ in tokens if key}
+    attrs = {key: value[1:-1] for key, value, _ in tokens if key and value[0] == '"'}
+    for key, value, _ in tokens:
+        if key and key not in attrs:
+            attrs[key] = value[1:-1]
+    return name, attrs
+
+
+def _extinf_fallback(line: str) -> Tuple[str, Dict[str, str]]:
+    """The former reading: attributes from the two quoted patterns, the name after the first comma."""
+    attrs = dict(_DOUBLE_QUOTED.findall(line))
+    for key, value in _SINGLE_QUOTED.findall(line):
+        attrs.setdefault(key, value)
+    return line[line.find(",") + 1:].strip(), attrs
+
+
+def _entries(lines: Iterable[str], detected: Set[str], numbered: bool = True,
+             counter: Dict[str, Any] | None = None) -> Iterator[Entry]:
+    """The parser loop; without ``numbered`` plain URL lines get ``None`` as name for the caller to number.
+
+    ``counter["entries"]`` receives the number of entries once ``lines`` is exhausted.
+    """
+    count = 0
+    pending: Tuple[str, Dict[str, str]] | None = None
+    # Attribute names of #EXTINF lines skipped while looking for a URL; they only
+    # count as detected when no URL follows before the end of the playlist
+    skipped_attrs: Set[str] = set()
+
+    for line in lines:
+        if not line:
+            continue
+        if line[0] == "#":
+            if line.startswith("#EXTINF"):
+                if pending is None:
+                    pending = _extinf(line)
+                    detected.update(pending[1])
+                else:
+                    skipped_attrs.update(_extinf(line)[1])
+            continue
+        if pending is not None:
+            name, attrs = pending
+            pending = None
+            skipped_attrs.clear()
+            if name:
+                count += 1
+                yield Entry(name, line, attrs)
+        elif line.startswith("http") or line.startswith("rtmp"):
+            count += 1
+            yield Entry(f"Channel {count}" if numbered else None, line, {})
+
+    detected.update(skipped_attrs)
+    if counter is not None:
+        counter["entries"] = count
+
+
+def iter_entries(lines: Iterable[str], detected_attrs: Set[str] | None = None) -> Iterator[Entry]:
+    """Turn stripped lines into channel entries, collecting attribute names into ``detected_attrs``.
+
+    An ``#EXTINF`` line takes the next line that is neither empty nor a comment
+    as its URL and is dropped when it has no name. Plain ``http``/``rtmp`` lines
+    outside an entry become ``Channel <n>``.
+    """
+    return _entries(lines, detected_attrs if detected_attrs is not None else set())
+
+
+def _boundary(text: str) -> int:
+    """Offset of the last line start in ``text`` where no ``#EXTINF`` entry is open, or 0.
+
+    Only complete lines are considered, and ``text`` must itself start at such a
+    point. Cutting there leaves the parser with no pending ``#EXTINF`` on either
+    side, so both parts parse exactly as they would in one pass.
+    """
+    cut = text.rfind("\n") + 1
+    while cut:
+        # The last line before the cut that is not empty or a plain comment decides
+        end = cut - 1
+        while True:
+            line_start = text.rfind("\n", 0, end) + 1
+            line = text[line_start:end].strip()
+            if line and line[0] != "#":
+                return cut
+            if line.startswith("#EXTINF"):
+                cut = line_start
+                break
+            if line_start == 0:
+                return cut
+            end = line_start - 1
+    return 0
+
+
+def _cut(texts: Iterable[str], piece_size: int, first_line: int, max_lines: int,
+         max_line_length: int) -> Iterator[Tuple[str, int, int]]:
+    """Cut decoded text into ``_parse_piece`` jobs of about ``piece_size`` characters as it arrives.
+
+    Only the unfinished piece is held, so memory stays bounded by ``piece_size``
+    plus the entry still open at its end.
+    """
+    parts: List[str] = []
+    size = 0
+    target = piece_size
+    for text in texts:
+        parts.append(text)
+        size += len(text)
+        if size < target:
+            continue
+        buffer = "".join(parts)
+        cut = _boundary(buffer)
+        if cut:
+            piece, buffer = buffer[:cut], buffer[cut:]
+            lines = piece.count("\n")
+            if first_line + lines > max_lines:
+                raise M3UParseError(f"Playlist has more than {max_lines} lines")
+            yield piece, first_line, max_line_length
+            first_line += lines
+        if len(buffer) - buffer.rfind("\n") - 1 > max_line_length:
+            number = first_line + buffer.count("\n")
+            raise M3UParseError(f"Line {number} is longer than {max_line_length} characters")
+        parts, size = [buffer], len(buffer)
+        # Without a cut, wait for another piece worth of text instead of rescanning every chunk
+        target = size + piece_size if not cut else piece_size
+    buffer = "".join(parts)
+    if first_line + buffer.count("\n") > max_lines:
+        raise M3UParseError(f"Playlist has more than {max_lines} lines")
+    yield buffer, first_line, max_line_length
+
+
+def _parse_piece(job: Tuple[str, int, int]) -> Tuple[List[Entry], Set[str]]:
+    """Process pool task: parse one piece into unnumbered entries and its attribute names."""
+    text, first_line, max_line_length = job
+    lines = text.split("\n")
+    if len(max(lines, key=len)) > max_line_length:
+        number = next(index for index, line in enumerate(lines) if len(line) > max_line_length)
+        raise M3UParseError(f"Line {first_line + number} is longer than {max_line_length} characters")
+    detected: Set[str] = set()
+    return list(_entries([line.strip() for line in lines], detected, numbered=False)), detected
+
+
+def _parse_pieces(jobs: Iterable[Tuple[str, int, int]], detected: Set[str], workers: int,
+                  count: int = 0) -> Iterator[Entry]:
+    """Parse pieces on ``workers`` processes and yield their entries in playlist order.
+
+    At most ``workers * PIECES_PER_WORKER`` pieces are submitted but not yet
+    consumed, so a slow consumer holds the reader back instead of piling up
+    parsed pieces. ``Channel <n>`` names continue from ``count``.
+    """
+    def entries(result: Tuple[List[Entry], Set[str]]) -> Iterator[Entry]:
+        nonlocal count
+        parsed, names = result
+        detected.update(names)
+        for entry in parsed:
+            count += 1
+            yield entry if entry.name is not None else entry._replace(name=f"Channel {count}")
+
+    if workers < 2:
+        for job in jobs:
+            yield from entries(_parse_piece(job))
+        return
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        in_flight: deque = deque()
+        for job in jobs:
+            in_flight.append(pool.submit(_parse_piece, job))
+            if len(in_flight) >= workers * PIECES_PER_WORKER:
+                yield from entries(in_flight.popleft().result())
+        while in_flight:
+            yield from entries(in_flight.popleft().result())
+
+
+def parse_parallel(text: str, detected_attrs: Set[str] | None = None, workers: int | None = None,
+                   max_lines: int = MAX_LINES, max_line_length: int = MAX_LINE_LENGTH) -> Iterator[Entry]:
+    """Parse decoded playlist ``text`` on ``workers`` processes.
+
+    The text is cut into ``workers * PIECES_PER_WORKER`` independent pieces;
+    their entries come back in playlist order and ``Channel <n>`` names are
+    numbered across pieces, so the output (and ``detected_attrs``) equals
+    ``iter_entries``.
+    """
+    detected = detected_attrs if detected_attrs is not None else set()
+    workers = workers or PARSE_WORKERS
+    piece_size = len(text) // (workers * PIECES_PER_WORKER) + 1
+    texts = (text[start:start + CHUNK_SIZE] for start in range(0, len(text), CHUNK_SIZE))
+    return _parse_pieces(_cut(texts, piece_size, 1, max_lines, max_line_length), detected, workers)
+
+
+def stream(source, detected_attrs: Set[str] | None = None, encoding: str = "utf-8", workers: int | None = None,
+           threshold: int = PARALLEL_THRESHOLD, max_bytes: int = MAX_BYTES, max_lines: int = MAX_LINES,
+           max_line_length: int = MAX_LINE_LENGTH) -> Iterator[Entry]:
+    """Parse ``source`` lazily; ``detected_attrs`` is complete once the iterator is exhausted.
+
+    Lines are parsed one at a time as they arrive. With more than one worker,
+    once ``threshold`` characters were read the rest is cut into ``PIECE_SIZE``
+    pieces as chunks arrive and parsed by :func:`_parse_pieces`; the output is
+    the same as the sequential parser's.
+    """
+    detected = detected_attrs if detected_attrs is not None else set()
+    workers = workers or PARSE_WORKERS
+    texts = _decoded(_chunks(source), encoding, max_bytes)
+    if workers < 2:
+        yield from _entries(_lines(texts, max_lines, max_line_length), detected)
+        return
+    handoff: Dict[str, Any] = {}
+    yield from _entries(_lines(texts, max_lines, max_line_length, threshold, handoff), detected, counter=handoff)
+    if "text" not in handoff:
+        return
+    jobs = _cut(chain((handoff["text"],), texts), PIECE_SIZE, handoff["lines"] + 1, max_lines, max_line_length)
+    yield from _parse_pieces(jobs, detected, workers, handoff["entries"])
+
+
+def parse_all(source, encoding: str = "utf-8", **limits) -> Tuple[list, Set[str]]:
+    """Parse a whole playlist into ``(entries, detected_attrs)``."""
+    detected: Set[str] = set()
+    entries = list(stream(source, detected, encoding, **limits))
+    return entries, detected
+
+
+def read_text(source, encoding: str = "utf-8", max_bytes: int = MAX_BYTES) -> str:
+    """Decode (and gunzip) ``source`` into one string, enforcing ``max_bytes``."""
+    return "".join(_decoded(_chunks(source), encoding, max_bytes))
+
+
+def fetch(url: str, timeout: float = FETCH_TIMEOUT, etag: str | None = None, last_modified: str | None = None,
+          info: Dict[str, Any] | None = None) -> Iterator[bytes]:
+    """Stream a remote playlist body in chunks without buffering the whole response.
+
+    ``etag``/``last_modified`` make the request conditional; a ``304 Not
+    Modified`` yields nothing. ``info`` receives the status, the validators to
+    send next time and, once the body is exhausted, its SHA-256.
+    Raises ``requests.RequestException`` for connection and HTTP errors.
+    """
+    headers = {}
+    if etag:
+        headers["If-None-Match"] = etag
+    if last_modified:
+        headers["If-Modified-Since"] = last_modified
+    with requests.get(url, timeout=timeout, stream=True, headers=headers) as response:
+        response.raise_for_status()
+        if info is not None:
+            info.update(status=response.status_code, etag=response.headers.get("ETag"),
+                        last_modified=response.headers.get("Last-Modified"))
+        if response.status_code == 304:
+            return
+        digest = hashlib.sha256()
+        for chunk in response.iter_content(CHUNK_SIZE):
+            digest.update(chunk)
+            yield chunk
+        if info is not None:
+            info["sha256"] = digest.hexdigest()
@@ -0,0 +1,104 @@
+"""Consistent-hash placement of subscribers on streaming servers."""
+from __future__ import annotations
+
+import bisect
+import hashlib
+import math
+from functools import lru_cache
+from typing import Dict, Iterable, Iterator, List, Tuple
+
+# Ring points per CAPACITY_UNIT connections of capacity. Fixed per server, so adding or
+# draining one server never changes the points, and the users, of the others.
+VNODES_PER_UNIT = 16
+CAPACITY_UNIT = 100
+# Bounded loads: no server is planned above (1 + LOAD_EPSILON) x its capacity share
+LOAD_EPSILON = 0.25
+
+
+def _hash(text: str) -> int:
+    return int.from_bytes(hashlib.blake2b(text.encode("utf-8"), digest_size=8).digest(), "big")
+
+
+class HashRing:
+    """Capacity-weighted consistent hash ring over ``{server_id: capacity}``.
+
+    Adding or removing a server only changes the first choice of the keys whose
+    ring positions fall next to that server's points.
+    """
+
+    def __init__(self, capacities: Dict[int, int]):
+        self.capacities = {server_id: max(1, int(capacity or 1)) for server_id, capacity in capacities.items()}
+        points: List[Tuple[int, int]] = []
+        for server_id, capacity in self.capacities.items():
+            vnodes = max(1, round(VNODES_PER_UNIT * capacity / CAPACITY_UNIT))
+            points.extend((_hash(f"{server_id}#{index}"), server_id) for index in range(vnodes))
+        points.sort()
+        self._hashes = [point for point, _ in points]
+        self._servers = [server_id for _, server_id in points]
+
+    def __bool__(self) -> bool:
+        return bool(self._servers)
+
+    def candidates(self, key: str) -> Iterator[int]:
+        """Servers in clockwise order from ``key``'s position, each once."""
+        if not self._servers:
+            return
+        start = bisect.bisect(self._hashes, _hash(key))
+        seen = set()
+        for offset in range(len(self._servers)):
+            server_id = self._servers[(start + offset) % len(self._servers)]
+            if server_id not in seen:
+                seen.add(server_id)
+                yield server_id
+                if len(seen) == len(self.capacities):
+                    return
+
+    def lookup(self, key: str) -> int | None:
+        return next(self.candidates(key), None)
+
+
+@lru_cache(maxsize=8)
+def _cached_ring(servers: frozenset) -> HashRing:
+    return HashRing(dict(servers))
+
+
+def ring_for(capacities: Dict[int, int]) -> HashRing:
+    """The ring for ``{server_id: capacity}``, built once per distinct server set and reused."""
+    return _cached_ring(frozenset(capacities.items()))
+
+
+def plan(keys: Iterable[str], capacities: Dict[int, int], epsilon: float = LOAD_EPSILON,
+         current: Dict[str, int] | None = None) -> Dict[str, int]:
+    """Assign every key to a server with consistent hashing and bounded loads.
+
+    Each server takes at most ``ceil((1 + epsilon) * keys * capacity / total)``
+    keys. Keys in ``current`` keep their server while it is listed and below that
+    bound; the others take the first server on the ring that is not full. Keys
+    are placed in ring order, so the result only depends on the key set, the
+    current assignment and the servers, not on the order ``keys`` came in.
+    """
+    ring = ring_for(capacities)
+    keys = sorted(keys, key=_hash)
+    if not ring or not keys:
+        return {}
+    total = sum(ring.capacities.values())
+    limits = {server_id: math.ceil((1 + epsilon) * len(keys) * capacity / total)
+              for server_id, capacity in ring.capacities.items()}
+    loads = dict.fromkeys(limits, 0)
+    assignment: Dict[str, int] = {}
+    current = current or {}
+    unplaced = []
+    for key in keys:
+        server_id = current.get(key)
+        if server_id in limits and loads[server_id] < limits[server_id]:
+            loads[server_id] += 1
+            assignment[key] = server_id
+        else:
+            unplaced.append(key)
+    for key in unplaced:
+        for server_id in ring.candidates(key):
+            if loads[server_id] < limits[server_id]:
+                loads[server_id] += 1
+                assignment[key] = server_id
+                break
+    return assignment
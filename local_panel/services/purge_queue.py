@@ -0,0 +1,149 @@
+"""Shared, debounced set of URLs waiting for a Cloudflare purge."""
+from __future__ import annotations
+
+import json
+import logging
+import time
+from datetime import datetime
+from typing import Any, Callable, Dict, Iterable, List, Tuple
+
+LOGGER = logging.getLogger(__name__)
+
+# ``purge(urls, stats)`` purges the URLs and fills ``stats["requests"]`` with the API calls it made
+Purge = Callable[[List[str], Dict[str, Any]], Tuple[bool, Any]]
+
+
+class PurgeQueue:
+    """URLs recorded by every gunicorn worker and flushed by a single consumer.
+
+    Redis layout (``<prefix>`` defaults to ``purge``):
+
+    * ``<prefix>:urls``    set of URLs waiting for the next flush
+    * ``<prefix>:first``   time the oldest pending URL was recorded
+    * ``<prefix>:last``    time the newest pending URL was recorded
+    * ``<prefix>:failures`` failed flushes in a row
+    * ``<prefix>:retry_at`` time before which a failed flush is not retried
+    * ``<prefix>:metrics`` hash of counters (URLs queued, API calls made, ...)
+    * ``<prefix>:last_flush`` JSON result of the last flush
+
+    A flush waits until nothing was recorded for ``debounce`` seconds, but never
+    longer than ``max_wait`` after the first URL, so repeated edits of the same
+    user collapse into one purge and bursts share API calls. A failed flush is
+    retried with exponential backoff; after ``MAX_ATTEMPTS`` failures in a row its
+    URLs are dropped.
+    """
+
+    MAX_ATTEMPTS = 6
+    BASE_DELAY = 5  # seconds, doubled on every failed flush
+
+    def __init__(self, client, prefix: str = "purge", debounce: float = 5, max_wait: float = 30):
+        self.client = client
+        self.prefix = prefix
+        self.debounce = debounce
+        self.max_wait = max_wait
+
+    def key(self, name: str) -> str:
+        return f"{self.prefix}:{name}"
+
+    def add(self, urls: Iterable[str]) -> int:
+        """Record URLs for the next flush and return how many were given."""
+        url_list = [url for url in urls if url]
+        if not url_list:
+            return 0
+        now = time.time()
+        with self.client.pipeline() as pipe:
+            pipe.sadd(self.key("urls"), *url_list)
+            pipe.set(self.key("first"), now, nx=True)
+            pipe.set(self.key("last"), now)
+            pipe.hincrby(self.key("metrics"), "urls_queued", len(url_list))
+            pipe.execute()
+        return len(url_list)
+
+    def pending(self, urls: Iterable[str] | None = None) -> int:
+        """Number of URLs waiting, or of ``urls`` among them."""
+        if urls is None:
+            return self.client.scard(self.key("urls"))
+        url_list = list(urls)
+        if not url_list:
+            return 0
+        return sum(self.client.smismember(self.key("urls"), url_list))
+
+    def due(self) -> bool:
+        first, last, retry_at = self.client.mget(self.key("first"), self.key("last"), self.key("retry_at"))
+        if first is None:
+            return False
+        now = time.time()
+        if retry_at is not None and now < float(retry_at):
+            return False
+        return now - float(last or first) >= self.debounce or now - float(first) >= self.max_wait
+
+    def _take(self) -> Tuple[List[str], str | None]:
+        """Remove and return the pending URLs with the time the oldest was recorded."""
+        with self.client.pipeline() as pipe:
+            pipe.smembers(self.key("urls"))
+            pipe.get(self.key("first"))
+            pipe.delete(self.key("urls"), self.key("first"), self.key("last"))
+            urls, first, _ = pipe.execute()
+        return sorted(urls), first
+
+    def flush(self, purge: Purge, force: bool = False) -> Tuple[bool, Any]:
+        """Purge everything recorded so far in as few API calls as ``purge`` allows.
+
+        URLs of a failed flush go back into the set, keeping the time they were
+        first recorded, and the next attempt waits ``BASE_DELAY * 2 ** (failures - 1)``
+        seconds. After ``MAX_ATTEMPTS`` failed flushes in a row they are dropped.
+        """
+        if not force and not self.due():
+            return True, "Nothing due"
+        urls, first = self._take()
+        if not urls:
+            return True, "Nothing to purge"
+
+        stats: Dict[str, Any] = {}
+        try:
+            success, detail = purge(urls, stats)
+        except Exception as exc:  # noqa: BLE001
+            LOGGER.exception("Purge flush raised")
+            success, detail = False, str(exc)
+
+        failures = 0 if success else self.client.incr(self.key("failures"))
+        with self.client.pipeline() as pipe:
+            if success:
+                pipe.delete(self.key("failures"), self.key("retry_at"))
+                pipe.hincrby(self.key("metrics"), "urls_purged", len(urls))
+            elif failures >= self.MAX_ATTEMPTS:
+                LOGGER.error("Dropping %s queued purge URLs after %s failed flushes: %s", len(urls), failures, detail)
+                pipe.delete(self.key("failures"), self.key("retry_at"))
+                pipe.hincrby(self.key("metrics"), "failed_flushes", 1)
+                pipe.hincrby(self.key("metrics"), "urls_dropped", len(urls))
+            else:
+                pipe.sadd(self.key("urls"), *urls)
+                # URLs recorded during the attempt are newer, so the original time wins
+                pipe.set(self.key("first"), first or time.time())
+                pipe.set(self.key("retry_at"), time.time() + self.BASE_DELAY * 2 ** (failures - 1))
+                pipe.hincrby(self.key("metrics"), "failed_flushes", 1)
+            pipe.hincrby(self.key("metrics"), "flushes", 1)
+            pipe.hincrby(self.key("metrics"), "api_calls", int(stats.get("requests", 0)))
+            pipe.set(self.key("last_flush"), json.dumps({
+                "success": success, "urls": len(urls), "requests": stats.get("requests", 0),
+                "detail": str(detail)[:500], "at": datetime.utcnow().isoformat(),
+            }))
+            pipe.execute()
+        return success, detail
+
+    def stats(self) -> Dict[str, Any]:
+        with self.client.pipeline() as pipe:
+            pipe.hgetall(self.key("metrics"))
+            pipe.scard(self.key("urls"))
+            pipe.get(self.key("last_flush"))
+            pipe.get(self.key("failures"))
+            metrics, pending, last_flush, failures = pipe.execute()
+        counters = {name: int(value) for name, value in metrics.items()}
+        api_calls = counters.get("api_calls", 0)
+        return {
+            "pending": pending,
+            "failures": int(failures or 0),
+            **counters,
+            "urls_per_call": round(counters.get("urls_purged", 0) / api_calls, 1) if api_calls else None,
+            "last_flush": json.loads(last_flush) if last_flush else None,
+        }
@@ -0,0 +1,168 @@
+"""Bucketed digest reconciliation between the panel database and the streaming server."""
+from __future__ import annotations
+
+import hashlib
+import logging
+import time
+from datetime import datetime
+from types import SimpleNamespace
+from typing import Any, Dict, List
+
+from database.models import db, User
+
+from .streaming import StreamingService, _channel_line, _line_digest, _manifest_digest
+
+LOGGER = logging.getLogger(__name__)
+
+DEFAULT_BUCKETS = 256
+# Bucket indexes requested per entries call once digests disagree
+FETCH_BUCKETS = 32
+SYNC_CHUNK = 1000
+_EPOCH = datetime(1970, 1, 1)
+
+
+def bucket_of(key: str, buckets: int) -> int:
+    return int(hashlib.sha1(key.encode("utf-8")).hexdigest()[:8], 16) % buckets
+
+
+def user_digest(username: str, token: str, max_connections: int | None, is_active: bool | None,
+                expiry_date: datetime | None) -> str:
+    """Digest of the subscriber fields the streaming server must agree on."""
+    expires = int((expiry_date - _EPOCH).total_seconds()) if expiry_date else 0
+    active = 1 if is_active or is_active is None else 0
+    return _line_digest(f"{username}|{token}|{max_connections or 1}|{active}|{expires}")
+
+
+def split_buckets(entries: Dict[str, str], buckets: int) -> List[Dict[str, str]]:
+    split: List[Dict[str, str]] = [{} for _ in range(buckets)]
+    for key, digest in entries.items():
+        split[bucket_of(key, buckets)][key] = digest
+    return split
+
+
+def root_digest(bucket_digests: List[str]) -> str:
+    return hashlib.sha256("".join(bucket_digests).encode("ascii")).hexdigest()
+
+
+def compare(kind: str, local: Dict[str, str], buckets: int = DEFAULT_BUCKETS, target: str | None = None) -> Dict[str, Any]:
+    """Compare ``{key: digest}`` with a server's tree for ``kind`` ("users" or "channels").
+
+    One request settles an in-sync catalog; otherwise only the buckets whose
+    digests differ are listed entry by entry, ``FETCH_BUCKETS`` per request.
+    """
+    started = time.perf_counter()
+    local_buckets = split_buckets(local, buckets)
+    local_digests = [_manifest_digest(bucket) for bucket in local_buckets]
+    result: Dict[str, Any] = {
+        "kind": kind, "entries": len(local), "buckets": buckets, "in_sync": False, "differing_buckets": 0,
+        "missing": [], "changed": [], "extra": [], "remote": {}, "requests": 1,
+    }
+
+    success, remote = StreamingService.fetch_digests(kind, buckets, target=target)
+    if not success:
+        raise RuntimeError(f"Could not fetch {kind} digests: {remote}")
+    remote_digests = remote.get("buckets") or []
+    if remote.get("root") == root_digest(local_digests) and len(remote_digests) == buckets:
+        result.update(in_sync=True, duration_ms=round((time.perf_counter() - started) * 1000, 1))
+        return result
+    if len(remote_digests) != buckets:
+        # Server uses another bucket count or sent nothing usable: compare everything
+        remote_digests = [None] * buckets
+
+    differing = [index for index in range(buckets) if remote_digests[index] != local_digests[index]]
+    result["differing_buckets"] = len(differing)
+    for start in range(0, len(differing), FETCH_BUCKETS):
+        chunk = differing[start:start + FETCH_BUCKETS]
+        success, fetched = StreamingService.fetch_bucket_entries(kind, buckets, chunk, target=target)
+        result["requests"] += 1
+        if not success:
+            raise RuntimeError(f"Could not fetch {kind} bucket entries: {fetched}")
+        for index in chunk:
+            remote_entries = fetched.get(str(index)) or {}
+            result["remote"].update(remote_entries)
+            mine = local_buckets[index]
+            result["missing"].extend(key for key in mine if key not in remote_entries)
+            result["changed"].extend(key for key in mine if key in remote_entries and remote_entries[key] != mine[key])
+            result["extra"].extend(key for key in remote_entries if key not in mine)
+
+    result["duration_ms"] = round((time.perf_counter() - started) * 1000, 1)
+    return result
+
+
+def _users_by_name(usernames: List[str]) -> List[User]:
+    users: List[User] = []
+    for start in range(0, len(usernames), SYNC_CHUNK):
+        users.extend(User.query.filter(User.username.in_(usernames[start:start + SYNC_CHUNK])).all())
+    return users
+
+
+def _bulk(users, action: str, target: str) -> int:
+    """Push ``users`` to one server in chunks and return how many it accepted."""
+    repaired = 0
+    for start in range(0, len(users), SYNC_CHUNK):
+        chunk = users[start:start + SYNC_CHUNK]
+        success, detail = StreamingService.sync_users_bulk(chunk, action, targets=[target])
+        if not success:
+            LOGGER.warning("Reconciliation %s of %s users failed: %s", action, len(chunk), detail)
+            continue
+        results = detail.get("results") if isinstance(detail, dict) else None
+        repaired += sum(1 for item in results if item.get("success")) if isinstance(results, list) else len(chunk)
+    return repaired
+
+
+def reconcile_users(buckets: int = DEFAULT_BUCKETS, repair: bool = True, target: str | None = None) -> Dict[str, Any]:
+    """Find subscribers whose copy on ``target`` (default: primary) drifted and re-sync just those."""
+    target = target or StreamingService.target_names()[0]
+    local = {
+        username: user_digest(username, token, max_connections, is_active, expiry_date)
+        for username, token, max_connections, is_active, expiry_date in db.session.query(
+            User.username, User.token, User.max_connections, User.is_active, User.expiry_date)
+    }
+    result = compare("users", local, buckets, target)
+    result["repaired"] = 0
+    if repair and not result["in_sync"]:
+        result["repaired"] += _bulk(_users_by_name(result["missing"]), "create", target)
+        result["repaired"] += _bulk(_users_by_name(result["changed"]), "update", target)
+        result["repaired"] += _bulk([SimpleNamespace(username=name, token=None) for name in result["extra"]],
+                                    "delete", target)
+    return _summarize(result)
+
+
+def reconcile_channels(channels, buckets: int = DEFAULT_BUCKETS, repair: bool = True,
+                       target: str | None = None) -> Dict[str, Any]:
+    """Compare the channel catalog and patch the differences through the delta sync.
+
+    The remote catalog is rebuilt as a manifest (local entries for matching buckets,
+    remote entries for the rest), so the patch carries only the drifted lines and
+    its base digest is checked by the server as usual. ``result["manifest"]`` is
+    the manifest to store for ``target`` when a repair ran.
+    """
+    target = target or StreamingService.target_names()[0]
+    local = {}
+    for channel in channels:
+        line = _channel_line(channel)
+        local[line.split("|", 1)[0]] = _line_digest(line)
+    result = compare("channels", local, buckets, target)
+    result["repaired"] = 0
+    if repair and not result["in_sync"]:
+        differing = set(result["missing"]) | set(result["changed"])
+        remote_entries = {key: digest for key, digest in local.items() if key not in differing}
+        remote_entries.update(result["remote"])
+        remote_manifest = {"digest": _manifest_digest(remote_entries), "entries": remote_entries}
+        _, _, failed_ids, report = StreamingService.sync_channels_delta(
+            channels, {target: remote_manifest}, targets=[target])
+        if not failed_ids:
+            result["repaired"] = len(differing) + len(result["extra"])
+        result.update(sync_mode=report["mode"], manifest=report["manifests"].get(target))
+    return _summarize(result)
+
+
+def _summarize(result: Dict[str, Any]) -> Dict[str, Any]:
+    """Replace key lists with counts (keeping a short sample) for storage and display."""
+    result.pop("remote", None)
+    for field in ("missing", "changed", "extra"):
+        keys = result[field]
+        result[f"{field}_sample"] = keys[:10]
+        result[field] = len(keys)
+    result["drift"] = result["missing"] + result["changed"] + result["extra"]
+    return result
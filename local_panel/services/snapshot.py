@@ -0,0 +1,274 @@
+"""Binary subscriber snapshot the streaming servers can authorize from locally."""
+from __future__ import annotations
+
+import bisect
+import hashlib
+import logging
+import mmap
+import os
+import struct
+from datetime import datetime, timedelta
+from typing import Any, Dict, Iterator, List, Tuple
+
+from database.models import db, User
+
+LOGGER = logging.getLogger(__name__)
+
+MAGIC = b"IPTVSNAP"
+VERSION = 1
+
+# magic, version, record size, record count, generated_at (ms since epoch, UTC), sha256 of the records
+HEADER = struct.Struct("<8sHHIQ32s8x")
+# token, username, user id, expires_at (s since epoch, UTC), max_connections, flags, password verifier
+RECORD = struct.Struct("<64s64sIqHB64sx")
+
+FLAG_ACTIVE = 0x01
+
+# Rows whose transaction committed after the last build may carry an older updated_at
+OVERLAP = timedelta(seconds=60)
+_EPOCH = datetime(1970, 1, 1)
+
+
+class SnapshotError(ValueError):
+    """Raised when a snapshot file is truncated, corrupt or of an unknown version."""
+
+
+def _fixed(text: str | None, size: int) -> bytes:
+    """UTF-8 encode ``text`` and cut it to ``size`` bytes without splitting a character."""
+    raw = (text or "").encode("utf-8")
+    if len(raw) > size:
+        raw = raw[:size].decode("utf-8", "ignore").encode("utf-8")
+    return raw
+
+
+def _to_ms(moment: datetime) -> int:
+    return int((moment - _EPOCH).total_seconds() * 1000)
+
+
+def _from_ms(value: int) -> datetime:
+    return _EPOCH + timedelta(milliseconds=value)
+
+
+def encode_record(user_id: int, token: str, username: str, expiry_date: datetime | None,
+                  max_connections: int | None, password_hash: str | None, is_active: bool = True) -> bytes | None:
+    """Pack one subscriber, or return None when the token does not fit the record."""
+    token_raw = (token or "").encode("utf-8")
+    if not token_raw or len(token_raw) > 64:
+        LOGGER.warning("User %s skipped in snapshot: token is empty or longer than 64 bytes", user_id)
+        return None
+    expires = int((expiry_date - _EPOCH).total_seconds()) if expiry_date else 0
+    return RECORD.pack(
+        token_raw,
+        _fixed(username, 64),
+        user_id,
+        expires,
+        max(0, min(int(max_connections or 1), 0xFFFF)),
+        FLAG_ACTIVE if is_active else 0,
+        _fixed(password_hash, 64),
+    )
+
+
+def decode_record(raw: bytes) -> Dict[str, Any]:
+    token, username, user_id, expires, max_connections, flags, verifier = RECORD.unpack(raw)
+    return {
+        "token": token.rstrip(b"\0").decode("utf-8"),
+        "username": username.rstrip(b"\0").decode("utf-8", "replace"),
+        "user_id": user_id,
+        "expires_at": expires,
+        "max_connections": max_connections,
+        "is_active": bool(flags & FLAG_ACTIVE),
+        "password_hash": verifier.rstrip(b"\0").decode("utf-8", "replace"),
+    }
+
+
+def _record_user_id(raw: bytes) -> int:
+    return struct.unpack_from("<I", raw, 128)[0]
+
+
+def build(records: List[bytes], generated_at: datetime) -> bytes:
+    """Sort packed records by token and prepend the checksummed header."""
+    records = sorted(records, key=lambda record: record[:64])
+    body = b"".join(records)
+    header = HEADER.pack(MAGIC, VERSION, RECORD.size, len(records), _to_ms(generated_at),
+                         hashlib.sha256(body).digest())
+    return header + body
+
+
+def parse_header(data) -> Dict[str, Any]:
+    if len(data) < HEADER.size:
+        raise SnapshotError("Snapshot is shorter than its header")
+    magic, version, record_size, count, generated_ms, checksum = HEADER.unpack_from(data, 0)
+    if magic != MAGIC:
+        raise SnapshotError("Not a subscriber snapshot")
+    if version != VERSION or record_size != RECORD.size:
+        raise SnapshotError(f"Unsupported snapshot version {version} (record size {record_size})")
+    if len(data) != HEADER.size + count * record_size:
+        raise SnapshotError("Snapshot size does not match its record count")
+    return {"version": version, "count": count, "generated_at": _from_ms(generated_ms), "checksum": checksum}
+
+
+class SnapshotReader:
+    """Memory-mapped, read-only view of a snapshot with O(log n) token lookups.
+
+    ``verify`` checks the body checksum once on open; lookups then only touch the
+    pages binary search visits.
+    """
+
+    def __init__(self, path: str | os.PathLike, verify: bool = True):
+        self._file = open(path, "rb")
+        try:
+            self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            self._file.close()
+            raise SnapshotError("Snapshot file is empty")
+        try:
+            self.header = parse_header(self._map)
+            if verify and hashlib.sha256(self._map[HEADER.size:]).digest() != self.header["checksum"]:
+                raise SnapshotError("Snapshot checksum mismatch")
+        except SnapshotError:
+            self.close()
+            raise
+
+    def close(self) -> None:
+        self._map.close()
+        self._file.close()
+
+    def __enter__(self) -> "SnapshotReader":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+    def __len__(self) -> int:
+        return self.header["count"]
+
+    def raw(self, index: int) -> bytes:
+        offset = HEADER.size + index * RECORD.size
+        return self._map[offset:offset + RECORD.size]
+
+    def __iter__(self) -> Iterator[bytes]:
+        for index in range(len(self)):
+            yield self.raw(index)
+
+    def _token_at(self, index: int) -> bytes:
+        offset = HEADER.size + index * RECORD.size
+        return self._map[offset:offset + 64]
+
+    def lookup(self, token: str) -> Dict[str, Any] | None:
+        """Binary-search the record for ``token``."""
+        key = (token or "").encode("utf-8")
+        if not key or len(key) > 64:
+            return None
+        key = key.ljust(64, b"\0")
+        tokens = _TokenView(self)
+        index = bisect.bisect_left(tokens, key)
+        if index < len(self) and tokens[index] == key:
+            return decode_record(self.raw(index))
+        return None
+
+
+class _TokenView:
+    """Sequence of token fields so ``bisect`` can search the mapped file directly."""
+
+    def __init__(self, reader: SnapshotReader):
+        self.reader = reader
+
+    def __len__(self) -> int:
+        return len(self.reader)
+
+    def __getitem__(self, index: int) -> bytes:
+        return self.reader._token_at(index)
+
+
+def _load_previous(path: str) -> Tuple[Dict[str, Any], Dict[int, bytes]] | None:
+    try:
+        with SnapshotReader(path) as reader:
+            return reader.header, {_record_user_id(raw): raw for raw in reader}
+    except FileNotFoundError:
+        return None
+    except SnapshotError as exc:
+        LOGGER.warning("Ignoring unusable subscriber snapshot %s: %s", path, exc)
+        return None
+
+
+def _user_columns():
+    return db.session.query(
+        User.id, User.token, User.username, User.expiry_date, User.max_connections, User.password_hash,
+    ).filter(User.is_active == True)  # noqa: E712
+
+
+def regenerate(path: str | os.PathLike, full: bool = False) -> Dict[str, Any]:
+    """Rebuild the snapshot at ``path`` from the database.
+
+    Incremental by default: the previous file is reused and only users whose
+    ``updated_at`` is newer than its ``generated_at`` (minus ``OVERLAP``) are
+    re-encoded; users that were deleted or deactivated are dropped by comparing
+    against the current set of active ids. Expired users stay in the file, the
+    edge compares ``expires_at`` itself. The file is replaced atomically and left
+    untouched when nothing changed (``mode`` is then ``"noop"``).
+    """
+    path = os.fspath(path)
+    generated_at = datetime.utcnow()
+    previous = None if full else _load_previous(path)
+
+    if previous is None:
+        mode = "full"
+        records: Dict[int, bytes] = {}
+        for row in _user_columns().yield_per(5000):
+            record = encode_record(*row)
+            if record is not None:
+                records[row.id] = record
+        changed, removed = len(records), 0
+    else:
+        mode = "incremental"
+        header, records = previous
+        active_ids = {user_id for (user_id,) in db.session.query(User.id).filter(User.is_active == True)}  # noqa: E712
+        stale = [user_id for user_id in records if user_id not in active_ids]
+        for user_id in stale:
+            del records[user_id]
+        removed = len(stale)
+
+        changed = 0
+        since = header["generated_at"] - OVERLAP
+        for row in _user_columns().filter(db.or_(User.updated_at >= since, User.updated_at.is_(None))).yield_per(5000):
+            record = encode_record(*row)
+            if record is None:
+                changed += records.pop(row.id, None) is not None
+            elif records.get(row.id) != record:
+                records[row.id] = record
+                changed += 1
+        # Active users that never made it into the previous file (e.g. inserted with an old updated_at)
+        missing = sorted(active_ids.difference(records))
+        for start in range(0, len(missing), 1000):
+            for row in _user_columns().filter(User.id.in_(missing[start:start + 1000])):
+                record = encode_record(*row)
+                if record is not None:
+                    records[row.id] = record
+                    changed += 1
+
+        if not changed and not removed:
+            return {"mode": "noop", "count": header["count"], "changed": 0, "removed": 0,
+                    "bytes": HEADER.size + header["count"] * RECORD.size,
+                    "sha256": _file_sha256(path), "generated_at": header["generated_at"].isoformat()}
+
+    data = build(list(records.values()), generated_at)
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    tmp_path = f"{path}.tmp-{os.getpid()}"
+    # The file carries password hashes
+    fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with os.fdopen(fd, "wb") as handle:
+        handle.write(data)
+    os.replace(tmp_path, path)
+
+    return {"mode": mode, "count": len(records), "changed": changed, "removed": removed, "bytes": len(data),
+            "sha256": hashlib.sha256(data).hexdigest(), "generated_at": generated_at.isoformat()}
+
+
+def _file_sha256(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as handle:
+        for block in iter(lambda: handle.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
@@ -0,0 +1,187 @@
+"""Scheduled re-fetch of URL-backed M3U sources, applied to their channels as a diff."""
+from __future__ import annotations
+
+import json
+import logging
+import tempfile
+import time
+from collections import defaultdict, deque
+from datetime import datetime, timedelta
+from typing import Any, Dict, Iterable, List
+
+from sqlalchemy import delete, insert, update
+
+from database.models import db, Channel, M3USource, SourceChannel
+
+from . import channel_import, m3u
+from .m3u import Entry
+
+LOGGER = logging.getLogger(__name__)
+
+CHUNK = 1000
+_FIELDS = (Channel.name, Channel.category, Channel.source_url, Channel.logo_url, Channel.epg_id, Channel.quality)
+
+
+def due_sources(now: datetime | None = None) -> List[M3USource]:
+    """URL-backed sources whose refresh interval (minutes) has elapsed and that are not importing or being deleted."""
+    now = now or datetime.utcnow()
+    sources = M3USource.query.filter(M3USource.origin_url.isnot(None), M3USource.refresh_interval > 0,
+                                     M3USource.deleted_at.is_(None)).all()
+    return [source for source in sources if not source.is_importing and (
+        source.refreshed_at is None or source.refreshed_at + timedelta(minutes=source.refresh_interval) <= now)]
+
+
+def _stored_hash(channel, uses_ids: bool) -> str:
+    """The channel's content hash, computed from its columns for channels imported before hashing."""
+    if channel.content_hash:
+        return channel.content_hash
+    row = {column: getattr(channel, column) for column in channel_import.CHANNEL_FIELDS}
+    return channel_import.content_hash(row, channel.channel_id if uses_ids else "")
+
+
+def diff(channels: Iterable, entries: Iterable[Entry], mapping: Dict[str, str]) -> Dict[str, list]:
+    """Pair fetched entries with a source's current channels.
+
+    An entry matches the channel with its proposed id (when ``tvg-id`` is mapped
+    to ``channel_id``), otherwise a channel with the same stream URL; duplicate
+    URLs pair up in order. ``entries`` is read once, so it may be a parser
+    stream. Returns the unmatched entries (``added``), the ``(channel, row,
+    content hash, entry)`` tuples whose content hash differs (``changed``), the
+    channels the playlist no longer lists (``removed``) and the number of
+    entries read (``listed``).
+    """
+    channels = list(channels)
+    uses_ids = mapping.get("tvg-id") == "channel_id"
+    by_id = {channel.channel_id: channel for channel in channels}
+    by_url: Dict[str, deque] = defaultdict(deque)
+    for channel in channels:
+        by_url[channel.source_url].append(channel)
+
+    matched = set()
+    added: List[Entry] = []
+    changed: List[tuple] = []
+    listed = 0
+    for entry in entries:
+        listed += 1
+        row = channel_import.channel_row(entry, mapping)
+        wanted = channel_import.proposed_id(entry, mapping)
+        channel = by_id.get(wanted)
+        if channel is not None and channel.id in matched:
+            channel = None
+        if channel is None:
+            candidates = by_url.get(row["source_url"])
+            while candidates:
+                candidate = candidates.popleft()
+                if candidate.id not in matched:
+                    channel = candidate
+                    break
+        if channel is None:
+            added.append(entry)
+            continue
+        matched.add(channel.id)
+        digest = channel_import.content_hash(row, wanted)
+        if digest != _stored_hash(channel, uses_ids):
+            changed.append((channel, row, digest, entry))
+
+    removed = [channel for channel in channels if channel.id not in matched]
+    return {"added": added, "changed": changed, "removed": removed, "listed": listed}
+
+
+def _spool(chunks: Iterable[bytes], body) -> None:
+    """Write the fetched body to ``body`` so nothing is parsed before the validators and hash were checked."""
+    size = 0
+    for chunk in chunks:
+        size += len(chunk)
+        if size > m3u.MAX_BYTES:
+            raise m3u.M3UParseError(f"Playlist is larger than {m3u.MAX_BYTES} bytes")
+        body.write(chunk)
+
+
+def refresh(source: M3USource, force: bool = False) -> Dict[str, Any]:
+    """Re-fetch ``source.origin_url`` and apply the differences to its channels without committing.
+
+    The request carries the stored ``ETag``/``Last-Modified`` validators, and a
+    body with the same SHA-256 as last time is not parsed at all: the body is
+    spooled to a temporary file while it is hashed and only then streamed
+    through the parser into :func:`diff`. ``force`` skips both checks. Raises
+    ``requests.RequestException`` or ``m3u.M3UParseError``; an empty playlist
+    is refused rather than deleting every channel.
+    """
+    started = time.perf_counter()
+    info: Dict[str, Any] = {}
+    detected: set = set()
+    report: Dict[str, Any] = {"status": "not_modified", "added": 0, "changed": 0, "removed": 0, "channel_ids": []}
+    with tempfile.TemporaryFile() as body:
+        _spool(m3u.fetch(source.origin_url, etag=None if force else source.etag,
+                         last_modified=None if force else source.last_modified, info=info), body)
+        source.refreshed_at = datetime.utcnow()
+        if info.get("status") == 304:
+            return report
+
+        source.etag = info.get("etag")
+        source.last_modified = info.get("last_modified")
+        if not force and source.content_hash and info.get("sha256") == source.content_hash:
+            report["status"] = "unchanged"
+            return report
+
+        mapping = json.loads(source.field_mapping or "{}")
+        current = (db.session.query(Channel.id, Channel.channel_id, Channel.content_hash, *_FIELDS)
+                   .filter(Channel.in_source(source.id)).all())
+        body.seek(0)
+        changes = diff(current, m3u.stream(body, detected), mapping)
+    if not changes["listed"]:
+        raise m3u.M3UParseError("The refreshed playlist has no channels")
+
+    members = {channel.id for channel in current}
+    # Channels other sources list too must not change under them
+    shared = {pk for (pk,) in db.session.query(SourceChannel.channel_pk).filter(
+        SourceChannel.source_id != source.id, SourceChannel.channel_pk.in_(
+            db.select(SourceChannel.channel_pk).where(SourceChannel.source_id == source.id)))}
+    new_hashes = [digest for _, _, digest, _ in changes["changed"]]
+    known: Dict[str, int] = {}
+    for start in range(0, len(new_hashes), CHUNK):
+        known.update((digest, pk) for pk, digest in db.session.query(Channel.id, Channel.content_hash)
+                     .filter(Channel.content_hash.in_(new_hashes[start:start + CHUNK])))
+
+    rewrites: List[Dict[str, Any]] = []
+    unlink = [channel.id for channel in changes["removed"]]
+    link: List[int] = []
+    added: List[Entry] = list(changes["added"])
+    for channel, row, digest, entry in changes["changed"]:
+        if digest in known:
+            # The new content already exists as a channel: point the membership at it
+            unlink.append(channel.id)
+            link.append(known[digest])
+        elif channel.id in shared:
+            unlink.append(channel.id)
+            added.append(entry)
+        else:
+            # Only this source lists the channel, so it keeps its id and changes in place
+            rewrites.append({"id": channel.id, **row, "content_hash": digest})
+            known[digest] = channel.id
+
+    for start in range(0, len(unlink), CHUNK):
+        db.session.execute(delete(SourceChannel).where(SourceChannel.source_id == source.id,
+                                                       SourceChannel.channel_pk.in_(unlink[start:start + CHUNK])))
+    if rewrites:
+        db.session.execute(update(Channel), rewrites)
+    remaining = members.difference(unlink)
+    link = sorted({pk for pk in link if pk not in remaining})
+    if link:
+        db.session.execute(insert(SourceChannel), [{"source_id": source.id, "channel_pk": pk} for pk in link])
+    stats = {"imported": 0, "shared": 0}
+    if added:
+        stats = channel_import.import_channels(added, source.id, mapping, total=len(added))
+    channel_import.remove_orphans(unlink)
+
+    source.content_hash = info.get("sha256")
+    source.detected_attributes = json.dumps(sorted(detected))
+    source.total_channels = SourceChannel.query.filter_by(source_id=source.id).count()
+    report.update(
+        status="updated", added=len(changes["added"]), changed=len(changes["changed"]),
+        removed=len(changes["removed"]), created=stats["imported"], shared=stats["shared"] + len(link),
+        channel_ids=[channel.channel_id for channel, _, _, _ in changes["changed"]]
+        + [channel.channel_id for channel in changes["removed"]],
+        seconds=round(time.perf_counter() - started, 2),
+    )
+    return report
@@ -0,0 +1,162 @@
+"""Persistent SSH/SFTP connections to the streaming server."""
+from __future__ import annotations
+
+import gzip
+import hashlib
+import io
+import logging
+import os
+import shlex
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, Tuple
+
+import paramiko
+
+LOGGER = logging.getLogger(__name__)
+
+_CONNECTIONS: Dict[Tuple[int, str, int, str], "SFTPConnection"] = {}
+_CONNECTIONS_LOCK = threading.Lock()
+
+
+class SFTPConnection:
+    """A long-lived SSH connection with an SFTP channel, reconnected on demand.
+
+    Every use goes through :meth:`session`, which health-checks the transport
+    and reconnects when the server dropped it. Access is serialized with a lock
+    because a paramiko SFTP channel must not be shared between threads.
+    """
+
+    def __init__(self, host: str, username: str, password: str, port: int = 22,
+                 timeout: float = 15, keepalive: int = 30):
+        self.host = host
+        self.username = username
+        self.password = password
+        self.port = port
+        self.timeout = timeout
+        self.keepalive = keepalive
+        self._ssh: paramiko.SSHClient | None = None
+        self._sftp: paramiko.SFTPClient | None = None
+        self._lock = threading.RLock()
+        self.connects = 0
+
+    def _healthy(self) -> bool:
+        if self._ssh is None or self._sftp is None:
+            return False
+        transport = self._ssh.get_transport()
+        if transport is None or not transport.is_active():
+            return False
+        try:
+            transport.send_ignore()
+        except Exception:  # noqa: BLE001
+            return False
+        return True
+
+    def _connect(self) -> None:
+        self.close()
+        ssh = paramiko.SSHClient()
+        ssh.set_missing_host_key_policy(paramiko.AutoAddPolicy())
+        ssh.connect(
+            hostname=self.host,
+            username=self.username,
+            password=self.password,
+            port=self.port,
+            timeout=self.timeout,
+        )
+        transport = ssh.get_transport()
+        if transport is not None and self.keepalive:
+            transport.set_keepalive(self.keepalive)
+        self._ssh = ssh
+        self._sftp = ssh.open_sftp()
+        self.connects += 1
+        LOGGER.info("Opened SSH connection to %s@%s", self.username, self.host)
+
+    def close(self) -> None:
+        for handle in (self._sftp, self._ssh):
+            if handle is not None:
+                try:
+                    handle.close()
+                except Exception:  # noqa: BLE001
+                    pass
+        self._ssh = None
+        self._sftp = None
+
+    @contextmanager
+    def session(self, timings: Dict[str, float] | None = None) -> Iterator[Tuple[paramiko.SSHClient, paramiko.SFTPClient]]:
+        """Yield a healthy ``(ssh, sftp)`` pair, recording connect time in ``timings``."""
+        with self._lock:
+            started = time.perf_counter()
+            if not self._healthy():
+                self._connect()
+            if timings is not None:
+                timings["connect"] = timings.get("connect", 0.0) + time.perf_counter() - started
+            try:
+                yield self._ssh, self._sftp
+            except (paramiko.SSHException, OSError, EOFError):
+                # Drop the broken connection so the next caller reconnects
+                self.close()
+                raise
+
+    def run(self, command: str) -> Tuple[int, str, str]:
+        """Run a remote command and return ``(exit status, stdout, stderr)``."""
+        with self.session() as (ssh, _):
+            _, stdout, stderr = ssh.exec_command(command, timeout=self.timeout * 4)
+            status = stdout.channel.recv_exit_status()
+            return status, stdout.read().decode("utf-8", "replace"), stderr.read().decode("utf-8", "replace")
+
+    def upload_atomic(self, data: bytes, remote_path: str, compress: bool = False,
+                      timings: Dict[str, float] | None = None) -> Dict[str, Any]:
+        """Upload ``data`` to a temp path, verify its SHA-256, then rename it into place.
+
+        Readers of ``remote_path`` only ever see the old or the new complete file.
+        With ``compress`` the bytes travel gzip-compressed and are unpacked remotely.
+        """
+        timings = timings if timings is not None else {}
+        checksum = hashlib.sha256(data).hexdigest()
+        tmp_path = f"{remote_path}.tmp-{uuid.uuid4().hex[:12]}"
+        payload = gzip.compress(data, compresslevel=6) if compress else data
+
+        with self.session(timings) as (ssh, sftp):
+            started = time.perf_counter()
+            try:
+                if compress:
+                    sftp.putfo(io.BytesIO(payload), f"{tmp_path}.gz")
+                    command = (f"gzip -dc {shlex.quote(tmp_path + '.gz')} > {shlex.quote(tmp_path)}"
+                               f" && rm -f {shlex.quote(tmp_path + '.gz')} && sha256sum {shlex.quote(tmp_path)}")
+                else:
+                    sftp.putfo(io.BytesIO(payload), tmp_path)
+                    command = f"sha256sum {shlex.quote(tmp_path)}"
+
+                _, stdout, stderr = ssh.exec_command(command, timeout=self.timeout * 4)
+                status = stdout.channel.recv_exit_status()
+                output = stdout.read().decode("utf-8", "replace").strip()
+                if status != 0:
+                    raise IOError(f"Remote verification failed: {stderr.read().decode('utf-8', 'replace').strip()}")
+                remote_checksum = output.split()[0] if output else ""
+                if remote_checksum != checksum:
+                    raise IOError(f"Checksum mismatch for {remote_path}: {remote_checksum} != {checksum}")
+
+                sftp.posix_rename(tmp_path, remote_path)
+            except Exception:
+                try:
+                    sftp.remove(tmp_path)
+                except Exception:  # noqa: BLE001
+                    pass
+                raise
+            finally:
+                timings["upload"] = timings.get("upload", 0.0) + time.perf_counter() - started
+
+        return {"sha256": checksum, "bytes": len(data), "transferred": len(payload)}
+
+
+def get_connection(host: str, username: str, password: str, port: int = 22) -> SFTPConnection:
+    """Return this process's shared connection for a host, creating it lazily."""
+    key = (os.getpid(), host, port, username)
+    with _CONNECTIONS_LOCK:
+        connection = _CONNECTIONS.get(key)
+        if connection is None or connection.password != password:
+            connection = SFTPConnection(host, username, password, port=port)
+            _CONNECTIONS[key] = connection
+        return connection
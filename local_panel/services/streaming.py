@@ -1,16 +1,124 @@
 """Integration helpers for the remote streaming server."""
 from __future__ import annotations
 
+import hashlib
+import json as jsonlib
 import logging
 import os
-from typing import Dict, Tuple, Any
+import shlex
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timezone
+from email.utils import parsedate_to_datetime
+from typing import Any, Callable, Dict, Iterable, List, Tuple
 
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from .ssh import get_connection
 
 LOGGER = logging.getLogger(__name__)
 
+CHANNELS_REMOTE_PATH = "/opt/streamapp/channels.txt"
+PATCH_REMOTE_PATH = "/opt/streamapp/channels.patch"
+USERS_SNAPSHOT_REMOTE_PATH = "/opt/streamapp/users.snap"
+# Catalogs staged ahead of a source switch, one file per source
+CATALOGS_REMOTE_DIR = "/opt/streamapp/catalogs"
+# Above this share of changed entries a full upload is cheaper than a patch
+DELTA_MAX_RATIO = 0.5
+
+# Read from the environment once per process; a restart picks up changes
+_CONFIG_CACHE: Dict[str, Any] | None = None
+_SESSION: requests.Session | None = None
+_SESSION_PID: int | None = None
+_SESSION_LOCK = threading.Lock()
+_STATS_LOCK = threading.Lock()
+_STATS: Dict[str, Any] = {"requests": 0, "errors": 0, "total_ms": 0.0, "max_ms": 0.0, "last_ms": 0.0}
+
+# A target that failed this many calls in a row is skipped for CIRCUIT_COOLDOWN seconds
+CIRCUIT_FAILURES = 3
+CIRCUIT_COOLDOWN = 30
+_HEALTH: Dict[str, Dict[str, Any]] = {}
+_HEALTH_LOCK = threading.Lock()
+_EXECUTOR: ThreadPoolExecutor | None = None
+_EXECUTOR_PID: int | None = None
+
+
+def _int_env(name: str, default: int) -> int:
+    try:
+        value = int(os.environ.get(name, "") or default)
+    except (TypeError, ValueError):
+        return default
+    return value if value >= 0 else default
+
 
 def _config() -> Dict[str, Any]:
+    """Return the cached streaming configuration snapshot."""
+    global _CONFIG_CACHE
+    if _CONFIG_CACHE is None:
+        _CONFIG_CACHE = _read_config()
+    return _CONFIG_CACHE
+
+
+def _target(name: str, base: str, token: str, timeout: float, host: str, user: str, password: str) -> Dict[str, Any]:
+    """Connection details of one streaming server."""
+    return {
+        "name": name,
+        "base": base.strip().rstrip("/"),
+        "token": token.strip(),
+        "timeout": timeout,
+        "ssh_host": host.strip(),
+        "ssh_user": user.strip(),
+        "ssh_pass": password.strip(),
+        "reload_url": f"http://{host}:5001/channels/reload" if host else "",
+        "patch_url": f"http://{host}:5001/channels/patch" if host else "",
+        "switch_url": f"http://{host}:5001/channels/switch" if host else "",
+        "rollback_url": f"http://{host}:5001/channels/rollback" if host else "",
+        "users_reload_url": f"http://{host}:5001/users/reload" if host else "",
+    }
+
+
+def _read_targets(base: str, token: str, timeout: float, host: str, user: str, password: str) -> List[Dict[str, Any]]:
+    """Parse ``STREAMING_TARGETS`` or fall back to the single server from the legacy variables.
+
+    ``STREAMING_TARGETS`` is a JSON list of objects with ``name``, ``base_url``,
+    ``token``, ``ssh_host``, ``ssh_user``, ``ssh_pass`` and ``timeout``; missing
+    token and SSH credentials default to the legacy variables.
+    """
+    raw = (os.environ.get("STREAMING_TARGETS", "") or "").strip()
+    targets: List[Dict[str, Any]] = []
+    if raw:
+        try:
+            items = jsonlib.loads(raw)
+        except ValueError:
+            LOGGER.error("STREAMING_TARGETS is not valid JSON; using the single configured server")
+            items = []
+        for index, item in enumerate(items if isinstance(items, list) else []):
+            if not isinstance(item, dict):
+                continue
+            item_host = str(item.get("ssh_host") or item.get("host") or "")
+            name = str(item.get("name") or item_host or item.get("base_url") or f"target{index + 1}")
+            if any(target["name"] == name for target in targets):
+                name = f"{name}-{index + 1}"
+            try:
+                item_timeout = float(item.get("timeout") or timeout)
+            except (TypeError, ValueError):
+                item_timeout = timeout
+            targets.append(_target(
+                name,
+                str(item.get("base_url") or ""),
+                str(item.get("token") or token),
+                item_timeout if item_timeout > 0 else timeout,
+                item_host,
+                str(item.get("ssh_user") or user),
+                str(item.get("ssh_pass") or password),
+            ))
+    return targets or [_target(host or "primary", base, token, timeout, host, user, password)]
+
+
+def _read_config() -> Dict[str, Any]:
     """Return streaming API configuration derived from environment variables."""
     base = (os.environ.get("STREAMING_API_BASE_URL", "") or "").strip()
     if base.endswith("/"):
@@ -21,12 +129,13 @@ def _config() -> Dict[str, Any]:
         timeout = int(timeout_raw)
     except (TypeError, ValueError):
         timeout = 10
-    
+    timeout = timeout if timeout > 0 else 10
+
     # New SSH and reload config
     host = (os.environ.get("STREAM_SERVER_IP", "") or "").strip()
     user = (os.environ.get("STREAMING_SERVER_USER", "") or "").strip()
     password = (os.environ.get("STREAMING_SERVER_PASS", "") or "").strip()
-    reload_url = f"http://{host}:5001/channels/reload" if host else ""
+    targets = _read_targets(base, token, timeout, host, user, password)
 
     user_endpoint = (os.environ.get("STREAMING_API_USER_ENDPOINT", "/api/users") or "/api/users").strip()
     channel_endpoint = (os.environ.get("STREAMING_API_CHANNEL_ENDPOINT", "/api/channels") or "/api/channels").strip()
@@ -35,36 +144,79 @@ def _config() -> Dict[str, Any]:
     if not channel_endpoint.startswith("/"):
         channel_endpoint = f"/{channel_endpoint}"
     return {
-        "base": base,
-        "token": token,
-        "timeout": timeout if timeout > 0 else 10,
+        # The first target doubles as the primary server (catalog pulls, legacy callers)
+        **targets[0],
+        "targets": targets,
         "user_endpoint": user_endpoint.rstrip("/"),
         "channel_endpoint": channel_endpoint.rstrip("/"),
-        "ssh_host": host,
-        "ssh_user": user,
-        "ssh_pass": password,
-        "reload_url": reload_url,
+        "pool_size": _int_env("STREAMING_API_POOL_SIZE", 10) or 10,
+        "retries": _int_env("STREAMING_API_RETRIES", 2),
+        "sync_gzip": (os.environ.get("STREAMING_SYNC_GZIP", "") or "").strip().lower() in ("1", "true", "yes"),
     }
 
 
-def _request(method: str, path: str, *, json: Dict[str, Any] | None = None, params: Dict[str, Any] | None = None) -> Tuple[bool, Any]:
-    """Perform an authenticated HTTP request against the streaming API."""
-    cfg = _config()
+def _session() -> requests.Session:
+    """Return this process's keep-alive session, creating it after a fork."""
+    global _SESSION, _SESSION_PID
+    pid = os.getpid()
+    if _SESSION is not None and _SESSION_PID == pid:
+        return _SESSION
+    with _SESSION_LOCK:
+        if _SESSION is None or _SESSION_PID != pid:
+            cfg = _config()
+            # Only idempotent methods are retried; a POST may already have been applied
+            retry = Retry(
+                total=cfg["retries"],
+                backoff_factor=0.3,
+                status_forcelist=(502, 503, 504),
+                allowed_methods=frozenset({"GET", "PUT", "DELETE", "HEAD", "OPTIONS"}),
+                raise_on_status=False,
+            )
+            adapter = HTTPAdapter(pool_connections=max(4, len(cfg["targets"])), pool_maxsize=cfg["pool_size"],
+                                  max_retries=retry)
+            session = requests.Session()
+            session.mount("http://", adapter)
+            session.mount("https://", adapter)
+            _SESSION, _SESSION_PID = session, pid
+    return _SESSION
+
+
+def _record_latency(elapsed_ms: float, failed: bool) -> None:
+    with _STATS_LOCK:
+        _STATS["requests"] += 1
+        _STATS["errors"] += int(failed)
+        _STATS["total_ms"] += elapsed_ms
+        _STATS["last_ms"] = elapsed_ms
+        _STATS["max_ms"] = max(_STATS["max_ms"], elapsed_ms)
+
+
+def _request(method: str, path: str, *, json: Dict[str, Any] | None = None, params: Dict[str, Any] | None = None,
+             headers: Dict[str, str] | None = None, raw: bool = False,
+             target: Dict[str, Any] | None = None, allow_status: Tuple[int, ...] = ()) -> Tuple[bool, Any]:
+    """Perform an authenticated HTTP request against the streaming API.
+
+    ``target`` selects the server (default: the primary one). With ``raw`` the
+    successful ``requests.Response`` is returned instead of its body. Error
+    statuses in ``allow_status`` count as success and return the response,
+    so the caller can tell them apart.
+    """
+    cfg = target or _config()
     if not cfg["base"] or not cfg["token"]:
-        # If using file-based sync, we might not have the base API configured, which is fine.
-        if "reload" in path:
-             pass
-        else:
+        # File-based sync calls the absolute control URLs, which need no API base.
+        if not path.startswith("http"):
             return True, "Streaming API not configured"
 
     url = path if path.startswith('http') else f'{cfg["base"]}{path}'
     headers = {
         "Authorization": f'Bearer {cfg["token"]}',
         "Content-Type": "application/json",
+        **(headers or {}),
     }
 
+    started = time.perf_counter()
+    failed = True
     try:
-        response = requests.request(
+        response = _session().request(
             method,
             url,
             json=json,
@@ -72,60 +224,330 @@ def _request(method: str, path: str, *, json: Dict[str, Any] | None = None, para
             timeout=cfg["timeout"],
             headers=headers,
         )
+        if response.status_code in allow_status:
+            failed = False
+            return True, response
         response.raise_for_status()
+        failed = False
+        if raw:
+            return True, response
         if response.content and "application/json" in response.headers.get("Content-Type", ""):
             return True, response.json()
         return True, response.text or "ok"
     except Exception as exc:  # noqa: BLE001
         LOGGER.exception("Streaming API request failed: %s %s", method, url)
         return False, str(exc)
+    finally:
+        _record_latency((time.perf_counter() - started) * 1000, failed)
+
+
+def _channel_line(channel) -> str:
+    """Render one channel as a pipe-delimited channels.txt line."""
+    fields = [
+        str(channel.channel_id or ''),
+        str(channel.name or ''),
+        str(channel.source_url or ''),
+        str(channel.logo_url or ''),
+        str(channel.category or 'General'),
+        str(channel.quality or 'medium'),
+        str(getattr(channel, 'order', '')),
+        str(getattr(channel, 'category_order', '')),
+    ]
+    return "|".join(fields)
+
+
+def _line_digest(line: str) -> str:
+    return hashlib.sha1(line.encode("utf-8")).hexdigest()[:16]
+
+
+def _manifest_digest(entries: Dict[str, str]) -> str:
+    digest = hashlib.sha256()
+    for channel_id in sorted(entries):
+        digest.update(f"{channel_id}:{entries[channel_id]}\n".encode("utf-8"))
+    return digest.hexdigest()
+
+
+def _catalog(channels) -> Tuple[Dict[str, str], Dict[str, str], str]:
+    """Catalog lines by channel id, their line hashes and the manifest digest of the whole catalog."""
+    lines = {}
+    for channel in channels:
+        line = _channel_line(channel)
+        lines[line.split("|", 1)[0]] = line
+    entries = {channel_id: _line_digest(line) for channel_id, line in lines.items()}
+    return lines, entries, _manifest_digest(entries)
+
+
+def _catalog_path(name: str) -> str:
+    return f"{CATALOGS_REMOTE_DIR}/{name}.txt"
+
+
+def _upload_bytes(target: Dict[str, Any], data: bytes, remote_path: str,
+                  timings: Dict[str, float] | None = None) -> Dict[str, Any]:
+    """Atomically upload a file to a streaming server over its shared SFTP connection."""
+    connection = get_connection(target["ssh_host"], target["ssh_user"], target["ssh_pass"])
+    return connection.upload_atomic(data, remote_path, compress=_config()["sync_gzip"], timings=timings)
+
+
+def _upload_text(target: Dict[str, Any], content: str, remote_path: str,
+                 timings: Dict[str, float] | None = None) -> Dict[str, Any]:
+    return _upload_bytes(target, content.encode("utf-8"), remote_path, timings)
+
+
+def _health_record(name: str, ok: bool, elapsed_ms: float, error: Any = None) -> None:
+    now = time.time()
+    with _HEALTH_LOCK:
+        health = _HEALTH.setdefault(name, {"calls": 0, "failures": 0, "consecutive_failures": 0})
+        health["calls"] += 1
+        health["last_ms"] = round(elapsed_ms, 1)
+        if ok:
+            health.update(healthy=True, consecutive_failures=0, last_success_at=now)
+        else:
+            health["failures"] += 1
+            health["consecutive_failures"] += 1
+            health.update(healthy=False, last_failure_at=now, last_error=str(error)[:300])
+
+
+def _circuit_open(name: str) -> bool:
+    with _HEALTH_LOCK:
+        health = _HEALTH.get(name)
+        return bool(health and health["consecutive_failures"] >= CIRCUIT_FAILURES
+                    and time.time() - health.get("last_failure_at", 0) < CIRCUIT_COOLDOWN)
+
+
+def _executor() -> ThreadPoolExecutor:
+    global _EXECUTOR, _EXECUTOR_PID
+    with _SESSION_LOCK:
+        if _EXECUTOR is None or _EXECUTOR_PID != os.getpid():
+            workers = max(2, len(_config()["targets"]))
+            _EXECUTOR = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="streaming-fanout")
+            _EXECUTOR_PID = os.getpid()
+        return _EXECUTOR
+
+
+def _select_targets(names: Iterable[str] | None = None) -> List[Dict[str, Any]]:
+    targets = _config()["targets"]
+    if names is None:
+        return list(targets)
+    wanted = set(names)
+    return [target for target in targets if target["name"] in wanted]
+
+
+def _call(target: Dict[str, Any], fn: Callable[[Dict[str, Any]], Tuple[bool, Any]],
+          skipped: Callable[[Dict[str, Any], str], Any] | None) -> Tuple[bool, Any]:
+    name = target["name"]
+    if _circuit_open(name):
+        message = f"{name} skipped after {CIRCUIT_FAILURES} consecutive failures"
+        return False, skipped(target, message) if skipped else message
+    started = time.perf_counter()
+    try:
+        ok, value = fn(target)
+    except Exception as exc:  # noqa: BLE001
+        LOGGER.exception("Streaming call to %s raised", name)
+        ok, value = False, skipped(target, str(exc)) if skipped else str(exc)
+    _health_record(name, ok, (time.perf_counter() - started) * 1000, None if ok else value)
+    return ok, value
+
+
+def _fan_out(fn: Callable[[Dict[str, Any]], Tuple[bool, Any]], targets: Iterable[str] | None = None,
+             skipped: Callable[[Dict[str, Any], str], Any] | None = None) -> Dict[str, Tuple[bool, Any]]:
+    """Run ``fn(target)`` on every selected server concurrently.
+
+    Each call is bounded by its own server's timeout, so a slow server only delays
+    its own result. ``skipped(target, message)`` builds the value for a server whose
+    circuit is open or whose call raised.
+    """
+    selected = _select_targets(targets)
+    if len(selected) == 1:
+        return {selected[0]["name"]: _call(selected[0], fn, skipped)}
+    futures = [(target["name"], _executor().submit(_call, target, fn, skipped)) for target in selected]
+    return {name: future.result() for name, future in futures}
+
+
+def _combine(results: Dict[str, Tuple[bool, Any]]) -> Tuple[bool, Any]:
+    """Collapse per-server results; a single server keeps its plain ``(success, detail)``."""
+    if len(results) == 1:
+        return next(iter(results.values()))
+    if not results:
+        return False, "No matching streaming targets"
+    failed = [name for name, (ok, _) in results.items() if not ok]
+    return not failed, {
+        "targets": {name: {"success": ok, "detail": detail} for name, (ok, detail) in results.items()},
+        "failed": failed,
+    }
+
+
+def _timed_request(timings: Dict[str, float], method: str, path: str, **kwargs) -> Tuple[bool, Any]:
+    started = time.perf_counter()
+    try:
+        return _request(method, path, **kwargs)
+    finally:
+        timings["reload"] = timings.get("reload", 0.0) + time.perf_counter() - started
+
+
+def _format_timings(timings: Dict[str, float]) -> Dict[str, float]:
+    return {phase: round(seconds * 1000, 1) for phase, seconds in timings.items()}
+
+
+def _user_payload(user, plain_password: str | None = None) -> Dict[str, Any]:
+    """Build the JSON body describing a subscriber for the streaming API."""
+    payload = {
+        "username": user.username,
+        "token": user.token,
+        "email": getattr(user, "email", ""),
+        "max_connections": getattr(user, "max_connections", 1),
+        "is_active": getattr(user, "is_active", True),
+        "expires_at": getattr(user, "expiry_date", None).isoformat() if getattr(user, "expiry_date", None) else None,
+    }
+
+    # Add password - use provided plain_password or user.password from database
+    password_to_use = plain_password or getattr(user, "password", None)
+    if password_to_use:
+        payload["password"] = password_to_use
+    return payload
 
 
 class StreamingService:
-    """Operations for syncing subscribers and channels to the streaming backend."""
+    """Operations for syncing subscribers and channels to the streaming backend.
+
+    Write operations go to every configured target concurrently (or to the
+    ``targets`` named by the caller); reads use the primary server.
+    """
 
     @staticmethod
     def is_configured() -> bool:
-        cfg = _config()
         # Consider it configured if either the API or the SSH details are present
-        return bool(cfg["base"] and cfg["token"]) or bool(cfg["ssh_host"] and cfg["ssh_user"] and cfg["ssh_pass"])
+        return any(
+            bool(target["base"] and target["token"]) or bool(target["ssh_host"] and target["ssh_user"] and target["ssh_pass"])
+            for target in _config()["targets"]
+        )
+
+    @staticmethod
+    def file_sync_targets() -> List[str]:
+        """Names of the targets with the SSH details needed to upload files."""
+        return [target["name"] for target in _config()["targets"]
+                if target["ssh_host"] and target["ssh_user"] and target["ssh_pass"]]
+
+    @staticmethod
+    def file_sync_configured() -> bool:
+        """Whether every target has the SSH details needed to upload, stage and switch catalog files."""
+        names = StreamingService.file_sync_targets()
+        return bool(names) and len(names) == len(_config()["targets"])
+
+    @staticmethod
+    def target_names() -> List[str]:
+        return [target["name"] for target in _config()["targets"]]
 
     @staticmethod
-    def sync_user(user, action: str, plain_password: str | None = None) -> Tuple[bool, Any]:
-        """Create, update, or delete a user on the streaming server.
+    def target_health() -> Dict[str, Dict[str, Any]]:
+        """Per-server call counters and last outcome for this worker process."""
+        with _HEALTH_LOCK:
+            health = {name: dict(values) for name, values in _HEALTH.items()}
+        for name in StreamingService.target_names():
+            health.setdefault(name, {"calls": 0, "failures": 0, "consecutive_failures": 0})
+            health[name]["circuit_open"] = _circuit_open(name)
+        return health
+
+    @staticmethod
+    def failed_targets(detail: Any) -> List[str]:
+        """Names of the servers that failed in a fanned-out ``detail`` (empty for one server)."""
+        if isinstance(detail, dict) and isinstance(detail.get("failed"), list):
+            return list(detail["failed"])
+        return []
+
+    @staticmethod
+    def pool_stats() -> Dict[str, Any]:
+        """Connection reuse and latency counters for this worker process."""
+        new_connections = 0
+        pooled_requests = 0
+        session = _SESSION if _SESSION_PID == os.getpid() else None
+        if session is not None:
+            for adapter in set(session.adapters.values()):
+                pools = adapter.poolmanager.pools
+                for key in list(pools.keys()):
+                    pool = pools.get(key)
+                    if pool is not None:
+                        new_connections += pool.num_connections
+                        pooled_requests += pool.num_requests
+        with _STATS_LOCK:
+            stats = dict(_STATS)
+        stats["avg_ms"] = round(stats["total_ms"] / stats["requests"], 2) if stats["requests"] else 0.0
+        stats.update(
+            pid=os.getpid(),
+            new_connections=new_connections,
+            reused_connections=max(0, pooled_requests - new_connections),
+            pool_size=_config()["pool_size"],
+            targets=StreamingService.target_health(),
+        )
+        return stats
+
+    @staticmethod
+    def sync_user(user, action: str, plain_password: str | None = None,
+                  targets: Iterable[str] | None = None) -> Tuple[bool, Any]:
+        """Create, update, or delete a user on the streaming servers.
 
         Args:
             user: User model instance
             action: 'create', 'update', or 'delete'
             plain_password: Plain text password (optional, uses user.password if not provided)
+            targets: Server names to limit the call to (default: all)
         """
         cfg = _config()
         endpoint = cfg["user_endpoint"]
-        payload = {
-            "username": user.username,
-            "token": user.token,
-            "email": getattr(user, "email", ""),
-            "max_connections": getattr(user, "max_connections", 1),
-            "is_active": getattr(user, "is_active", True),
-            "expires_at": getattr(user, "expiry_date", None).isoformat() if getattr(user, "expiry_date", None) else None,
-        }
-
-        # Add password - use provided plain_password or user.password from database
-        password_to_use = plain_password or getattr(user, "password", None)
-        if password_to_use:
-            payload["password"] = password_to_use
+        payload = _user_payload(user, plain_password)
 
         if action == "create":
-            return _request("POST", endpoint, json=payload)
-        if action == "update":
-            return _request("PUT", f"{endpoint}/{user.username}", json=payload)
+            call = lambda target: _request("POST", endpoint, json=payload, target=target)
+        elif action == "update":
+            call = lambda target: _request("PUT", f"{endpoint}/{user.username}", json=payload, target=target)
+        elif action == "delete":
+            call = lambda target: _request("DELETE", f"{endpoint}/{user.username}", target=target)
+        else:
+            return False, f"Unsupported user sync action: {action}"
+        return _combine(_fan_out(call, targets))
+
+    @staticmethod
+    def sync_users_bulk(users, action: str, targets: Iterable[str] | None = None) -> Tuple[bool, Any]:
+        """Apply the same action to many users with a single streaming API call per server.
+
+        The payload is posted to ``<user endpoint>/bulk``. Servers may answer with
+        ``{"results": [{"username": ..., "success": ..., "error": ...}]}`` to report
+        per-user outcomes; otherwise the overall status applies to every user. With
+        several servers a user only counts as synced when every server accepted it.
+        """
+        if action not in ("create", "update", "delete"):
+            return False, f"Unsupported user sync action: {action}"
+        users = list(users)
+        if not users:
+            return True, "No users to sync"
+
+        cfg = _config()
         if action == "delete":
-            return _request("DELETE", f"{endpoint}/{user.username}")
-        return False, f"Unsupported user sync action: {action}"
+            entries = [{"username": user.username, "token": user.token} for user in users]
+        else:
+            entries = [_user_payload(user) for user in users]
+        results = _fan_out(
+            lambda target: _request("POST", f'{cfg["user_endpoint"]}/bulk',
+                                    json={"action": action, "users": entries}, target=target),
+            targets,
+        )
+        success, detail = _combine(results)
+        if len(results) > 1:
+            merged = {user.username: {"username": user.username, "success": True, "error": None} for user in users}
+            for name, (ok, target_detail) in results.items():
+                per_user = {}
+                if ok and isinstance(target_detail, dict) and isinstance(target_detail.get("results"), list):
+                    per_user = {item.get("username"): item for item in target_detail["results"] if isinstance(item, dict)}
+                for username, outcome in merged.items():
+                    item = per_user.get(username)
+                    if not ok or (item is not None and not item.get("success", True)):
+                        outcome["success"] = False
+                        outcome["error"] = f'{name}: {(item or {}).get("error") or ("rejected" if item else target_detail)}'
+            detail["results"] = list(merged.values())
+        return success, detail
 
     @staticmethod
-    def sync_channel(channel, action: str) -> Tuple[bool, Any]:
-        """Create, update, or delete a channel definition on the streaming server."""
+    def sync_channel(channel, action: str, targets: Iterable[str] | None = None) -> Tuple[bool, Any]:
+        """Create, update, or delete a channel definition on the streaming servers."""
         cfg = _config()
         endpoint = cfg["channel_endpoint"]
         payload = {
@@ -136,19 +558,21 @@ class StreamingService:
             "logo_url": getattr(channel, "logo_url", ""),
             "is_active": getattr(channel, "is_active", True),
             "quality": getattr(channel, "quality", "medium"),
-        }
+        } if action != "delete" else None
 
         if action == "create":
-            return _request("POST", endpoint, json=payload)
-        if action == "update":
-            return _request("PUT", f"{endpoint}/{channel.channel_id}", json=payload)
-        if action == "delete":
-            return _request("DELETE", f"{endpoint}/{channel.channel_id}")
-        return False, f"Unsupported channel sync action: {action}"
+            call = lambda target: _request("POST", endpoint, json=payload, target=target)
+        elif action == "update":
+            call = lambda target: _request("PUT", f"{endpoint}/{channel.channel_id}", json=payload, target=target)
+        elif action == "delete":
+            call = lambda target: _request("DELETE", f"{endpoint}/{channel.channel_id}", target=target)
+        else:
+            return False, f"Unsupported channel sync action: {action}"
+        return _combine(_fan_out(call, targets))
 
     @staticmethod
     def fetch_channels(limit: int | None = None) -> Tuple[bool, Any]:
-        """Retrieve the full channel catalog from the streaming server."""
+        """Retrieve the full channel catalog from the primary streaming server."""
         cfg = _config()
         params: Dict[str, Any] | None = None
         if limit is not None:
@@ -156,64 +580,378 @@ class StreamingService:
         return _request("GET", cfg["channel_endpoint"], params=params)
 
     @staticmethod
-    def sync_channels_via_file(channels, app) -> Tuple[int, int, list]:
+    def fetch_channel_changes(etag: str | None = None, updated_since: str | None = None) -> Tuple[bool, Any, Dict[str, Any]]:
+        """Conditionally fetch the channel catalog, or only what changed since a cursor.
+
+        Sends ``If-None-Match`` and ``updated_since`` when given. Returns
+        ``(success, records, meta)`` where ``meta`` holds ``not_modified``, the new
+        ``etag``, the ``cursor`` reported by the server (if any) and ``server_time``,
+        the naive UTC time from the response's ``Date`` header (if any).
+        """
+        cfg = _config()
+        meta: Dict[str, Any] = {"not_modified": False, "etag": etag, "cursor": None, "server_time": None}
+        if not cfg["base"] or not cfg["token"]:
+            return False, "Streaming API not configured", meta
+
+        params = {"updated_since": updated_since} if updated_since else None
+        headers = {"If-None-Match": etag} if etag else None
+        success, response = _request("GET", cfg["channel_endpoint"], params=params, headers=headers, raw=True)
+        if not success:
+            return False, response, meta
+        if response.status_code == 304:
+            meta["not_modified"] = True
+            return True, [], meta
+
+        meta["etag"] = response.headers.get("ETag")
+        try:
+            meta["server_time"] = parsedate_to_datetime(response.headers["Date"]).astimezone(timezone.utc).replace(tzinfo=None)
+        except (KeyError, TypeError, ValueError):
+            pass
+        try:
+            payload = response.json()
+        except ValueError:
+            return False, "Channel catalog response is not JSON", meta
+
+        records = payload
+        if isinstance(payload, dict):
+            records = payload.get("channels") or []
+            meta["cursor"] = payload.get("cursor") or payload.get("next_cursor")
+        if not isinstance(records, list):
+            return False, f"Channel sync payload unexpected: {type(payload)}", meta
+        return True, records, meta
+
+    @staticmethod
+    def _digest_endpoint(kind: str) -> str:
+        cfg = _config()
+        return f'{cfg["user_endpoint"] if kind == "users" else cfg["channel_endpoint"]}/digest'
+
+    @staticmethod
+    def _target(name: str | None) -> Dict[str, Any] | None:
+        if name is None:
+            return _config()
+        matches = _select_targets([name])
+        return matches[0] if matches else None
+
+    @staticmethod
+    def fetch_digests(kind: str, buckets: int, target: str | None = None) -> Tuple[bool, Any]:
+        """Fetch ``{"root", "buckets"}`` digests of a server's users or channels."""
+        cfg = StreamingService._target(target)
+        if not cfg or not cfg["base"] or not cfg["token"]:
+            return False, "Streaming API not configured"
+        success, payload = _request("GET", StreamingService._digest_endpoint(kind), params={"buckets": buckets},
+                                    target=cfg)
+        if success and not isinstance(payload, dict):
+            return False, f"Digest payload unexpected: {type(payload)}"
+        return success, payload
+
+    @staticmethod
+    def fetch_bucket_entries(kind: str, buckets: int, indexes, target: str | None = None) -> Tuple[bool, Any]:
+        """Fetch ``{bucket index: {key: digest}}`` for the given buckets."""
+        cfg = StreamingService._target(target)
+        if not cfg:
+            return False, f"Unknown streaming target: {target}"
+        success, payload = _request("GET", StreamingService._digest_endpoint(kind), params={
+            "buckets": buckets, "bucket": ",".join(str(index) for index in indexes),
+        }, target=cfg)
+        if not success:
+            return False, payload
+        entries = payload.get("entries") if isinstance(payload, dict) else None
+        if not isinstance(entries, dict):
+            return False, f"Bucket entries payload unexpected: {type(payload)}"
+        return True, entries
+
+    @staticmethod
+    def sync_channels_via_file(channels, app, targets: Iterable[str] | None = None) -> Tuple[int, int, list]:
         """
         Syncs channels by generating a channels.txt file, uploading it via SFTP,
-        and triggering a reload on the streaming server.
+        and triggering a reload on the streaming servers.
         """
-        import io
-        import paramiko
+        success_count, failure_count, failed_ids, _ = StreamingService._sync_full(channels, targets)
+        return success_count, failure_count, failed_ids
 
-        cfg = _config()
-        if not all([cfg["ssh_host"], cfg["ssh_user"], cfg["ssh_pass"], cfg["reload_url"]]):
-            return 0, len(channels), [getattr(c, 'channel_id', 'unknown') for c in channels]
-
-        content = ""
-        for channel in channels:
-            fields = [
-                str(channel.channel_id or ''),
-                str(channel.name or ''),
-                str(channel.source_url or ''),
-                str(channel.logo_url or ''),
-                str(channel.category or 'General'),
-                str(channel.quality or 'medium'),
-                str(getattr(channel, 'order', '')),
-                str(getattr(channel, 'category_order', '')),
-            ]
-            content += "|".join(fields) + "\n"
+    @staticmethod
+    def _sync_full(channels, targets: Iterable[str] | None = None) -> Tuple[int, int, list, Dict[str, Any]]:
+        """Full channels.txt upload plus reload on every target; also returns timings in ms.
+
+        Timings are per phase for one server and ``{server: phases}`` for several.
+        """
+        content = "".join(_channel_line(channel) + "\n" for channel in channels)
+        results = _fan_out(
+            lambda target: _ok_when_synced(StreamingService._sync_full_one(target, channels, content)),
+            targets,
+            skipped=lambda target, message: _all_failed(channels, {}),
+        )
+        success_count, failure_count, failed_ids, reports = _merge_channel_results(results)
+        timings = next(iter(reports.values())) if len(reports) == 1 else reports
+        return success_count, failure_count, failed_ids, timings
+
+    @staticmethod
+    def _sync_full_one(target: Dict[str, Any], channels, content: str) -> Tuple[int, int, list, Dict[str, float]]:
+        timings: Dict[str, float] = {}
+        if not all([target["ssh_host"], target["ssh_user"], target["ssh_pass"], target["reload_url"]]):
+            return _all_failed(channels, timings)
 
         try:
-            # Use an in-memory file-like object
-            with io.StringIO(content) as file_obj:
-                # Establish SSH connection
-                with paramiko.SSHClient() as ssh:
-                    ssh.set_missing_host_key_policy(paramiko.AutoAddPolicy())
-                    ssh.connect(
-                        hostname=cfg["ssh_host"],
-                        username=cfg["ssh_user"],
-                        password=cfg["ssh_pass"],
-                        port=22,
-                        timeout=15
-                    )
-
-                    # Upload the file via SFTP
-                    with ssh.open_sftp() as sftp:
-                        remote_path = "/opt/streamapp/channels.txt"
-                        sftp.putfo(file_obj, remote_path)
+            _upload_text(target, content, CHANNELS_REMOTE_PATH, timings)
 
             # Trigger the reload endpoint
-            success, detail = _request("POST", cfg["reload_url"])
+            success, detail = _timed_request(timings, "POST", target["reload_url"], target=target)
             if not success:
                 raise Exception(f"Reload endpoint failed: {detail}")
+            LOGGER.info("Full channel sync of %s channels to %s: %s ms", len(channels), target["name"],
+                        _format_timings(timings))
 
             # The response from the reload endpoint might contain the count
             if isinstance(detail, dict) and 'count' in detail:
                 success_count = detail['count']
                 failure_count = len(channels) - success_count
-                return success_count, failure_count, []
-            
-            return len(channels), 0, []
+                return success_count, failure_count, [], _format_timings(timings)
+
+            return len(channels), 0, [], _format_timings(timings)
 
         except Exception as e:
-            LOGGER.exception("File-based channel sync failed.")
-            return 0, len(channels), [getattr(c, 'channel_id', 'unknown') for c in channels]
+            LOGGER.exception("File-based channel sync to %s failed.", target["name"])
+            return _all_failed(channels, _format_timings(timings))
+
+    @staticmethod
+    def sync_channels_delta(channels, manifests: Dict[str, Any] | None,
+                            targets: Iterable[str] | None = None) -> Tuple[int, int, list, Dict[str, Any]]:
+        """Push only the channel lines that changed since the last sync, per server.
+
+        ``manifests`` maps server names to what the previous sync returned in
+        ``report["manifests"]`` (per-channel line hashes plus an overall digest).
+        Added/changed lines and removed ids are uploaded as ``channels.patch`` and
+        applied through the incremental reload endpoint, which must reject the
+        patch when its base digest differs from the catalog it holds. A full
+        channels.txt upload is used when there is no valid manifest, the patch is
+        rejected, or the delta is too large to be worth it. Servers are synced
+        concurrently; the caller persists ``report["manifests"]``.
+        """
+        lines, entries, digest = _catalog(channels)
+        manifests = manifests or {}
+
+        def skipped(target: Dict[str, Any], message: str):
+            report = {"mode": "skipped", "added": 0, "changed": 0, "removed": 0, "bytes": 0, "timings": {},
+                      "error": message, "manifest": manifests.get(target["name"])}
+            return _all_failed(channels, report)
+
+        results = _fan_out(
+            lambda target: _ok_when_synced(StreamingService._sync_delta_one(
+                target, channels, lines, entries, digest, manifests.get(target["name"]))),
+            targets,
+            skipped=skipped,
+        )
+
+        success_count, failure_count, failed_ids, reports = _merge_channel_results(results)
+        new_manifests = {name: report.pop("manifest", None) for name, report in reports.items()}
+        if len(reports) == 1:
+            report = next(iter(reports.values()))
+        else:
+            modes = {report["mode"] for report in reports.values()}
+            first = next(iter(reports.values()), {})
+            report = {
+                "mode": modes.pop() if len(modes) == 1 else "mixed",
+                "added": first.get("added", 0), "changed": first.get("changed", 0), "removed": first.get("removed", 0),
+                "bytes": sum(item["bytes"] for item in reports.values()),
+                "timings": {name: item["timings"] for name, item in reports.items()},
+                "targets": reports,
+            }
+        report["manifests"] = new_manifests
+        return success_count, failure_count, failed_ids, report
+
+    @staticmethod
+    def _sync_delta_one(target: Dict[str, Any], channels, lines: Dict[str, str], entries: Dict[str, str],
+                        target_digest: str, manifest: Dict[str, Any] | None) -> Tuple[int, int, list, Dict[str, Any]]:
+        report: Dict[str, Any] = {"mode": "noop", "added": 0, "changed": 0, "removed": 0, "bytes": 0,
+                                  "timings": {}, "manifest": {"digest": target_digest, "entries": entries}}
+
+        previous = (manifest or {}).get("entries")
+        base = (manifest or {}).get("digest")
+        valid = isinstance(previous, dict) and base == _manifest_digest(previous)
+
+        if valid:
+            added = [cid for cid in entries if cid not in previous]
+            changed = [cid for cid in entries if cid in previous and previous[cid] != entries[cid]]
+            removed = [cid for cid in previous if cid not in entries]
+            report.update(added=len(added), changed=len(changed), removed=len(removed))
+            if base == target_digest:
+                return len(channels), 0, [], report
+
+            delta_size = len(added) + len(changed) + len(removed)
+            if delta_size <= max(len(entries), 1) * DELTA_MAX_RATIO:
+                patch = [f"#PATCH base={base} target={target_digest}"]
+                patch.extend(f"+|{lines[cid]}" for cid in added + changed)
+                patch.extend(f"-|{cid}" for cid in removed)
+                content = "\n".join(patch) + "\n"
+                timings: Dict[str, float] = {}
+                try:
+                    _upload_text(target, content, PATCH_REMOTE_PATH, timings)
+                    success, detail = _timed_request(timings, "POST", target["patch_url"], target=target, json={
+                        "base": base, "target": target_digest,
+                        "added": len(added), "changed": len(changed), "removed": len(removed),
+                    })
+                    if not success:
+                        raise Exception(f"Patch endpoint failed: {detail}")
+                    report.update(mode="delta", bytes=len(content.encode("utf-8")), timings=_format_timings(timings))
+                    return len(channels), 0, [], report
+                except Exception:  # noqa: BLE001
+                    LOGGER.warning("Delta channel sync to %s failed, falling back to a full upload",
+                                   target["name"], exc_info=True)
+
+        content = "".join(line + "\n" for line in lines.values())
+        success_count, failure_count, failed_ids, timings = StreamingService._sync_full_one(target, channels, content)
+        report.update(mode="full", bytes=len(content.encode("utf-8")), timings=timings)
+        if failed_ids:
+            # Nothing reached the server; keep the old manifest as the known remote state
+            report["manifest"] = manifest if valid else None
+        return success_count, failure_count, failed_ids, report
+
+    @staticmethod
+    def catalog_manifest(channels) -> Dict[str, Any]:
+        """The manifest ``sync_channels_delta`` records for a server holding exactly ``channels``."""
+        _, entries, digest = _catalog(channels)
+        return {"digest": digest, "entries": entries}
+
+    @staticmethod
+    def stage_catalog(name: str, channels, targets: Iterable[str] | None = None) -> Tuple[bool, Any, Dict[str, Any]]:
+        """Phase one of a catalog switch: upload ``channels`` as ``catalogs/<name>.txt`` without loading it.
+
+        Uses the same atomic SFTP upload as channels.txt, so a server holds
+        either the complete staged file or none. Returns ``(success, detail,
+        staged)`` where ``staged`` maps every server that now holds the file to
+        its manifest ``digest``, file ``sha256`` and channel ``count``.
+        """
+        lines, _, digest = _catalog(channels)
+        content = "".join(line + "\n" for line in lines.values())
+        path = _catalog_path(name)
+
+        def stage(target: Dict[str, Any]) -> Tuple[bool, Any]:
+            if not all([target["ssh_host"], target["ssh_user"], target["ssh_pass"]]):
+                return False, "Streaming server SSH access not configured"
+            connection = get_connection(target["ssh_host"], target["ssh_user"], target["ssh_pass"])
+            status, _, error = connection.run(f"mkdir -p {CATALOGS_REMOTE_DIR}")
+            if status != 0:
+                return False, f"Could not create {CATALOGS_REMOTE_DIR}: {error.strip()}"
+            timings: Dict[str, float] = {}
+            uploaded = _upload_text(target, content, path, timings)
+            LOGGER.info("Staged catalog %s (%s channels) on %s: %s ms", name, len(lines), target["name"],
+                        _format_timings(timings))
+            return True, {"digest": digest, "sha256": uploaded["sha256"], "count": len(lines)}
+
+        results = _fan_out(stage, targets)
+        staged = {name: value for name, (ok, value) in results.items() if ok}
+        success, detail = _combine(results)
+        return success, detail, staged
+
+    @staticmethod
+    def switch_catalog(name: str, staged: Dict[str, Dict[str, Any]],
+                       targets: Iterable[str] | None = None) -> Tuple[bool, Any, List[str], List[str]]:
+        """Phase two: make the staged catalog live on every server at the same time.
+
+        Posts ``catalog`` (the staged path), its manifest ``digest`` and file
+        ``sha256`` to the switch endpoint, which must verify the file, replace
+        channels.txt with a copy of it in one rename (the staged file stays for
+        later switches), keep the catalog it replaced for
+        :meth:`rollback_catalog` and reload. A server without a staged entry
+        in ``staged`` fails. Returns ``(success, detail, switched, unsupported)``
+        with the servers that now serve the new catalog and those that failed
+        because they have no switch endpoint (it answered 404 or 405).
+        """
+        path = _catalog_path(name)
+        unsupported: List[str] = []
+
+        def switch(target: Dict[str, Any]) -> Tuple[bool, Any]:
+            stage = staged.get(target["name"])
+            if not stage:
+                return False, "Catalog not staged"
+            if not target["switch_url"]:
+                return False, "Streaming server switch endpoint not configured"
+            ok, response = _request("POST", target["switch_url"], target=target, raw=True, allow_status=(404, 405),
+                                    json={"catalog": path, "digest": stage["digest"], "sha256": stage["sha256"],
+                                          "count": stage["count"]})
+            if not ok:
+                return False, response
+            if response.status_code in (404, 405):
+                unsupported.append(target["name"])
+                return False, f"Switch endpoint not supported (HTTP {response.status_code})"
+            return True, response.text or "ok"
+
+        results = _fan_out(switch, targets)
+        success, detail = _combine(results)
+        return success, detail, [target for target, (ok, _) in results.items() if ok], sorted(unsupported)
+
+    @staticmethod
+    def rollback_catalog(digest: str, targets: Iterable[str]) -> Tuple[bool, Any]:
+        """Undo :meth:`switch_catalog` on ``targets``.
+
+        The rollback endpoint restores the catalog kept by the last switch,
+        but only while the live catalog still has manifest ``digest``, so a
+        late or repeated rollback cannot undo a newer switch.
+        """
+        targets = list(targets)
+        if not targets:
+            return True, "Nothing to roll back"
+
+        def rollback(target: Dict[str, Any]) -> Tuple[bool, Any]:
+            if not target["rollback_url"]:
+                return False, "Streaming server rollback endpoint not configured"
+            return _request("POST", target["rollback_url"], target=target, json={"digest": digest})
+
+        return _combine(_fan_out(rollback, targets))
+
+    @staticmethod
+    def discard_catalog(name: str, targets: Iterable[str] | None = None) -> Tuple[bool, Any]:
+        """Remove a staged catalog file from the streaming servers."""
+        command = f"rm -f {shlex.quote(_catalog_path(name))}"
+
+        def discard(target: Dict[str, Any]) -> Tuple[bool, Any]:
+            if not all([target["ssh_host"], target["ssh_user"], target["ssh_pass"]]):
+                return False, "Streaming server SSH access not configured"
+            connection = get_connection(target["ssh_host"], target["ssh_user"], target["ssh_pass"])
+            status, _, error = connection.run(command)
+            return status == 0, error.strip() or "Removed"
+
+        return _combine(_fan_out(discard, targets))
+
+    @staticmethod
+    def push_user_snapshot(data: bytes, meta: Dict[str, Any],
+                           targets: Iterable[str] | None = None) -> Tuple[bool, Any, Dict[str, Any]]:
+        """Upload the binary subscriber snapshot and ask the servers to reopen it.
+
+        Travels the same atomic SFTP path as channels.txt; ``meta`` (count,
+        sha256, generated_at) is posted to the users reload endpoint so the
+        server can confirm it mapped the file it was told about.
+        """
+        def push(target: Dict[str, Any]) -> Tuple[bool, Any]:
+            timings: Dict[str, float] = {}
+            if not all([target["ssh_host"], target["ssh_user"], target["ssh_pass"], target["users_reload_url"]]):
+                return False, ("Streaming server SSH access not configured", timings)
+            try:
+                _upload_bytes(target, data, USERS_SNAPSHOT_REMOTE_PATH, timings)
+                success, detail = _timed_request(timings, "POST", target["users_reload_url"], json=meta, target=target)
+            except Exception as exc:  # noqa: BLE001
+                LOGGER.exception("Subscriber snapshot upload to %s failed", target["name"])
+                return False, (str(exc), _format_timings(timings))
+            return success, (detail, _format_timings(timings))
+
+        results = _fan_out(push, targets, skipped=lambda target, message: (message, {}))
+        success, detail = _combine({name: (ok, value[0]) for name, (ok, value) in results.items()})
+        timings = {name: value[1] for name, (ok, value) in results.items()}
+        return success, detail, next(iter(timings.values())) if len(timings) == 1 else timings
+
+
+def _all_failed(channels, report: Any) -> Tuple[int, int, list, Any]:
+    return 0, len(channels), [getattr(c, 'channel_id', 'unknown') for c in channels], report
+
+
+def _ok_when_synced(result: Tuple[int, int, list, Any]) -> Tuple[bool, Tuple[int, int, list, Any]]:
+    return not result[2], result
+
+
+def _merge_channel_results(results: Dict[str, Tuple[bool, Tuple[int, int, list, Any]]]) -> Tuple[int, int, list, Dict[str, Any]]:
+    """Combine per-server channel sync results; a channel failed if it failed anywhere."""
+    success_count = min((value[0] for _, value in results.values()), default=0)
+    failure_count = max((value[1] for _, value in results.values()), default=0)
+    failed_ids = list(dict.fromkeys(cid for _, value in results.values() for cid in value[2]))
+    reports = {name: value[3] for name, (_, value) in results.items()}
+    return success_count, failure_count, failed_ids, reports
@@ -0,0 +1,230 @@
+"""Bulk subscriber import from CSV or NDJSON streams."""
+from __future__ import annotations
+
+import csv
+import json
+import logging
+import os
+import secrets
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import ExitStack
+from datetime import datetime, timedelta, timezone
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Tuple
+
+import bcrypt
+from sqlalchemy import insert
+
+from database.models import db, User
+
+LOGGER = logging.getLogger(__name__)
+
+BATCH_SIZE = 500
+# Batches smaller than this hash their passwords inline; starting worker processes costs more.
+PARALLEL_HASH_THRESHOLD = 32
+FORMATS = ("csv", "ndjson")
+
+
+def _hash_password(password: str) -> str:
+    """bcrypt a password; module level so it can run in a worker process."""
+    return bcrypt.hashpw(password.encode("utf-8"), bcrypt.gensalt()).decode("utf-8")
+
+
+def decode_lines(chunks: Iterable[bytes | str]) -> Iterator[str]:
+    """Turn a stream of byte lines (request body, file object) into text lines."""
+    for chunk in chunks:
+        if isinstance(chunk, bytes):
+            chunk = chunk.decode("utf-8-sig", errors="replace")
+        yield chunk
+
+
+def detect_format(filename: str | None, first_line: str = "") -> str:
+    name = (filename or "").lower()
+    if name.endswith((".ndjson", ".jsonl", ".json")):
+        return "ndjson"
+    if name.endswith(".csv"):
+        return "csv"
+    return "ndjson" if first_line.lstrip().startswith("{") else "csv"
+
+
+def iter_rows(lines: Iterable[str], fmt: str) -> Iterator[Tuple[int, Dict[str, Any] | None, str | None]]:
+    """Yield ``(line_number, row, error)`` for every record in the stream."""
+    if fmt == "csv":
+        reader = csv.DictReader(lines)
+        for row in reader:
+            cleaned = {(key or "").strip().lower(): value for key, value in row.items() if key}
+            yield reader.line_num, cleaned, None
+        return
+
+    for line_number, line in enumerate(lines, 1):
+        if not line.strip():
+            continue
+        try:
+            row = json.loads(line)
+        except json.JSONDecodeError as exc:
+            yield line_number, None, f"Invalid JSON: {exc.msg}"
+            continue
+        if not isinstance(row, dict):
+            yield line_number, None, "Expected a JSON object"
+            continue
+        yield line_number, row, None
+
+
+def _positive_int(value: Any, default: int) -> int:
+    if value in (None, ""):
+        return default
+    number = int(value)
+    if number <= 0:
+        raise ValueError
+    return number
+
+
+def _validate(row: Dict[str, Any], *, default_days: int, default_max_connections: int, token_length: int,
+              usernames: set, tokens: set, batch_usernames: set,
+              batch_tokens: set) -> Tuple[Dict[str, Any] | None, str | None]:
+    """Normalize one input row, mirroring the checks of the single-user API.
+
+    ``usernames`` and ``tokens`` hold committed values; the row's own values are
+    added to the ``batch_*`` sets, which only join them once the batch commits.
+    """
+    username = str(row.get("username") or "").strip()
+    if len(username) < 3:
+        return None, "Username must be at least 3 characters"
+    if len(username) > 50:
+        return None, "Username must be at most 50 characters"
+    if username in usernames or username in batch_usernames:
+        return None, "Username already exists"
+
+    try:
+        days = _positive_int(row.get("days", row.get("expiry_days")), default_days)
+    except (TypeError, ValueError):
+        return None, "Invalid subscription days value"
+    try:
+        max_connections = _positive_int(row.get("max_connections"), default_max_connections)
+    except (TypeError, ValueError):
+        return None, "Invalid max_connections value"
+
+    expiry_date = datetime.utcnow() + timedelta(days=days)
+    expires_raw = str(row.get("expires_at") or row.get("expiry_date") or "").strip()
+    if expires_raw:
+        try:
+            expiry_date = datetime.fromisoformat(expires_raw)
+        except ValueError:
+            return None, "Invalid expires_at value"
+        if expiry_date.tzinfo is not None:
+            expiry_date = expiry_date.astimezone(timezone.utc).replace(tzinfo=None)
+
+    token = str(row.get("token") or "").strip()
+    if token:
+        if len(token) > 64:
+            return None, "Token must be at most 64 characters"
+        if token in tokens or token in batch_tokens:
+            return None, "Token already exists"
+    else:
+        token = secrets.token_hex(token_length // 2)
+        while token in tokens or token in batch_tokens:
+            token = secrets.token_hex(token_length // 2)
+
+    batch_usernames.add(username)
+    batch_tokens.add(token)
+    return {
+        "username": username,
+        "password": str(row.get("password") or "") or secrets.token_urlsafe(12),
+        "email": str(row.get("email") or "").strip()[:100],
+        "notes": str(row.get("notes") or "").strip(),
+        "token": token,
+        "expiry_date": expiry_date,
+        "max_connections": max_connections,
+        "is_active": True,
+        "created_at": datetime.utcnow(),
+    }, None
+
+
+def import_users(lines: Iterable[str], fmt: str, *, default_days: int = 30, default_max_connections: int = 1,
+                 token_length: int = 64, workers: int | None = None, batch_size: int = BATCH_SIZE,
+                 on_batch: Callable[[List[Dict[str, Any]]], None] | None = None) -> Iterator[Dict[str, Any]]:
+    """Stream-import subscribers, yielding progress and per-row error events.
+
+    Existing usernames and tokens are loaded with a single query and checked in
+    memory. Passwords of batches with at least ``PARALLEL_HASH_THRESHOLD`` rows are
+    hashed in a process pool, started on first use; each batch is written with
+    one executemany INSERT and committed. ``on_batch`` receives the committed rows
+    (with their plain passwords) so the caller can sync them to the streaming server.
+    """
+    if fmt not in FORMATS:
+        raise ValueError(f"Unsupported import format: {fmt}")
+
+    usernames: set = set()
+    tokens: set = set()
+    for username, token in db.session.query(User.username, User.token):
+        usernames.add(username)
+        tokens.add(token)
+
+    batch_usernames: set = set()
+    batch_tokens: set = set()
+    stats = {"processed": 0, "created": 0, "failed": 0}
+    pending: List[Dict[str, Any]] = []
+    pool: List[ProcessPoolExecutor] = []
+
+    def hash_passwords(passwords: List[str], stack: ExitStack) -> Iterable[str]:
+        if len(passwords) < PARALLEL_HASH_THRESHOLD:
+            return map(_hash_password, passwords)
+        if not pool:
+            pool.append(stack.enter_context(ProcessPoolExecutor(max_workers=workers)))
+        chunksize = max(1, len(passwords) // ((workers or os.cpu_count() or 1) * 4))
+        return pool[0].map(_hash_password, passwords, chunksize=chunksize)
+
+    def flush(stack: ExitStack) -> List[Dict[str, Any]]:
+        events = []
+        passwords = [row["password"] for row in pending]
+        try:
+            for row, password_hash in zip(pending, hash_passwords(passwords, stack)):
+                row["password_hash"] = password_hash
+            db.session.execute(insert(User), pending)
+            db.session.commit()
+        except Exception as exc:  # noqa: BLE001
+            db.session.rollback()
+            LOGGER.exception("Bulk user import batch failed")
+            stats["failed"] += len(pending)
+            events.append({"event": "error", "line": None, "username": None,
+                           "error": f"Batch of {len(pending)} users failed: {exc}"})
+        else:
+            stats["created"] += len(pending)
+            usernames.update(batch_usernames)
+            tokens.update(batch_tokens)
+            if on_batch:
+                try:
+                    on_batch(list(pending))
+                except Exception:  # noqa: BLE001
+                    LOGGER.exception("Post-import batch hook failed")
+        pending.clear()
+        batch_usernames.clear()
+        batch_tokens.clear()
+        events.append({"event": "progress", **stats})
+        return events
+
+    with ExitStack() as stack:
+        for line_number, row, error in iter_rows(lines, fmt):
+            stats["processed"] += 1
+            if error is None:
+                record, error = _validate(
+                    row,
+                    default_days=default_days,
+                    default_max_connections=default_max_connections,
+                    token_length=token_length,
+                    usernames=usernames,
+                    tokens=tokens,
+                    batch_usernames=batch_usernames,
+                    batch_tokens=batch_tokens,
+                )
+            if error:
+                stats["failed"] += 1
+                yield {"event": "error", "line": line_number, "username": (row or {}).get("username"), "error": error}
+                continue
+            pending.append(record)
+            if len(pending) >= batch_size:
+                yield from flush(stack)
+
+        if pending:
+            yield from flush(stack)
+
+    yield {"event": "done", **stats}